@@ -10,7 +10,7 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
 from app.core.database import Base
 from app.core.config import settings
-from app.models import User, Message, Memory
+from app.models import User, Message, Memory, ConversationSummary
 
 config = context.config
 
@@ -0,0 +1,28 @@
+"""Add memory content hashes for deduplication
+
+Revision ID: 004
+Revises: 003
+Create Date: 2026-10-17
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '004'
+down_revision = '003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Existing rows are hashed by `python -m app.commands.consolidate_memories`
+    op.add_column('memories', sa.Column('content_hash', sa.String(length=64), nullable=True))
+    op.create_index(
+        'ix_memories_user_id_content_hash', 'memories', ['user_id', 'content_hash']
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_memories_user_id_content_hash', 'memories')
+    op.drop_column('memories', 'content_hash')
@@ -0,0 +1,30 @@
+"""Add memory archiving for the per-user memory cap
+
+Revision ID: 005
+Revises: 004
+Create Date: 2026-10-17
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '005'
+down_revision = '004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('memories', sa.Column('archived_at', sa.DateTime(), nullable=True))
+    op.create_index(
+        'ix_memories_user_id_active',
+        'memories',
+        ['user_id', 'importance'],
+        postgresql_where=sa.text('archived_at IS NULL'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_memories_user_id_active', 'memories')
+    op.drop_column('memories', 'archived_at')
@@ -0,0 +1,33 @@
+"""Add a (user_id, created_at, id) index for keyset pagination of messages
+
+Revision ID: 006
+Revises: 005
+Create Date: 2026-10-17
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '006'
+down_revision = '005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Built concurrently so existing message tables stay writable
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_messages_user_id_created_at_id',
+            'messages',
+            ['user_id', sa.text('created_at DESC'), sa.text('id DESC')],
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_messages_user_id_created_at_id', 'messages', postgresql_concurrently=True
+        )
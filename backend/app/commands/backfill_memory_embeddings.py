@@ -0,0 +1,66 @@
+"""Embed memories stored without an embedding.
+
+Usage:
+    python -m app.commands.backfill_memory_embeddings [--batch-size 256] [--all]
+
+Uses the configured ``MEMORY_EMBEDDING_MODEL``. Memories without an embedding
+are otherwise embedded by a ``memories.embed`` task queued the first time they
+are ranked, one user at a time; run this after deploying embeddings to embed
+them all at once, and with ``--all`` after switching to a different embedding
+model.
+"""
+import argparse
+from app.core.database import SessionLocal
+from app.models.memory import Memory
+from app.services.embedding_service import embedding_service, to_bytes
+
+
+def backfill_memory_embeddings(batch_size: int = 256, reembed_all: bool = False) -> int:
+    """Embed memories in batches; returns the number of rows updated"""
+    db = SessionLocal()
+    updated = 0
+    last_id = None
+    try:
+        while True:
+            query = db.query(Memory.id, Memory.content).order_by(Memory.id)
+            if not reembed_all:
+                query = query.filter(Memory.embedding.is_(None))
+            if last_id is not None:
+                query = query.filter(Memory.id > last_id)
+            rows = query.limit(batch_size).all()
+            if not rows:
+                break
+
+            vectors = embedding_service.embed([row.content for row in rows])
+            db.bulk_update_mappings(
+                Memory,
+                [
+                    {"id": row.id, "embedding": to_bytes(vector)}
+                    for row, vector in zip(rows, vectors)
+                ],
+            )
+            db.commit()
+
+            updated += len(rows)
+            last_id = rows[-1].id
+            print(f"Embedded {updated} memories")
+    finally:
+        db.close()
+
+    return updated
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument(
+        "--all", action="store_true", help="re-embed every memory (after a model change)"
+    )
+    args = parser.parse_args()
+
+    updated = backfill_memory_embeddings(args.batch_size, args.all)
+    print(f"Done: {updated} memories embedded")
+
+
+if __name__ == "__main__":
+    main()
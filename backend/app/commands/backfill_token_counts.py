@@ -0,0 +1,63 @@
+"""Backfill ``messages.tokens_used`` for rows written before counts were stored.
+
+Usage:
+    python -m app.commands.backfill_token_counts [--batch-size 500]
+
+Counts use the tokenizer of the configured ``LLM_PROVIDER``, the same one
+``ChatService.create_message`` uses for new rows. Safe to re-run: only rows
+with a missing or zero count are touched.
+"""
+import argparse
+from sqlalchemy import or_
+from app.core.database import SessionLocal
+from app.models.message import Message
+from app.services.llm_service import llm_service
+
+
+def backfill_token_counts(batch_size: int = 500) -> int:
+    """Fill in missing token counts in batches; returns the number of rows updated"""
+    db = SessionLocal()
+    updated = 0
+    last_id = None
+    try:
+        while True:
+            query = (
+                db.query(Message.id, Message.content)
+                .filter(or_(Message.tokens_used.is_(None), Message.tokens_used == 0))
+                .order_by(Message.id)
+            )
+            if last_id is not None:
+                query = query.filter(Message.id > last_id)
+            rows = query.limit(batch_size).all()
+            if not rows:
+                break
+
+            db.bulk_update_mappings(
+                Message,
+                [
+                    {"id": row.id, "tokens_used": llm_service.count_tokens(row.content)}
+                    for row in rows
+                ],
+            )
+            db.commit()
+
+            updated += len(rows)
+            last_id = rows[-1].id
+            print(f"Backfilled {updated} messages")
+    finally:
+        db.close()
+
+    return updated
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    updated = backfill_token_counts(args.batch_size)
+    print(f"Done: {updated} messages updated")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+"""Enforce the per-user memory cap now.
+
+Usage:
+    python -m app.commands.compact_memories [--max-users N]
+
+Archives (or deletes, with ``MEMORY_EVICTION_MODE=delete``) the
+lowest-scoring memories of every user above ``MEMORY_MAX_PER_USER``. The
+application also does this periodically; see
+``app/services/memory_compactor.py``.
+"""
+import argparse
+from app.services.memory_compactor import memory_compactor
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--max-users", type=int, help="stop after this many users")
+    args = parser.parse_args()
+
+    result = memory_compactor.compact(args.max_users)
+    print(f"Done: {result['evicted']} memories evicted from {result['users']} users")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""Merge duplicate and near-duplicate memories.
+
+Usage:
+    python -m app.commands.consolidate_memories [--user-id ID]
+
+New memories are deduplicated as they are stored; run this periodically (for
+example from cron) to clean up rows written before that, or duplicates that
+only became close after an embedding model change. Of each group of duplicates
+the most important memory is kept. Also fills in missing content hashes and
+embeddings. Reports how many rows were reclaimed.
+"""
+import argparse
+from typing import Optional
+from app.core.database import SessionLocal
+from app.models.memory import Memory
+from app.services.memory_service import memory_service
+
+
+def consolidate_memories(user_id: Optional[str] = None) -> int:
+    """Consolidate one user's memories, or everyone's; returns rows reclaimed"""
+    db = SessionLocal()
+    reclaimed = 0
+    try:
+        if user_id:
+            user_ids = [user_id]
+        else:
+            user_ids = [row.user_id for row in db.query(Memory.user_id).distinct()]
+
+        for uid in user_ids:
+            removed = memory_service.consolidate_user_memories(db, uid)
+            if removed:
+                print(f"User {uid}: merged {removed} duplicate memories")
+            reclaimed += removed
+    finally:
+        db.close()
+
+    return reclaimed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--user-id", help="only consolidate this user's memories")
+    args = parser.parse_args()
+
+    reclaimed = consolidate_memories(args.user_id)
+    print(f"Done: {reclaimed} memory rows reclaimed")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,74 @@
-from sqlalchemy import create_engine
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Iterator, List, Optional
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from app.core.config import settings
 
+# Synchronous engine (psycopg2): background tasks, commands and migrations
 engine = create_engine(
     settings.DATABASE_URL,
     pool_pre_ping=True,
-    pool_size=10,
-    max_overflow=20
+    pool_size=settings.DATABASE_POOL_SIZE,
+    max_overflow=settings.DATABASE_MAX_OVERFLOW,
 )
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async engine (asyncpg) for request handlers, so queries never block the event loop
+async_engine = create_async_engine(
+    make_url(settings.DATABASE_URL).set(drivername="postgresql+asyncpg"),
+    pool_pre_ping=True,
+    pool_size=settings.DATABASE_ASYNC_POOL_SIZE,
+    max_overflow=settings.DATABASE_ASYNC_MAX_OVERFLOW,
+)
+
+# Objects stay usable after commit; routes serialize them once the session is gone
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+# Autocommit sessions for reads that need no transaction (no BEGIN/COMMIT round trips)
+ReadSessionLocal = async_sessionmaker(
+    async_engine.execution_options(isolation_level="AUTOCOMMIT"),
+    autoflush=False,
+    expire_on_commit=False,
+)
+
 Base = declarative_base()
 
+# Round trips (BEGIN, statements, COMMIT/ROLLBACK) counted for the current task
+_round_trips: ContextVar[Optional[List[int]]] = ContextVar("round_trips", default=None)
+
+
+@contextmanager
+def count_round_trips(counter: Optional[List[int]] = None) -> Iterator[List[int]]:
+    """Count database round trips made in this block into ``counter`` (``[n]``)"""
+    counter = counter if counter is not None else [0]
+    token = _round_trips.set(counter)
+    try:
+        yield counter
+    finally:
+        _round_trips.reset(token)
+
+
+def _count_round_trip(*args, **kwargs) -> None:
+    counter = _round_trips.get()
+    if counter is not None:
+        counter[0] += 1
+
+
+def _count_transaction_round_trip(conn, *args) -> None:
+    # Autocommit connections send no BEGIN, COMMIT or ROLLBACK
+    if conn.get_execution_options().get("isolation_level") != "AUTOCOMMIT":
+        _count_round_trip()
+
+
+event.listen(async_engine.sync_engine, "before_cursor_execute", _count_round_trip)
+for _event in ("begin", "commit", "rollback"):
+    event.listen(async_engine.sync_engine, _event, _count_transaction_round_trip)
+
 
 def get_db():
     """Dependency for getting database session"""
@@ -22,3 +77,9 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+async def get_async_db() -> AsyncIterator[AsyncSession]:
+    """Dependency for getting an async database session (one per request)"""
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -1,21 +1,30 @@
-import redis
+import redis.asyncio as redis
 import json
-from typing import Optional, Any
+from typing import Optional, Any, Dict, List
 from app.core.config import settings
 
 
 class RedisClient:
+    """Async Redis access; every call fails soft (logged, with a neutral result).
+
+    Socket timeouts bound each call, so an unresponsive Redis slows a request
+    by at most ``REDIS_SOCKET_TIMEOUT`` per call instead of hanging it.
+    """
+
     def __init__(self):
         self.redis = redis.from_url(
             settings.REDIS_URL,
             decode_responses=True,
-            encoding="utf-8"
+            encoding="utf-8",
+            socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=settings.REDIS_CONNECT_TIMEOUT,
         )
+        self._scripts = {}
 
     async def get(self, key: str) -> Optional[Any]:
         """Get value from Redis"""
         try:
-            value = self.redis.get(key)
+            value = await self.redis.get(key)
             if value:
                 return json.loads(value)
             return None
@@ -26,7 +35,7 @@ class RedisClient:
     async def set(self, key: str, value: Any, expire: int = 3600) -> bool:
         """Set value in Redis with expiration"""
         try:
-            self.redis.setex(
+            await self.redis.setex(
                 key,
                 expire,
                 json.dumps(value)
@@ -36,10 +45,41 @@ class RedisClient:
             print(f"Redis set error: {e}")
             return False
 
+    async def set_nx(self, key: str, value: Any, expire: int = 3600) -> Optional[bool]:
+        """Set value only if the key does not exist.
+
+        Returns True if the key was set, False if it already existed and None
+        if Redis could not be reached.
+        """
+        try:
+            return bool(await self.redis.set(key, json.dumps(value), ex=expire, nx=True))
+        except Exception as e:
+            print(f"Redis set_nx error: {e}")
+            return None
+
+    async def eval(self, script: str, keys: List[str], args: List[Any]) -> Optional[Any]:
+        """Run a Lua script (cached server-side by its SHA); None if Redis is unreachable"""
+        try:
+            if script not in self._scripts:
+                self._scripts[script] = self.redis.register_script(script)
+            return await self._scripts[script](keys=keys, args=args)
+        except Exception as e:
+            print(f"Redis eval error: {e}")
+            return None
+
+    async def lpush(self, key: str, value: str) -> bool:
+        """Push a raw string onto the head of a list"""
+        try:
+            await self.redis.lpush(key, value)
+            return True
+        except Exception as e:
+            print(f"Redis lpush error: {e}")
+            return False
+
     async def delete(self, key: str) -> bool:
         """Delete key from Redis"""
         try:
-            self.redis.delete(key)
+            await self.redis.delete(key)
             return True
         except Exception as e:
             print(f"Redis delete error: {e}")
@@ -48,10 +88,77 @@ class RedisClient:
     async def exists(self, key: str) -> bool:
         """Check if key exists in Redis"""
         try:
-            return self.redis.exists(key) > 0
+            return await self.redis.exists(key) > 0
         except Exception as e:
             print(f"Redis exists error: {e}")
             return False
 
+    async def hincrby(self, key: str, field: str, amount: int = 1) -> int:
+        """Increment a hash field"""
+        try:
+            return await self.redis.hincrby(key, field, amount)
+        except Exception as e:
+            print(f"Redis hincrby error: {e}")
+            return 0
+
+    async def hgetall(self, key: str) -> Dict[str, str]:
+        """Get all fields of a hash"""
+        try:
+            return await self.redis.hgetall(key)
+        except Exception as e:
+            print(f"Redis hgetall error: {e}")
+            return {}
+
+    async def zadd_and_trim(
+        self, key: str, member: str, score: float, max_size: int, min_score: float = None
+    ) -> List[str]:
+        """Add a member to a sorted set and trim it to ``max_size`` entries.
+
+        Members scoring below ``min_score`` are dropped first, then the
+        lowest-scoring members beyond ``max_size``. Returns the members removed
+        by the size trim so callers can evict what they index.
+        """
+        try:
+            async with self.redis.pipeline() as pipe:
+                pipe.zadd(key, {member: score})
+                if min_score is not None:
+                    pipe.zremrangebyscore(key, "-inf", f"({min_score}")
+                pipe.zcard(key)
+                size = (await pipe.execute())[-1]
+
+            if size <= max_size:
+                return []
+            return [m for m, _ in await self.redis.zpopmin(key, size - max_size)]
+        except Exception as e:
+            print(f"Redis zadd error: {e}")
+            return []
+
+    async def mget(self, *keys: str) -> List[Optional[str]]:
+        """Raw values of several keys in one round trip (None where missing)"""
+        try:
+            return await self.redis.mget(keys)
+        except Exception as e:
+            print(f"Redis mget error: {e}")
+            return [None] * len(keys)
+
+    def pubsub(self):
+        """A pub/sub connection (poll it with ``get_message(timeout=...)``)"""
+        return self.redis.pubsub(ignore_subscribe_messages=True)
+
+    async def delete_many(self, *keys: str) -> bool:
+        """Delete several keys in one round trip"""
+        if not keys:
+            return True
+        try:
+            await self.redis.delete(*keys)
+            return True
+        except Exception as e:
+            print(f"Redis delete error: {e}")
+            return False
+
+    async def close(self) -> None:
+        """Close the connection pool (called on shutdown)"""
+        await self.redis.aclose(close_connection_pool=True)
+
 
 redis_client = RedisClient()
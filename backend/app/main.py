@@ -1,7 +1,21 @@
+import asyncio
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.routes import chat
 from app.core.config import settings
+from app.core.database import async_engine
+from app.core.redis_client import redis_client
+from app.services.embedding_service import embedding_service
+from app.services.llm_providers import shutdown_executor
+from app.services.llm_service import llm_service
+from app.services.memory_access import memory_access_buffer
+from app.services.memory_compactor import memory_compactor
+from app.services.profile_cache import profile_cache
+from app.services.response_cache import response_cache
+from app.services.task_queue import task_queue
+from app.services.unit_of_work import turn_stats
+from app.utils.knowledge_base import knowledge_base
+import app.tasks  # noqa: F401 (registers background tasks)
 import logging
 
 # Configure logging
@@ -48,18 +62,64 @@ async def health_check():
     return {"status": "healthy"}
 
 
+@app.get("/stats/llm")
+async def llm_stats():
+    """Circuit breaker state, recent latency and the current adaptive
+    concurrency limit per LLM provider"""
+    return {"providers": llm_service.client.status()}
+
+
+@app.get("/stats/response-cache")
+async def response_cache_stats():
+    """Response cache hit/miss statistics"""
+    return await response_cache.stats()
+
+
+@app.get("/stats/protocols")
+async def protocol_stats():
+    """Documents and terms in the protocol knowledge base"""
+    return knowledge_base.status()
+
+
+@app.get("/stats/tasks")
+async def task_stats():
+    """Background task queue depths"""
+    return await task_queue.stats()
+
+
+@app.get("/stats/turns")
+async def chat_turn_stats():
+    """Database round trips and context-gathering time per chat turn over
+    recent turns, and context steps dropped for exceeding their budget"""
+    return turn_stats.status()
+
+
 @app.on_event("startup")
 async def startup_event():
     """Startup event"""
     logger.info(f"Starting {settings.APP_NAME}")
     logger.info(f"Environment: {settings.ENVIRONMENT}")
     logger.info(f"LLM Provider: {settings.LLM_PROVIDER}")
+    # Load the embedding model and protocol index before serving, not on the first chat turn
+    await asyncio.to_thread(embedding_service.load)
+    await asyncio.to_thread(knowledge_base.load)
+    memory_access_buffer.start()
+    memory_compactor.start()
+    profile_cache.start()
+    task_queue.start()
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Shutdown event"""
     logger.info(f"Shutting down {settings.APP_NAME}")
+    await task_queue.stop()
+    await memory_compactor.stop()
+    await profile_cache.stop()
+    await memory_access_buffer.stop()
+    shutdown_executor()
+    await async_engine.dispose()
+    await redis_client.close()
 
 
 if __name__ == "__main__":
@@ -1,5 +1,6 @@
 from app.models.user import User
 from app.models.message import Message
 from app.models.memory import Memory
+from app.models.summary import ConversationSummary
 
-__all__ = ["User", "Message", "Memory"]
+__all__ = ["User", "Message", "Memory", "ConversationSummary"]
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, DateTime, Float, ForeignKey, Text
+from sqlalchemy import Column, String, DateTime, Float, ForeignKey, Index, LargeBinary, Text
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -17,6 +17,19 @@ class Memory(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     last_accessed = Column(DateTime, default=datetime.utcnow)
     access_count = Column(Float, default=0)
+    embedding = Column(LargeBinary, nullable=True)  # float32 vector, see embedding_service.py
+    content_hash = Column(String(64), nullable=True)  # sha256 of the normalized content
+    archived_at = Column(DateTime, nullable=True)  # Set when evicted by the compactor
+
+    __table_args__ = (
+        Index("ix_memories_user_id_content_hash", "user_id", "content_hash"),
+        Index(
+            "ix_memories_user_id_active",
+            "user_id",
+            "importance",
+            postgresql_where=archived_at.is_(None),
+        ),
+    )
 
     # Relationships
     user = relationship("User", back_populates="memories")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, DateTime, Boolean, ForeignKey, Text, Integer
+from sqlalchemy import Column, String, DateTime, Boolean, ForeignKey, Text, Integer, Index
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -21,5 +21,10 @@ class Message(Base):
     # Relationships
     user = relationship("User", back_populates="messages")
 
+    __table_args__ = (
+        # Keyset pagination and history reads: a user's messages newest first
+        Index("ix_messages_user_id_created_at_id", "user_id", created_at.desc(), id.desc()),
+    )
+
     class Config:
         orm_mode = True
@@ -0,0 +1,21 @@
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, Text
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.orm import relationship
+from datetime import datetime
+from app.core.database import Base
+
+
+class ConversationSummary(Base):
+    __tablename__ = "conversation_summaries"
+
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), primary_key=True)
+    content = Column(Text, nullable=False)
+    # created_at of the newest message folded into the summary; only messages
+    # after it are sent to the LLM as conversation history
+    summarized_until = Column(DateTime, nullable=False)
+    message_count = Column(Integer, default=0)  # Messages folded so far
+    tokens = Column(Integer, default=0)  # Token count of content
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # Relationships
+    user = relationship("User", back_populates="summary")
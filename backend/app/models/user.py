@@ -24,3 +24,6 @@ class User(Base):
     # Relationships
     messages = relationship("Message", back_populates="user", cascade="all, delete-orphan")
     memories = relationship("Memory", back_populates="user", cascade="all, delete-orphan")
+    summary = relationship(
+        "ConversationSummary", back_populates="user", uselist=False, cascade="all, delete-orphan"
+    )
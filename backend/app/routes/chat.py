@@ -1,28 +1,27 @@
-from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect
-from sqlalchemy.orm import Session
-from typing import List
-from app.core.database import get_db
+from fastapi import APIRouter, Depends, HTTPException, Query, WebSocket, WebSocketDisconnect
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
+from app.core.database import AsyncSessionLocal, get_async_db
 from app.services.chat_service import chat_service
+from app.services.idempotency import TurnInProgressError
 from app.schemas.message import MessageCreate, MessageResponse, MessageList
 from app.schemas.user import UserResponse
 import json
-import asyncio
 
 router = APIRouter(prefix="/api/chat", tags=["chat"])
 
 
 @router.get("/user/{user_id}", response_model=UserResponse)
-async def get_user(user_id: str, db: Session = Depends(get_db)):
+async def get_user(user_id: str, db: AsyncSession = Depends(get_async_db)):
     """Get user information"""
-    user = chat_service.get_or_create_user(db, user_id)
-    return user
+    return await chat_service.get_or_create_profile(db, user_id)
 
 
 @router.post("/user/{user_id}/initialize")
-async def initialize_chat(user_id: str, db: Session = Depends(get_db)):
+async def initialize_chat(user_id: str, db: AsyncSession = Depends(get_async_db)):
     """Initialize chat for a new user"""
-    user = chat_service.get_or_create_user(db, user_id)
-    message = await chat_service.initialize_chat(db, str(user.id))
+    user = await chat_service.get_or_create_profile(db, user_id)
+    message = await chat_service.initialize_chat(db, user["id"])
 
     if message:
         return {"message": "Chat initialized", "initial_message": message}
@@ -32,26 +31,37 @@ async def initialize_chat(user_id: str, db: Session = Depends(get_db)):
 
 @router.get("/user/{user_id}/messages", response_model=MessageList)
 async def get_messages(
-    user_id: str, page: int = 1, per_page: int = 20, db: Session = Depends(get_db)
+    user_id: str,
+    per_page: int = Query(20, ge=1, le=100),
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
 ):
-    """Get paginated messages for user"""
-    result = chat_service.get_messages(db, user_id, page, per_page)
-    return result
+    """Get a page of messages for user: the newest, or those before/after a cursor"""
+    try:
+        return await chat_service.get_messages(db, user_id, per_page, before=before, after=after)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
 @router.post("/user/{user_id}/message", response_model=MessageResponse)
 async def send_message(
-    user_id: str, message: MessageCreate, db: Session = Depends(get_db)
+    user_id: str, message: MessageCreate, db: AsyncSession = Depends(get_async_db)
 ):
     """Send a message and get AI response"""
     try:
         response = await chat_service.process_user_message(
-            db, user_id, message.content
+            db, user_id, message.content, client_message_id=message.client_message_id
         )
         return response
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
+    except TurnInProgressError as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
+        print(f"Error processing message: {type(e).__name__}: {str(e)}")
+        import traceback
+        traceback.print_exc()
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
@@ -85,14 +95,14 @@ async def websocket_endpoint(websocket: WebSocket, user_id: str):
     """WebSocket endpoint for real-time chat"""
     await manager.connect(websocket, user_id)
 
-    # Get database session
-    db = next(get_db())
-
     try:
         # Initialize chat if needed (creates onboarding message in DB if first time)
-        # Don't send it via WebSocket since frontend loads messages via REST API
-        user = chat_service.get_or_create_user(db, user_id)
-        await chat_service.initialize_chat(db, str(user.id))
+        # Don't send it via WebSocket since frontend loads messages via REST API.
+        # Sessions are scoped to this and to each turn, so an idle connection
+        # holds no database connection.
+        async with AsyncSessionLocal() as db:
+            user = await chat_service.get_or_create_profile(db, user_id)
+            await chat_service.initialize_chat(db, user["id"])
 
         while True:
             # Receive message from client
@@ -109,48 +119,73 @@ async def websocket_endpoint(websocket: WebSocket, user_id: str):
                     )
                     continue
 
-                # Save user message
-                user_msg = chat_service.create_message(db, user_id, "user", content)
-
-                # Send confirmation that message was received
-                await manager.send_message(
-                    user_id,
-                    {
-                        "type": "message",
-                        "role": "user",
-                        "content": content,
-                        "id": str(user_msg.id),
-                        "created_at": user_msg.created_at.isoformat(),
-                    },
-                )
-
-                # Show typing indicator
-                await manager.send_typing_indicator(user_id, True)
-
-                # Small delay to simulate natural typing
-                await asyncio.sleep(0.5)
-
-                # Process message and generate response
+                # Process message and stream the response as it is generated.
+                # The user message is accepted by the service and echoed back as
+                # confirmation before generation starts; it is saved with the reply.
+                # Frames of the turn carry the client's message id, so it can
+                # tell which of its sends were answered (and resend the others)
+                client_message_id = message_data.get("client_message_id")
                 try:
-                    response = await chat_service.process_user_message(
-                        db, user_id, content
-                    )
-
-                    # Hide typing indicator
-                    await manager.send_typing_indicator(user_id, False)
-
-                    # Send AI response - note we already saved it in process_user_message
-                    # So we just need to send the response, not the user message
-                    await manager.send_message(
-                        user_id,
-                        {
-                            "type": "message",
-                            "role": "assistant",
-                            "content": response.content,
-                            "id": str(response.id),
-                            "created_at": response.created_at.isoformat(),
-                        },
-                    )
+                    # One session per turn, closed before the next message is read
+                    async with AsyncSessionLocal() as db:
+                        async for event in chat_service.stream_user_message(
+                            db,
+                            user_id,
+                            content,
+                            client_message_id=client_message_id,
+                        ):
+                            if event["type"] == "user_message":
+                                user_msg = event["message"]
+                                await manager.send_message(
+                                    user_id,
+                                    {
+                                        "type": "message",
+                                        "role": "user",
+                                        "content": user_msg.content,
+                                        "id": str(user_msg.id),
+                                        "created_at": user_msg.created_at.isoformat(),
+                                        "client_message_id": client_message_id,
+                                    },
+                                )
+                                # Show typing indicator until the first chunk arrives
+                                await manager.send_typing_indicator(user_id, True)
+
+                            elif event["type"] == "start":
+                                await manager.send_typing_indicator(user_id, False)
+                                await manager.send_message(
+                                    user_id,
+                                    {
+                                        "type": "message_start",
+                                        "role": "assistant",
+                                        "id": str(event["id"]),
+                                    },
+                                )
+
+                            elif event["type"] == "delta":
+                                await manager.send_message(
+                                    user_id,
+                                    {
+                                        "type": "message_delta",
+                                        "id": str(event["id"]),
+                                        "content": event["content"],
+                                    },
+                                )
+
+                            elif event["type"] == "end":
+                                # Final frame carries the saved message, so clients
+                                # can reconcile whatever deltas they rendered
+                                response = event["message"]
+                                await manager.send_message(
+                                    user_id,
+                                    {
+                                        "type": "message_end",
+                                        "role": "assistant",
+                                        "content": response.content,
+                                        "id": str(response.id),
+                                        "created_at": response.created_at.isoformat(),
+                                        "client_message_id": client_message_id,
+                                    },
+                                )
 
                 except Exception as e:
                     print(f"Error processing message: {type(e).__name__}: {str(e)}")
@@ -172,5 +207,3 @@ async def websocket_endpoint(websocket: WebSocket, user_id: str):
         import traceback
         traceback.print_exc()
         manager.disconnect(user_id)
-    finally:
-        db.close()
@@ -6,6 +6,8 @@ from uuid import UUID
 
 class MessageCreate(BaseModel):
     content: str = Field(..., min_length=1, max_length=10000)
+    # Client-generated id; resending the same id never creates a second turn
+    client_message_id: Optional[str] = Field(None, max_length=100)
 
     @validator('content')
     def validate_content(cls, v):
@@ -27,7 +29,7 @@ class MessageResponse(BaseModel):
 
 
 class MessageList(BaseModel):
-    messages: List[MessageResponse]
-    total: int
-    has_more: bool
-    page: int
+    messages: List[MessageResponse]  # Oldest first
+    has_more: bool  # More messages in the direction paged (older, or newer with after)
+    before_cursor: Optional[str] = None  # Pass as before= for the previous (older) page
+    after_cursor: Optional[str] = None  # Pass as after= for newer messages
@@ -1,21 +1,73 @@
-from sqlalchemy.orm import Session
-from typing import List, Dict
+from sqlalchemy import insert, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Any, AsyncIterator, Awaitable, List, Dict, Optional, Set, Tuple
 from datetime import datetime
 from app.models.user import User
 from app.models.message import Message
+from app.models.summary import ConversationSummary
+from app.services.history_cache import history_cache, history_entry
+from app.services.idempotency import TurnClaim, turn_deduplicator
 from app.services.llm_service import llm_service
 from app.services.memory_service import memory_service
+from app.services.profile_cache import profile_cache, profile_dict
+from app.services.summary_service import summary_service
+from app.services.task_queue import task_queue
+from app.services.unit_of_work import TurnUnitOfWork, turn_stats
+from app.utils.extraction import Extraction, extraction_engine
+from app.utils.pagination import decode_cursor, encode_cursor
+from app.utils.protocols import find_relevant_protocol_ids
 from app.core.config import settings
+from app.core.database import ReadSessionLocal
+import asyncio
+import json
+import time
 import uuid
 
+# Context steps that overran their budget, kept referenced until they finish
+_late_steps: Set[asyncio.Future] = set()
+
+
+def _discard_late_step(task: asyncio.Future) -> None:
+    _late_steps.discard(task)
+    if not task.cancelled():
+        task.exception()  # Retrieved, so a late failure is not reported as unhandled
+
+
+async def _within_budget(step: Awaitable, timeout: float, default: Any, name: str) -> Any:
+    """Result of a context step, or ``default`` if it fails or overruns ``timeout``.
+
+    An overrunning step is not cancelled (that would abort its query
+    mid-flight); it finishes in the background and its result is dropped.
+    """
+    task = asyncio.ensure_future(step)
+    try:
+        return await asyncio.wait_for(asyncio.shield(task), timeout)
+    except asyncio.TimeoutError:
+        print(f"Context step '{name}' exceeded {timeout}s, continuing without it")
+        _late_steps.add(task)
+        task.add_done_callback(_discard_late_step)
+    except Exception as e:
+        print(f"Context step '{name}' error: {e}")
+    turn_stats.record_degraded(name)
+    return default
+
 
 class ChatService:
-    """Service for managing chat operations"""
+    """Service for managing chat operations.
+
+    Methods take an ``AsyncSession``; callers scope one session to a request
+    or, on the WebSocket, to a turn. A turn reads in one transaction before
+    the reply is generated and writes in one after it (``TurnUnitOfWork``).
+    """
 
-    def get_or_create_user(self, db: Session, user_id: str = None) -> User:
+    async def get_user(self, db: AsyncSession, user_id: str) -> Optional[User]:
+        """Get a user by id"""
+        return await db.get(User, uuid.UUID(str(user_id)))
+
+    async def get_or_create_user(self, db: AsyncSession, user_id: str = None) -> User:
         """Get existing user or create new one"""
         if user_id:
-            user = db.query(User).filter(User.id == user_id).first()
+            user = await self.get_user(db, user_id)
             if user:
                 return user
 
@@ -29,166 +81,460 @@ class ChatService:
             onboarding_completed=False,
         )
         db.add(user)
-        db.commit()
-        db.refresh(user)
+        await db.commit()
+        await db.refresh(user)
         return user
 
-    def get_messages(
-        self, db: Session, user_id: str, page: int = 1, per_page: int = None
+    async def get_profile(self, user_id: str, db: Optional[AsyncSession] = None) -> Optional[Dict]:
+        """The user's profile as a dict (see ``profile_cache``), or None if there
+        is no such user. Misses are loaded on ``db``, or a read session."""
+        async def load() -> Optional[User]:
+            if db is not None:
+                return await self.get_user(db, user_id)
+            async with ReadSessionLocal() as session:
+                return await self.get_user(session, user_id)
+
+        return await profile_cache.get_or_load(str(user_id), load)
+
+    async def get_or_create_profile(self, db: AsyncSession, user_id: str = None) -> Dict:
+        """Get the profile of an existing user, or create a new one"""
+        if user_id:
+            profile = await self.get_profile(user_id, db)
+            if profile:
+                return profile
+        return profile_dict(await self.get_or_create_user(db, user_id))
+
+    async def get_messages(
+        self,
+        db: AsyncSession,
+        user_id: str,
+        per_page: int = None,
+        before: Optional[str] = None,
+        after: Optional[str] = None,
     ) -> Dict:
-        """Get paginated messages for user"""
+        """Get a page of the user's messages, oldest first.
+
+        Without a cursor this is the newest page. ``before`` pages back to
+        older messages and ``after`` forward to newer ones; ``has_more`` says
+        whether there are more in that direction. Pages are keyset ranges on
+        ``(created_at, id)``, so they cost the same however far back they are
+        and do not shift as new messages arrive.
+        """
         if per_page is None:
             per_page = settings.MESSAGES_PER_PAGE
-
-        # Calculate offset
-        offset = (page - 1) * per_page
-
-        # Get total count
-        total = db.query(Message).filter(Message.user_id == user_id).count()
-
-        # Get messages (ordered by created_at DESC for pagination, but we'll reverse for display)
-        messages = (
-            db.query(Message)
-            .filter(Message.user_id == user_id)
-            .order_by(Message.created_at.desc())
-            .offset(offset)
-            .limit(per_page)
-            .all()
-        )
-
-        # Reverse to show oldest first in the current page
-        messages = list(reversed(messages))
-
-        has_more = (page * per_page) < total
+        if before and after:
+            raise ValueError("Pass either before or after, not both")
+
+        key = tuple_(Message.created_at, Message.id)
+        query = select(Message).where(Message.user_id == user_id)
+        if after:
+            query = query.where(key > tuple_(*decode_cursor(after)))
+            query = query.order_by(Message.created_at.asc(), Message.id.asc())
+        else:
+            if before:
+                query = query.where(key < tuple_(*decode_cursor(before)))
+            query = query.order_by(Message.created_at.desc(), Message.id.desc())
+
+        # One extra row tells whether there is another page, without a count
+        messages = list((await db.scalars(query.limit(per_page + 1))).all())
+        has_more = len(messages) > per_page
+        messages = messages[:per_page]
+        if not after:
+            messages.reverse()
 
         return {
             "messages": messages,
-            "total": total,
             "has_more": has_more,
-            "page": page,
+            "before_cursor": (
+                encode_cursor(messages[0].created_at, messages[0].id) if messages else before
+            ),
+            "after_cursor": (
+                encode_cursor(messages[-1].created_at, messages[-1].id) if messages else after
+            ),
         }
 
-    def create_message(
-        self, db: Session, user_id: str, role: str, content: str, is_onboarding: bool = False
+    def _message_row(
+        self,
+        user_id: str,
+        role: str,
+        content: str,
+        is_onboarding: bool = False,
+        message_id: Optional[uuid.UUID] = None,
+        meta_data: Optional[Dict] = None,
+    ) -> Dict:
+        """Column values for a new message"""
+        return {
+            "id": message_id or uuid.uuid4(),
+            "user_id": uuid.UUID(str(user_id)),
+            "role": role,
+            "content": content,
+            "is_onboarding": is_onboarding,
+            "meta_data": json.dumps(meta_data) if meta_data else None,
+            "created_at": datetime.utcnow(),
+            # Counted once here so context assembly never re-tokenizes history
+            "tokens_used": llm_service.count_tokens(content),
+        }
+
+    async def create_message(
+        self,
+        db: AsyncSession,
+        user_id: str,
+        role: str,
+        content: str,
+        is_onboarding: bool = False,
+        message_id: Optional[uuid.UUID] = None,
+        meta_data: Optional[Dict] = None,
     ) -> Message:
         """Create a new message"""
-        message = Message(
-            id=uuid.uuid4(),
-            user_id=user_id,
-            role=role,
-            content=content,
-            is_onboarding=is_onboarding,
-            created_at=datetime.utcnow(),
-        )
-        db.add(message)
-        db.commit()
-        db.refresh(message)
+        row = self._message_row(user_id, role, content, is_onboarding, message_id, meta_data)
+        message = await db.scalar(insert(Message).values(**row).returning(Message))
+        await db.commit()
+        await history_cache.append([message])
         return message
 
-    def get_conversation_context(self, db: Session, user_id: str) -> List[Dict[str, str]]:
-        """Get recent conversation context for LLM"""
-        messages = (
-            db.query(Message)
-            .filter(Message.user_id == user_id)
+    async def get_recent_history(
+        self, user_id: str, db: Optional[AsyncSession] = None
+    ) -> List[Dict]:
+        """The user's last ``MAX_CONVERSATION_HISTORY`` messages, oldest first.
+
+        Read from the Redis window (``history_cache``); on a miss they are
+        queried from Postgres (on ``db``, or a read session) and the window
+        is rebuilt.
+        """
+        entries = await history_cache.get(user_id)
+        if entries is not None:
+            return entries
+
+        rebuild = await history_cache.claim_rebuild(user_id)
+        query = (
+            select(Message)
+            .where(Message.user_id == user_id)
             .order_by(Message.created_at.desc())
             .limit(settings.MAX_CONVERSATION_HISTORY)
-            .all()
         )
+        if db is None:
+            async with ReadSessionLocal() as session:
+                messages = (await session.scalars(query)).all()
+        else:
+            messages = (await db.scalars(query)).all()
 
         # Reverse to get chronological order
-        messages = list(reversed(messages))
-
-        # Convert to LLM format
-        context = []
-        for msg in messages:
-            context.append({"role": msg.role, "content": msg.content})
-
-        return context
-
-    async def process_user_message(
-        self, db: Session, user_id: str, content: str
-    ) -> Message:
-        """Process user message and generate response"""
-        # Get user
-        user = db.query(User).filter(User.id == user_id).first()
-        if not user:
+        entries = [history_entry(msg) for msg in reversed(messages)]
+        if rebuild:
+            await history_cache.fill(user_id, entries)
+        return entries
+
+    def _context_since(self, entries: List[Dict], since: Optional[datetime]) -> List[Dict]:
+        """History entries after ``since``, in LLM format"""
+        return [
+            {"role": entry["role"], "content": entry["content"], "tokens": entry["tokens"]}
+            for entry in entries
+            if since is None or entry["created_at"] > since
+        ]
+
+    async def get_conversation_context(
+        self, db: AsyncSession, user_id: str, since: Optional[datetime] = None
+    ) -> List[Dict]:
+        """Get recent conversation context for LLM.
+
+        Only messages created after ``since`` (the end of the user's
+        conversation summary) are included. Each entry carries the message's
+        stored token count under ``tokens`` (``None`` for rows written before
+        counts were stored).
+        """
+        return self._context_since(await self.get_recent_history(user_id, db), since)
+
+    async def _load_summary(self, user_id: str) -> Optional[ConversationSummary]:
+        async with ReadSessionLocal() as db:
+            return await summary_service.get_summary(db, user_id)
+
+    async def _load_memories(self, user_id: str, content: str) -> List[str]:
+        async with ReadSessionLocal() as db:
+            memories = await memory_service.get_relevant_memories(db, user_id, content)
+        return [mem.content for mem in memories]
+
+    async def _prepare_turn(
+        self,
+        uow: TurnUnitOfWork,
+        user_id: str,
+        content: str,
+        user_message_id: Optional[str] = None,
+    ) -> Tuple[Message, Dict, Extraction]:
+        """Gather everything the LLM needs for a turn.
+
+        The profile, summary, history, memories and protocols are independent,
+        so they are fetched concurrently (each read on its own autocommit
+        session), and the stage takes as long as its slowest step. The profile
+        is usually a cache hit. History, memories and protocols have a latency
+        budget (``CONTEXT_*_TIMEOUT``); a step that overruns or fails is left
+        out instead of failing the turn.
+
+        The user message and the profile updates it implies are queued on
+        ``uow`` and written with the reply; the returned message is an unsaved
+        copy. ``user_message_id`` is the message saved by an earlier, failed
+        attempt at this turn; if it still exists it is reused instead. Also
+        returns what the message says about the user; memories are stored
+        after the reply.
+        """
+        with uow.counting():
+            started = time.perf_counter()
+            user, summary, history, memory_strings, protocol_ids = await asyncio.gather(
+                self.get_profile(user_id),
+                self._load_summary(user_id),
+                _within_budget(
+                    self.get_recent_history(user_id), settings.CONTEXT_HISTORY_TIMEOUT, [], "history"
+                ),
+                _within_budget(
+                    self._load_memories(user_id, content),
+                    settings.CONTEXT_MEMORIES_TIMEOUT, [], "memories",
+                ),
+                _within_budget(
+                    asyncio.to_thread(find_relevant_protocol_ids, content),
+                    settings.CONTEXT_PROTOCOLS_TIMEOUT, [], "protocols",
+                ),
+            )
+            turn_stats.record_context(time.perf_counter() - started)
+        if user is None:
             raise ValueError("User not found")
+        uow.user = user
+
+        user_message = None
+        if user_message_id:
+            with uow.counting():
+                user_message = await self._saved_user_message(uow.db, user_id, user_message_id)
+        if user_message is not None:
+            # Already in the history; it is appended below like a new message
+            history = [entry for entry in history if entry["id"] != str(user_message.id)]
+        else:
+            user_message = uow.add_message(
+                self._message_row(
+                    user_id, "user", content, is_onboarding=not user["onboarding_completed"]
+                )
+            )
 
-        # Save user message
-        user_message = self.create_message(
-            db, user_id, "user", content, is_onboarding=not user.onboarding_completed
-        )
-
-        # Update user profile from message
-        memory_service.update_user_profile_from_message(db, user, content)
-
-        # Get conversation context
-        conversation = self.get_conversation_context(db, user_id)
+        # Profile updates and memory candidates, from one scan of the message
+        extraction = extraction_engine.extract(content)
+        profile = memory_service.profile_changes(user, extraction.profile)
+        uow.update_profile(profile)
 
-        # Get relevant memories
-        memories = memory_service.get_relevant_memories(db, user_id, content)
-        memory_strings = [mem.content for mem in memories]
+        # Turns older than the summary are not resent. The user message is
+        # not written yet, so it is appended here
+        conversation = self._context_since(history, summary.summarized_until if summary else None)
+        conversation.append({"role": "user", "content": content, "tokens": user_message.tokens_used})
+        if summary_service.needs_folding(conversation):
+            summary_service.schedule_fold(user_id)
 
-        # Prepare user info for context
+        # Prepare user info for context, including what this message told us
         user_info = {
-            "name": user.name,
-            "age": user.age,
-            "gender": user.gender,
-            "medical_conditions": user.medical_conditions,
-            "medications": user.medications,
-            "allergies": user.allergies,
+            field: user[field]
+            for field in ("name", "age", "gender", "medical_conditions", "medications", "allergies")
         }
+        user_info.update(profile)
+
+        llm_kwargs = {
+            "messages": conversation,
+            "user_info": user_info,
+            "memories": memory_strings,
+            "user_message": content,
+            "protocol_ids": protocol_ids,
+            "summary": summary.content if summary else None,
+            # Filled by the LLM service; stored on the assistant message
+            "budget_report": {},
+            # Filled by the LLM service: whether the reply is a full answer
+            "reply_status": {},
+        }
+        return user_message, llm_kwargs, extraction
+
+    async def _complete_turn(
+        self,
+        uow: TurnUnitOfWork,
+        memories: List[Dict],
+        ai_response: str,
+        message_id: Optional[uuid.UUID] = None,
+        budget_report: Optional[Dict] = None,
+    ) -> Message:
+        """Write the turn with the AI response and queue post-response bookkeeping"""
+        user = uow.user
+        user_id = user["id"]
 
-        # Generate AI response
-        ai_response = await llm_service.generate_response(
-            messages=conversation,
-            user_info=user_info,
-            memories=memory_strings,
-            user_message=content,
-        )
-
-        # Save AI response
-        assistant_message = self.create_message(
-            db,
+        # Save AI response, with how the prompt budget was spent, together
+        # with the user message and profile updates
+        assistant_row = self._message_row(
             user_id,
             "assistant",
             ai_response,
-            is_onboarding=not user.onboarding_completed,
+            is_onboarding=not user["onboarding_completed"],
+            message_id=message_id,
+            meta_data={"prompt_budget": budget_report} if budget_report else None,
         )
+        uow.add_message(assistant_row)
+        assistant_message = (await uow.commit())[assistant_row["id"]]
+        uow.finish()
 
-        # Extract and save memories
-        new_memories = memory_service.extract_memories_from_conversation(
-            content, ai_response, user
-        )
-        for mem_data in new_memories:
-            memory_service.create_memory(
-                db,
-                user_id,
-                mem_data["content"],
-                mem_data["memory_type"],
-                mem_data["importance"],
+        # Storing memories and onboarding progress run off the request path (app/tasks.py)
+        if memories:
+            await task_queue.enqueue("memories.create", user_id=user_id, memories=memories)
+        if not user["onboarding_completed"]:
+            await task_queue.enqueue("onboarding.update", user_id=user_id)
+
+        return assistant_message
+
+    async def get_message(self, db: AsyncSession, message_id: str) -> Optional[Message]:
+        """Get a message by id"""
+        return await db.get(Message, uuid.UUID(str(message_id)))
+
+    async def _saved_user_message(
+        self, db: AsyncSession, user_id: str, message_id: str
+    ) -> Optional[Message]:
+        message = await self.get_message(db, message_id)
+        if message is None or message.role != "user" or str(message.user_id) != str(user_id):
+            return None
+        return message
+
+    async def _claim_turn(
+        self, db: AsyncSession, user_id: str, client_message_id: str
+    ) -> Tuple[TurnClaim, Optional[Message], Optional[Message]]:
+        """Claim a turn; for one already processed, also its stored user and
+        assistant messages.
+
+        A record whose assistant message is gone (deleted, or its commit
+        failed after the record was written) is stale: it is released and the
+        turn is claimed again, to be processed normally.
+        """
+        while True:
+            claim = await turn_deduplicator.acquire(user_id, client_message_id)
+            if claim.owned:
+                return claim, None, None
+            assistant_message = await self.get_message(db, claim.record["message_id"])
+            if assistant_message is not None:
+                user_message = await self.get_message(db, claim.record["user_message_id"])
+                return claim, user_message, assistant_message
+            await claim.release(claim.record.get("user_message_id"))
+
+    async def _finish_claim(
+        self, claim: TurnClaim, user_message: Message, assistant_message: Message, llm_kwargs: Dict
+    ) -> None:
+        """Record the turn for retries if its reply is a full answer; otherwise
+        release it so a retry gets one (reusing the saved user message)"""
+        if llm_kwargs["reply_status"].get("complete"):
+            await claim.complete(user_message.id, assistant_message.id)
+        else:
+            await claim.release(user_message.id)
+
+    async def process_user_message(
+        self, db: AsyncSession, user_id: str, content: str, client_message_id: Optional[str] = None
+    ) -> Message:
+        """Process user message and generate response.
+
+        With a ``client_message_id``, retries of the same message are
+        deduplicated and answered with the original assistant message, as long
+        as that was a full answer.
+        """
+        claim = None
+        if client_message_id:
+            claim, _, stored = await self._claim_turn(db, user_id, client_message_id)
+            if stored is not None:
+                return stored
+
+        uow = TurnUnitOfWork(db)
+        user_message = None
+        try:
+            user_message, llm_kwargs, extraction = await self._prepare_turn(
+                uow, user_id, content, claim.user_message_id if claim else None
             )
 
-        # Mark onboarding as completed after a few exchanges
-        if not user.onboarding_completed:
-            message_count = db.query(Message).filter(Message.user_id == user_id).count()
-            if message_count >= 6:  # After 3 exchanges (user + assistant messages)
-                user.onboarding_completed = True
-                db.commit()
+            # Generate AI response
+            ai_response = await llm_service.generate_response(**llm_kwargs)
 
+            assistant_message = await self._complete_turn(
+                uow, extraction.memories, ai_response,
+                budget_report=llm_kwargs["budget_report"],
+            )
+        except BaseException:
+            await uow.commit_pending()
+            if claim:
+                await claim.release(user_message.id if user_message else None)
+            raise
+
+        if claim:
+            await self._finish_claim(claim, user_message, assistant_message, llm_kwargs)
         return assistant_message
 
-    async def initialize_chat(self, db: Session, user_id: str) -> Message:
+    async def stream_user_message(
+        self, db: AsyncSession, user_id: str, content: str, client_message_id: Optional[str] = None
+    ) -> AsyncIterator[Dict]:
+        """Process user message and stream the response as it is generated.
+
+        Yields events in order:
+        - ``{"type": "user_message", "message": Message}`` once the turn's context
+          is read; the message is saved with the reply (or alone if generation fails)
+        - ``{"type": "start", "id": UUID}`` together with the first chunk (or just
+          before ``end`` if the stream is empty); ``id`` is the id the assistant
+          message will be saved with
+        - ``{"type": "delta", "id": UUID, "content": str}`` for each chunk
+        - ``{"type": "end", "message": Message}`` once the full reply is saved
+
+        A retry of an already processed ``client_message_id`` yields only the
+        stored ``user_message`` and ``end`` events.
+        """
+        claim = None
+        if client_message_id:
+            claim, stored_user_message, stored = await self._claim_turn(
+                db, user_id, client_message_id
+            )
+            if stored is not None:
+                if stored_user_message is not None:
+                    yield {"type": "user_message", "message": stored_user_message}
+                yield {"type": "end", "message": stored}
+                return
+
+        uow = TurnUnitOfWork(db)
+        user_message = None
+        try:
+            user_message, llm_kwargs, extraction = await self._prepare_turn(
+                uow, user_id, content, claim.user_message_id if claim else None
+            )
+            yield {"type": "user_message", "message": user_message}
+
+            # ``start`` goes out with the first chunk, so clients keep showing
+            # the typing indicator until there is text to render
+            assistant_id = uuid.uuid4()
+            chunks = []
+            async for chunk in llm_service.stream_response(**llm_kwargs):
+                if not chunks:
+                    yield {"type": "start", "id": assistant_id}
+                chunks.append(chunk)
+                yield {"type": "delta", "id": assistant_id, "content": chunk}
+            if not chunks:
+                yield {"type": "start", "id": assistant_id}
+
+            # Save the assistant message only once the stream has ended
+            assistant_message = await self._complete_turn(
+                uow, extraction.memories, "".join(chunks),
+                message_id=assistant_id,
+                budget_report=llm_kwargs["budget_report"],
+            )
+        except BaseException:
+            await uow.commit_pending()
+            if claim:
+                await claim.release(user_message.id if user_message else None)
+            raise
+
+        if claim:
+            await self._finish_claim(claim, user_message, assistant_message, llm_kwargs)
+        yield {"type": "end", "message": assistant_message}
+
+    async def initialize_chat(self, db: AsyncSession, user_id: str) -> Message:
         """Initialize chat with onboarding message"""
         # Check if user already has messages
-        existing_messages = (
-            db.query(Message).filter(Message.user_id == user_id).count()
+        existing_message = await db.scalar(
+            select(Message.id).where(Message.user_id == user_id).limit(1)
         )
 
-        if existing_messages == 0:
+        if existing_message is None:
             # Send onboarding message
             onboarding_message = await llm_service.generate_onboarding_message()
-            return self.create_message(
+            return await self.create_message(
                 db, user_id, "assistant", onboarding_message, is_onboarding=True
             )
 
@@ -0,0 +1,136 @@
+"""Text embeddings for semantic memory retrieval.
+
+The model is chosen with ``MEMORY_EMBEDDING_MODEL``: a sentence-transformers
+model name (run on the local CPU/GPU) or ``"hashing"`` for a dependency-free
+bag-of-words fallback. API and task worker processes load it on startup, off the
+event loop; other processes load it on first use. Encoding is blocking, so
+async callers run it in a thread. Embeddings are L2-normalized
+float32 vectors, so cosine similarity is a dot product; they are stored on
+``Memory.embedding`` as raw bytes.
+"""
+import re
+import threading
+import zlib
+from typing import List, Optional
+
+import numpy as np
+
+from app.core.config import settings
+
+_WORD = re.compile(r"\w+")
+
+
+def to_bytes(vector: np.ndarray) -> bytes:
+    """Compact storage form of an embedding"""
+    return np.asarray(vector, dtype=np.float32).tobytes()
+
+
+def from_bytes(blob: bytes) -> np.ndarray:
+    return np.frombuffer(blob, dtype=np.float32)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32)
+
+
+class EmbeddingModel:
+    """Base class: ``embed`` maps texts to an (n, dim) array of unit vectors"""
+
+    name = "base"
+    dim = 0
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        raise NotImplementedError
+
+
+class HashingEmbeddingModel(EmbeddingModel):
+    """Hashed bag of words and word bigrams (no model download needed).
+
+    Only matches shared words, but is deterministic across processes and
+    needs nothing beyond NumPy.
+    """
+
+    name = "hashing"
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            words = _WORD.findall(text.lower())
+            for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+                digest = zlib.crc32(feature.encode("utf-8"))
+                # Signed hashing keeps collisions from only ever adding up
+                vectors[row, digest % self.dim] += 1.0 if digest & 0x80000000 else -1.0
+        return _normalize(vectors)
+
+
+class SentenceTransformerModel(EmbeddingModel):
+    """A local sentence-transformers model"""
+
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+
+        self.name = model_name
+        self.model = SentenceTransformer(model_name)
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = self.model.encode(
+            texts,
+            batch_size=settings.MEMORY_EMBEDDING_BATCH_SIZE,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        )
+        return vectors.astype(np.float32)
+
+
+def create_embedding_model(name: str) -> EmbeddingModel:
+    """Embedding model for ``name``; falls back to hashing if it cannot be loaded"""
+    if name == "hashing":
+        return HashingEmbeddingModel()
+    try:
+        return SentenceTransformerModel(name)
+    except Exception as e:
+        print(f"Embedding model {name} unavailable, using hashing embeddings: {e}")
+        return HashingEmbeddingModel()
+
+
+class EmbeddingService:
+    """Embedding model shared by the process"""
+
+    def __init__(self):
+        self._model: Optional[EmbeddingModel] = None
+        self._lock = threading.Lock()  # Threads embedding at once load the model once
+
+    @property
+    def model(self) -> EmbeddingModel:
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model = create_embedding_model(settings.MEMORY_EMBEDDING_MODEL)
+        return self._model
+
+    def load(self) -> None:
+        """Load the model now rather than on first use (blocking)"""
+        print(f"Embedding model {self.model.name} loaded ({self.dim} dimensions)")
+
+    @property
+    def dim(self) -> int:
+        return self.model.dim
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """Embed texts in one batch; returns an (n, dim) float32 array"""
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return self.model.embed(texts)
+
+    def embed_one(self, text: str) -> np.ndarray:
+        return self.embed([text])[0]
+
+
+embedding_service = EmbeddingService()
@@ -0,0 +1,103 @@
+"""Hot conversation window: each user's last messages, cached in Redis.
+
+The window is a sorted set per user (``history:{user_id}``) of the last
+``MAX_CONVERSATION_HISTORY`` messages, scored by ``created_at``, with their
+token counts. Message writes append to it (write-through), so context
+assembly normally needs no history query. On a miss it is rebuilt from
+Postgres by one reader, which holds a ``history:{user_id}:building`` marker
+while it reads. Writes made meanwhile are added to the window instead of
+being lost, and other readers query Postgres until the rebuild is done.
+Appends only go to windows that exist or are being rebuilt, so a partial
+window is never served.
+"""
+import json
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional
+from app.core.config import settings
+from app.core.redis_client import redis_client
+from app.models.message import Message
+
+REBUILD_TTL = 30  # Seconds a rebuild marker outlives a reader that died
+
+# KEYS: window, building marker. Nothing while a rebuild is pending or on a miss
+READ = """
+if redis.call('EXISTS', KEYS[2]) == 1 or redis.call('EXISTS', KEYS[1]) == 0 then
+    return false
+end
+return redis.call('ZRANGE', KEYS[1], 0, -1)
+"""
+
+# KEYS: window, building marker. ARGV: ttl, size, fill (1 = rebuild), then score/member pairs
+WRITE = """
+local fill = ARGV[3] == '1'
+if not fill and redis.call('EXISTS', KEYS[1]) == 0 and redis.call('EXISTS', KEYS[2]) == 0 then
+    return 0
+end
+for i = 4, #ARGV, 2 do
+    redis.call('ZADD', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+redis.call('ZREMRANGEBYRANK', KEYS[1], 0, -(tonumber(ARGV[2]) + 1))
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+if fill then
+    redis.call('DEL', KEYS[2])
+end
+return 1
+"""
+
+
+def history_entry(message: Message) -> Dict:
+    """A message as a window entry"""
+    return {
+        "id": str(message.id),
+        "role": message.role,
+        "content": message.content,
+        "tokens": message.tokens_used or None,
+        "created_at": message.created_at,
+    }
+
+
+class HistoryCache:
+    """Per-user Redis window of recent messages"""
+
+    def _keys(self, user_id: str) -> List[str]:
+        return [f"history:{user_id}", f"history:{user_id}:building"]
+
+    async def get(self, user_id: str) -> Optional[List[Dict]]:
+        """The user's window, oldest first; None on a miss or while it is rebuilt"""
+        members = await redis_client.eval(READ, self._keys(user_id), [])
+        if members is None:
+            return None
+        entries = []
+        for member in members:
+            entry = json.loads(member)
+            entry["created_at"] = datetime.fromisoformat(entry["created_at"])
+            entries.append(entry)
+        return entries
+
+    async def claim_rebuild(self, user_id: str) -> bool:
+        """Whether this reader should rebuild the window (no one else is)"""
+        return bool(await redis_client.set_nx(self._keys(user_id)[1], 1, REBUILD_TTL))
+
+    async def fill(self, user_id: str, entries: List[Dict]) -> None:
+        """Finish a rebuild with the window read from Postgres"""
+        await self._write(user_id, entries, fill=True)
+
+    async def append(self, messages: Iterable[Message]) -> None:
+        """Add newly written messages to their users' windows"""
+        by_user: Dict[str, List[Dict]] = {}
+        for message in messages:
+            by_user.setdefault(str(message.user_id), []).append(history_entry(message))
+        for user_id, entries in by_user.items():
+            if await self._write(user_id, entries, fill=False) is None:
+                # A window that missed a write must not be served
+                await redis_client.delete(self._keys(user_id)[0])
+
+    async def _write(self, user_id: str, entries: List[Dict], fill: bool) -> Optional[int]:
+        args = [settings.HISTORY_CACHE_TTL, settings.MAX_CONVERSATION_HISTORY, 1 if fill else 0]
+        for entry in entries:
+            args.append(entry["created_at"].replace(tzinfo=timezone.utc).timestamp())
+            args.append(json.dumps({**entry, "created_at": entry["created_at"].isoformat()}))
+        return await redis_client.eval(WRITE, self._keys(user_id), args)
+
+
+history_cache = HistoryCache()
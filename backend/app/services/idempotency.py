@@ -0,0 +1,142 @@
+"""Idempotent chat turns keyed on a client-supplied message id.
+
+The first request for a ``(user_id, client_message_id)`` pair claims the turn in
+Redis and processes it. A retry that arrives while the turn is still being
+generated waits for it to finish (on the same worker through a shared future,
+across workers by polling the Redis record); a retry that arrives afterwards
+gets the ids of the stored messages. Only a full reply is recorded: a turn
+that failed, or whose reply was the fallback apology or cut short, releases its
+claim so a retry is answered properly. A released turn whose user message was
+already saved remembers that message's id, and the retry reuses the row
+instead of saving the message twice. If Redis is unreachable, deduplication
+falls back to the current worker only.
+"""
+import asyncio
+import uuid
+from typing import Dict, Optional
+from app.core.config import settings
+from app.core.redis_client import RedisClient, redis_client
+
+
+class TurnInProgressError(Exception):
+    """Raised when a retried turn is still generating after the wait timeout"""
+
+
+class TurnClaim:
+    """Result of ``TurnDeduplicator.acquire``.
+
+    ``owned`` claims must be finished with ``complete`` or ``release``; their
+    ``user_message_id`` is the saved user message of an earlier, released
+    attempt (if any). For claims that are not owned, ``record`` holds the
+    stored turn's message ids.
+    """
+
+    def __init__(
+        self,
+        deduplicator: "TurnDeduplicator",
+        key: str,
+        owned: bool,
+        record: Optional[Dict] = None,
+        user_message_id: Optional[str] = None,
+    ):
+        self.deduplicator = deduplicator
+        self.key = key
+        self.owned = owned
+        self.record = record
+        self.user_message_id = user_message_id
+
+    async def complete(self, user_message_id: uuid.UUID, message_id: uuid.UUID) -> None:
+        """Record the finished turn and wake up waiting retries"""
+        record = {
+            "status": "done",
+            "user_message_id": str(user_message_id),
+            "message_id": str(message_id),
+        }
+        await self.deduplicator.client.set(self.key, record, settings.IDEMPOTENCY_TTL)
+        self.deduplicator._finish(self.key, record)
+
+    async def release(self, user_message_id: Optional[uuid.UUID] = None) -> None:
+        """Give up the claim so a retry can process the turn.
+
+        ``user_message_id`` is the turn's user message if it was saved; the
+        retry reuses it.
+        """
+        client = self.deduplicator.client
+        if user_message_id is not None:
+            await client.set(
+                self.deduplicator._user_message_key(self.key),
+                str(user_message_id),
+                settings.IDEMPOTENCY_TTL,
+            )
+        await client.delete(self.key)
+        self.deduplicator._finish(self.key, None)
+
+
+class TurnDeduplicator:
+    """Single-flight deduplication of chat turns"""
+
+    PREFIX = "idempotency"
+
+    def __init__(self, client: RedisClient):
+        self.client = client
+        # Turns being processed on this worker, resolved with the done record
+        # (or None if the turn failed)
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    def _key(self, user_id: str, client_message_id: str) -> str:
+        return f"{self.PREFIX}:{user_id}:{client_message_id}"
+
+    def _user_message_key(self, key: str) -> str:
+        return f"{key}:user_message"
+
+    def _finish(self, key: str, record: Optional[Dict]) -> None:
+        future = self._inflight.pop(key, None)
+        if future is not None and not future.done():
+            future.set_result(record)
+
+    async def acquire(self, user_id: str, client_message_id: str) -> TurnClaim:
+        """Claim a turn, or wait for the request that already claimed it.
+
+        Raises ``TurnInProgressError`` if the original request is still running
+        after ``IDEMPOTENCY_WAIT_TIMEOUT`` seconds.
+        """
+        key = self._key(user_id, client_message_id)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.IDEMPOTENCY_WAIT_TIMEOUT
+
+        while True:
+            remaining = deadline - loop.time()
+
+            # Attach to a turn in flight on this worker
+            future = self._inflight.get(key)
+            if future is not None:
+                try:
+                    record = await asyncio.wait_for(
+                        asyncio.shield(future), max(remaining, 0)
+                    )
+                except asyncio.TimeoutError:
+                    raise TurnInProgressError("Message is still being processed")
+                if record is not None:
+                    return TurnClaim(self, key, owned=False, record=record)
+                continue  # Original failed; try to take the turn over
+
+            claimed = await self.client.set_nx(
+                key, {"status": "pending"}, settings.IDEMPOTENCY_PENDING_TTL
+            )
+            if claimed is not False:
+                # Claimed (or Redis unavailable: deduplicate on this worker only)
+                self._inflight[key] = loop.create_future()
+                user_message_id = await self.client.get(self._user_message_key(key))
+                return TurnClaim(self, key, owned=True, user_message_id=user_message_id)
+
+            record = await self.client.get(key)
+            if record and record.get("status") == "done":
+                return TurnClaim(self, key, owned=False, record=record)
+
+            if remaining <= 0:
+                raise TurnInProgressError("Message is still being processed")
+            # Claimed by another worker; poll until it finishes or is released
+            await asyncio.sleep(min(settings.IDEMPOTENCY_POLL_INTERVAL, remaining))
+
+
+turn_deduplicator = TurnDeduplicator(redis_client)
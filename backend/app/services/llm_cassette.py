@@ -0,0 +1,207 @@
+"""Record/replay LLM provider for offline performance runs.
+
+Selected with ``LLM_PROVIDER=cassette``:
+
+- ``LLM_CASSETTE_MODE=record`` forwards every call to the real
+  ``LLM_CASSETTE_UPSTREAM`` provider and appends the request, the response
+  chunks and the observed latencies to the JSONL cassette at
+  ``LLM_CASSETTE_PATH``.
+- ``LLM_CASSETTE_MODE=replay`` serves responses from the cassette with no
+  network access, after a synthetic time to first chunk and per-chunk delay
+  (or the recorded timings with ``LLM_REPLAY_USE_RECORDED_TIMING``).
+
+Requests are matched on a hash of the system prompt and messages; if that
+misses, on the last message alone, so replays survive small prompt changes.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import AsyncIterator, Dict, List, Optional
+
+from app.core.config import settings
+from app.services.llm_providers import LLMProvider, count_openai_tokens, create_provider
+
+
+class CassetteMissError(Exception):
+    """Raised in replay mode when no recorded response matches a request"""
+
+
+def _hash(payload) -> str:
+    return hashlib.sha256(
+        json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    ).hexdigest()
+
+
+def request_key(system_prompt: str, messages: List[Dict[str, str]]) -> str:
+    """Exact match key for a request"""
+    return _hash(
+        {
+            "system": system_prompt,
+            "messages": [[msg["role"], msg["content"]] for msg in messages],
+        }
+    )
+
+
+def last_message_key(messages: List[Dict[str, str]]) -> str:
+    """Loose match key: the message being answered"""
+    return _hash(messages[-1]["content"] if messages else "")
+
+
+class CassetteProvider(LLMProvider):
+    """Records real provider traffic to, or replays it from, a cassette file"""
+
+    name = "cassette"
+
+    def __init__(self, mode: str, path: str, upstream_name: str):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown LLM cassette mode: {mode}")
+        self.mode = mode
+        self.path = path
+        self.upstream_name = upstream_name
+        self.upstream: Optional[LLMProvider] = None
+
+        if mode == "record":
+            self.upstream = create_provider(upstream_name)
+            super().__init__(self.upstream.model)
+            self._write_lock = threading.Lock()  # Appends run in threads; one line at a time
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        else:
+            super().__init__(settings.LLM_MODEL)
+            self.entries: Dict[str, Dict] = {}
+            self.entries_by_last_message: Dict[str, Dict] = {}
+            self._load()
+
+    def count_tokens(self, text: str) -> int:
+        """Count tokens the way the upstream provider does"""
+        if self.upstream is not None:
+            return self.upstream.count_tokens(text)
+        if self.upstream_name == "openai":
+            return count_openai_tokens(text)
+        return super().count_tokens(text)
+
+    # Replay
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(f"LLM cassette not found: {self.path}")
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                self.entries[entry["key"]] = entry
+                self.entries_by_last_message[entry["last_message_key"]] = entry
+
+    def _lookup(self, system_prompt: str, messages: List[Dict[str, str]]) -> Dict:
+        entry = self.entries.get(request_key(system_prompt, messages))
+        if entry is None:
+            entry = self.entries_by_last_message.get(last_message_key(messages))
+        if entry is None:
+            raise CassetteMissError("No recorded LLM response matches this request")
+        return entry
+
+    def _replay_chunks(self, entry: Dict) -> List[str]:
+        if entry.get("chunks"):
+            return entry["chunks"]
+        response = entry["response"]
+        size = max(1, settings.LLM_REPLAY_CHUNK_CHARS)
+        return [response[i:i + size] for i in range(0, len(response), size)] or [""]
+
+    def _first_chunk_delay(self, entry: Dict) -> float:
+        if settings.LLM_REPLAY_USE_RECORDED_TIMING and entry.get("first_chunk_latency") is not None:
+            return entry["first_chunk_latency"]
+        return settings.LLM_REPLAY_LATENCY_MS / 1000
+
+    def _chunk_delay(self, entry: Dict, index: int) -> float:
+        delays = entry.get("chunk_delays")
+        if settings.LLM_REPLAY_USE_RECORDED_TIMING and delays and index < len(delays):
+            return delays[index]
+        return settings.LLM_REPLAY_CHUNK_DELAY_MS / 1000
+
+    # Recording
+
+    def _record(
+        self,
+        system_prompt: str,
+        messages: List[Dict[str, str]],
+        response: str,
+        chunks: Optional[List[str]],
+        first_chunk_latency: float,
+        chunk_delays: Optional[List[float]],
+    ) -> None:
+        entry = {
+            "key": request_key(system_prompt, messages),
+            "last_message_key": last_message_key(messages),
+            "upstream": self.upstream_name,
+            "model": self.model,
+            "system_prompt": system_prompt,
+            "messages": [{"role": m["role"], "content": m["content"]} for m in messages],
+            "response": response,
+            "chunks": chunks,
+            "first_chunk_latency": first_chunk_latency,
+            "chunk_delays": chunk_delays,
+            "recorded_at": time.time(),
+        }
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._write_lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+    # Provider interface
+
+    async def complete(self, system_prompt: str, messages: List[Dict[str, str]]) -> str:
+        if self.mode == "record":
+            started = time.monotonic()
+            response = await self.upstream.complete(system_prompt, messages)
+            # File writes run in a thread, off the event loop
+            await asyncio.to_thread(
+                self._record,
+                system_prompt, messages, response, None, time.monotonic() - started, None,
+            )
+            return response
+
+        entry = self._lookup(system_prompt, messages)
+        chunks = self._replay_chunks(entry)
+        delay = self._first_chunk_delay(entry) + sum(
+            self._chunk_delay(entry, i) for i in range(len(chunks) - 1)
+        )
+        await asyncio.sleep(delay)
+        return entry["response"]
+
+    async def stream(
+        self, system_prompt: str, messages: List[Dict[str, str]]
+    ) -> AsyncIterator[str]:
+        if self.mode == "record":
+            chunks, delays = [], []
+            started = last = time.monotonic()
+            first_chunk_latency = None
+            async for chunk in self.upstream.stream(system_prompt, messages):
+                now = time.monotonic()
+                if first_chunk_latency is None:
+                    first_chunk_latency = now - started
+                else:
+                    delays.append(now - last)
+                last = now
+                chunks.append(chunk)
+                yield chunk
+            await asyncio.to_thread(
+                self._record,
+                system_prompt,
+                messages,
+                "".join(chunks),
+                chunks,
+                first_chunk_latency if first_chunk_latency is not None else last - started,
+                delays,
+            )
+            return
+
+        entry = self._lookup(system_prompt, messages)
+        await asyncio.sleep(self._first_chunk_delay(entry))
+        for index, chunk in enumerate(self._replay_chunks(entry)):
+            if index:
+                await asyncio.sleep(self._chunk_delay(entry, index - 1))
+            yield chunk
@@ -0,0 +1,267 @@
+"""LLM provider clients.
+
+Every provider exposes the same non-blocking interface: ``complete`` returns the
+full reply and ``stream`` yields text chunks as they arrive. Providers use their
+native async client where one exists; blocking clients are run on a dedicated
+thread pool so a slow completion never stalls the event loop.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+import google.generativeai as genai
+import openai
+import tiktoken
+
+from app.core.config import settings
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+# Sentinel returned by next() on the executor once a blocking stream is exhausted
+_STREAM_DONE = object()
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str) -> tiktoken.Encoding:
+    """tiktoken encoder for ``model``, built once per process"""
+    return tiktoken.encoding_for_model(model)
+
+
+def count_openai_tokens(text: str) -> int:
+    """Count tokens in text with the GPT-4 tiktoken encoding"""
+    return len(get_encoding("gpt-4").encode(text))
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Thread pool reserved for blocking provider calls"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.LLM_EXECUTOR_WORKERS, thread_name_prefix="llm"
+        )
+    return _executor
+
+
+def shutdown_executor() -> None:
+    """Stop the provider thread pool (called on application shutdown)"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def is_rate_limit_error(exc: BaseException) -> bool:
+    """Whether a provider error is a 429 / quota exhaustion"""
+    if isinstance(exc, openai.RateLimitError):
+        return True
+    # google.api_core raises ResourceExhausted for Gemini 429s
+    if type(exc).__name__ == "ResourceExhausted":
+        return True
+    return getattr(exc, "status_code", None) == 429 or getattr(exc, "code", None) == 429
+
+
+class LLMProvider:
+    """Base class for LLM providers.
+
+    Subclasses implement the blocking ``_complete_sync`` / ``_stream_sync`` pair,
+    which the default ``complete`` / ``stream`` run on the provider thread pool.
+    Providers with a native async client override ``complete`` / ``stream``.
+    """
+
+    name = "base"
+
+    def __init__(self, model: str):
+        self.model = model
+
+    def count_tokens(self, text: str) -> int:
+        """Count tokens in text (rough estimation: 1 token ≈ 4 characters)"""
+        return len(text) // 4
+
+    async def complete(self, system_prompt: str, messages: List[Dict[str, str]]) -> str:
+        """Generate the full reply for a conversation"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            get_executor(), self._complete_sync, system_prompt, messages
+        )
+
+    async def stream(
+        self, system_prompt: str, messages: List[Dict[str, str]]
+    ) -> AsyncIterator[str]:
+        """Generate the reply for a conversation, yielding text chunks"""
+        loop = asyncio.get_running_loop()
+        executor = get_executor()
+        chunks = await loop.run_in_executor(
+            executor, lambda: iter(self._stream_sync(system_prompt, messages))
+        )
+        while True:
+            chunk = await loop.run_in_executor(executor, next, chunks, _STREAM_DONE)
+            if chunk is _STREAM_DONE:
+                break
+            yield chunk
+
+    def _complete_sync(self, system_prompt: str, messages: List[Dict[str, str]]) -> str:
+        raise NotImplementedError
+
+    def _stream_sync(
+        self, system_prompt: str, messages: List[Dict[str, str]]
+    ) -> Iterator[str]:
+        raise NotImplementedError
+
+
+class GeminiProvider(LLMProvider):
+    """Google Gemini via ``google-generativeai``.
+
+    Uses the library's grpc-asyncio methods (``send_message_async``) by default;
+    set ``GEMINI_USE_ASYNC=false`` to run the blocking client on the thread pool
+    instead.
+    """
+
+    name = "gemini"
+
+    def __init__(self, model: str, api_key: Optional[str]):
+        super().__init__(model)
+        genai.configure(api_key=api_key)
+        self.use_async = settings.GEMINI_USE_ASYNC
+
+    def _start_chat(
+        self, system_prompt: str, messages: List[Dict[str, str]]
+    ) -> Tuple[object, str, object]:
+        """Build the Gemini chat session and split off the message to send"""
+        # Convert messages to Gemini format
+        # Gemini uses "user" and "model" roles
+        gemini_history = []
+        for msg in messages[:-1]:  # All but last message
+            role = "user" if msg["role"] == "user" else "model"
+            gemini_history.append({
+                "role": role,
+                "parts": [msg["content"]]
+            })
+
+        # Configure generation
+        generation_config = genai.types.GenerationConfig(
+            max_output_tokens=settings.MAX_RESPONSE_TOKENS,
+            temperature=0.7,
+        )
+
+        # Create model with system instruction
+        model_with_system = genai.GenerativeModel(
+            self.model,
+            system_instruction=system_prompt
+        )
+
+        # Start chat with history
+        chat = model_with_system.start_chat(history=gemini_history)
+
+        last_message = messages[-1]["content"] if messages else ""
+        return chat, last_message, generation_config
+
+    def _complete_sync(self, system_prompt: str, messages: List[Dict[str, str]]) -> str:
+        chat, last_message, generation_config = self._start_chat(system_prompt, messages)
+        response = chat.send_message(last_message, generation_config=generation_config)
+        return response.text
+
+    def _stream_sync(
+        self, system_prompt: str, messages: List[Dict[str, str]]
+    ) -> Iterator[str]:
+        chat, last_message, generation_config = self._start_chat(system_prompt, messages)
+        response = chat.send_message(
+            last_message, generation_config=generation_config, stream=True
+        )
+        for chunk in response:
+            if chunk.text:
+                yield chunk.text
+
+    async def complete(self, system_prompt: str, messages: List[Dict[str, str]]) -> str:
+        if not self.use_async:
+            return await super().complete(system_prompt, messages)
+
+        chat, last_message, generation_config = self._start_chat(system_prompt, messages)
+        response = await chat.send_message_async(
+            last_message, generation_config=generation_config
+        )
+        return response.text
+
+    async def stream(
+        self, system_prompt: str, messages: List[Dict[str, str]]
+    ) -> AsyncIterator[str]:
+        if not self.use_async:
+            async for chunk in super().stream(system_prompt, messages):
+                yield chunk
+            return
+
+        chat, last_message, generation_config = self._start_chat(system_prompt, messages)
+        response = await chat.send_message_async(
+            last_message, generation_config=generation_config, stream=True
+        )
+        async for chunk in response:
+            if chunk.text:
+                yield chunk.text
+
+
+class OpenAIProvider(LLMProvider):
+    """OpenAI chat completions via the native ``AsyncOpenAI`` client"""
+
+    name = "openai"
+
+    def __init__(self, model: str, api_key: Optional[str]):
+        super().__init__(model)
+        self.client = openai.AsyncOpenAI(
+            api_key=api_key, timeout=settings.LLM_REQUEST_TIMEOUT
+        )
+
+    def count_tokens(self, text: str) -> int:
+        """Count tokens in text with tiktoken"""
+        return count_openai_tokens(text)
+
+    def _build_messages(
+        self, system_prompt: str, messages: List[Dict[str, str]]
+    ) -> List[Dict[str, str]]:
+        # Only role/content go to the API; context messages carry extra keys
+        return [{"role": "system", "content": system_prompt}] + [
+            {"role": msg["role"], "content": msg["content"]} for msg in messages
+        ]
+
+    async def complete(self, system_prompt: str, messages: List[Dict[str, str]]) -> str:
+        response = await self.client.chat.completions.create(
+            model=self.model,
+            messages=self._build_messages(system_prompt, messages),
+            max_tokens=settings.MAX_RESPONSE_TOKENS,
+        )
+        return response.choices[0].message.content
+
+    async def stream(
+        self, system_prompt: str, messages: List[Dict[str, str]]
+    ) -> AsyncIterator[str]:
+        stream = await self.client.chat.completions.create(
+            model=self.model,
+            messages=self._build_messages(system_prompt, messages),
+            max_tokens=settings.MAX_RESPONSE_TOKENS,
+            stream=True,
+        )
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            text = chunk.choices[0].delta.content
+            if text:
+                yield text
+
+
+def create_provider(name: str, model: Optional[str] = None) -> LLMProvider:
+    """Create the provider client for ``name`` ("gemini", "openai" or "cassette")"""
+    if name == "gemini":
+        return GeminiProvider(model or settings.LLM_MODEL, settings.GEMINI_API_KEY)
+    if name == "openai":
+        return OpenAIProvider(
+            model or settings.LLM_MODEL or "gpt-4-turbo-preview", settings.OPENAI_API_KEY
+        )
+    if name == "cassette":
+        # Record/replay for offline performance runs
+        from app.services.llm_cassette import CassetteProvider
+
+        return CassetteProvider(
+            settings.LLM_CASSETTE_MODE,
+            settings.LLM_CASSETTE_PATH,
+            settings.LLM_CASSETTE_UPSTREAM,
+        )
+    raise ValueError(f"Unknown LLM provider: {name}")
@@ -0,0 +1,422 @@
+"""Multi-provider routing for LLM calls.
+
+``ProviderRouter`` exposes the same ``complete`` / ``stream`` interface as a
+single provider and adds, per provider, a circuit breaker and a rolling latency
+window:
+
+- Providers whose breaker is open are skipped until their cooldown passes.
+- If the first provider has not answered (or, when streaming, produced its first
+  chunk) by its recent p95 latency, the same request is hedged to the next
+  provider and whichever answers first wins.
+- If a provider fails, the request fails over to the next one.
+
+Every provider call, including hedges and failovers, takes its request and
+estimated tokens from that provider's shared quota (``cluster_rate_limiter``)
+and a slot from that provider's adaptive concurrency limit on this worker. Each
+call is bounded by ``LLM_REQUEST_TIMEOUT`` (per chunk when streaming).
+
+Once a stream has produced its first chunk it is committed to that provider;
+a failure after that point is not retried elsewhere.
+"""
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.services.llm_providers import LLMProvider, create_provider, is_rate_limit_error
+from app.services.rate_limiter import (
+    AdaptiveConcurrencyLimiter,
+    RateLimitExceededError,
+    cluster_rate_limiter,
+)
+
+
+class ProviderUnavailableError(Exception):
+    """Raised when every provider's circuit breaker is open"""
+
+
+class SlotUnavailableError(Exception):
+    """Raised when a call got no quota or call slot in time (it was never sent)"""
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker.
+
+    Opens after ``failure_threshold`` consecutive failures. Once
+    ``reset_timeout`` seconds have passed it lets a single trial request through
+    (half-open); the trial's outcome closes or re-opens the breaker.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+
+    def is_available(self) -> bool:
+        """Whether a request may be sent now (does not change state)"""
+        if self.state == self.CLOSED:
+            return True
+        # Open: only once cooled down. Half-open: the trial is still in flight
+        return self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout
+
+    def record_attempt(self) -> None:
+        """A request is being sent; a cooled-down open breaker becomes half-open"""
+        if self.state == self.OPEN:
+            self.state = self.HALF_OPEN
+
+    def record_success(self) -> None:
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def record_cancelled(self) -> None:
+        """A request was cancelled (lost a hedge race) or never sent before it finished"""
+        if self.state == self.HALF_OPEN:
+            # The trial never completed; let the next request try again
+            self.state = self.OPEN
+
+
+class LatencyTracker:
+    """Rolling window of recent successful call latencies"""
+
+    def __init__(self, window: int):
+        self.samples = deque(maxlen=window)
+
+    def record(self, seconds: float) -> None:
+        self.samples.append(seconds)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        """Latency at ``pct`` (0-100), or None until enough samples exist"""
+        if len(self.samples) < settings.LLM_HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(len(ordered) * pct / 100))
+        return ordered[index]
+
+
+class _CallSlot:
+    """An acquired provider call slot; measures the call's latency"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.latency: Optional[float] = None
+
+    def first_chunk(self) -> None:
+        """Streams report latency to the first chunk rather than to the end"""
+        if self.latency is None:
+            self.latency = time.monotonic() - self.started
+
+
+class _Route:
+    """A provider with its breaker, latency windows and concurrency limit"""
+
+    def __init__(self, provider: LLMProvider):
+        self.provider = provider
+        self.breaker = CircuitBreaker(
+            settings.LLM_BREAKER_FAILURE_THRESHOLD, settings.LLM_BREAKER_RESET_TIMEOUT
+        )
+        self.complete_latency = LatencyTracker(settings.LLM_LATENCY_WINDOW)
+        self.first_chunk_latency = LatencyTracker(settings.LLM_LATENCY_WINDOW)
+        # Bounds in-flight calls to this provider, adapting to its latency
+        self.concurrency = AdaptiveConcurrencyLimiter(
+            settings.LLM_AIMD_MIN_CONCURRENCY, settings.LLM_MAX_CONCURRENCY
+        )
+
+    @asynccontextmanager
+    async def slot(self, estimated_tokens: int):
+        """Take the call from this provider's shared quota, then wait (bounded
+        by LLM_QUEUE_TIMEOUT) for a free call slot on this worker.
+
+        On exit the slot reports the call's latency, or congestion for 429s and
+        timeouts, to the provider's adaptive concurrency limit.
+        """
+        try:
+            await cluster_rate_limiter.acquire(self.provider.name, estimated_tokens)
+            await self.concurrency.acquire(settings.LLM_QUEUE_TIMEOUT)
+        except RateLimitExceededError as e:
+            raise SlotUnavailableError(str(e)) from e
+        except asyncio.TimeoutError as e:
+            raise SlotUnavailableError(f"No free call slot for {self.provider.name}") from e
+        slot = _CallSlot()
+        try:
+            yield slot
+        except Exception as e:
+            congested = isinstance(e, asyncio.TimeoutError) or is_rate_limit_error(e)
+            await self.concurrency.release(congested=congested)
+            raise
+        except BaseException:
+            # Cancelled or closed by the caller: no signal about the provider
+            await self.concurrency.release()
+            raise
+        else:
+            if slot.latency is None:
+                slot.latency = time.monotonic() - slot.started
+            await self.concurrency.release(latency=slot.latency)
+
+    def record_error(self, error: BaseException) -> None:
+        """Count a failed call against the breaker unless it was never sent"""
+        if isinstance(error, SlotUnavailableError):
+            self.breaker.record_cancelled()
+        else:
+            self.breaker.record_failure()
+
+
+def _hedge_delay(tracker: LatencyTracker) -> float:
+    """How long to wait on a provider before hedging to the next one"""
+    observed = tracker.percentile(settings.LLM_HEDGE_PERCENTILE)
+    if observed is None:
+        return settings.LLM_HEDGE_MAX_DELAY
+    return min(max(observed, settings.LLM_HEDGE_MIN_DELAY), settings.LLM_HEDGE_MAX_DELAY)
+
+
+class ProviderRouter:
+    """Routes calls across providers in priority order (first is primary)"""
+
+    def __init__(self, providers: List[LLMProvider]):
+        self.routes = [_Route(provider) for provider in providers]
+        self.primary = providers[0]
+        self.model = self.primary.model
+
+    def count_tokens(self, text: str) -> int:
+        return self.primary.count_tokens(text)
+
+    def _available_routes(self) -> List[_Route]:
+        routes = [route for route in self.routes if route.breaker.is_available()]
+        if not routes:
+            raise ProviderUnavailableError("All LLM providers are unavailable")
+        return routes
+
+    def _hedging(self, routes: List[_Route]) -> bool:
+        return settings.LLM_HEDGING_ENABLED and len(routes) > 1
+
+    async def _timed_complete(
+        self,
+        route: _Route,
+        system_prompt: str,
+        messages: List[Dict[str, str]],
+        estimated_tokens: int,
+    ) -> str:
+        try:
+            async with route.slot(estimated_tokens) as slot:
+                response = await asyncio.wait_for(
+                    route.provider.complete(system_prompt, messages),
+                    settings.LLM_REQUEST_TIMEOUT,
+                )
+        except asyncio.CancelledError:
+            route.breaker.record_cancelled()
+            raise
+        except Exception as e:
+            route.record_error(e)
+            raise
+        route.breaker.record_success()
+        route.complete_latency.record(slot.latency)
+        return response
+
+    async def complete(
+        self, system_prompt: str, messages: List[Dict[str, str]], estimated_tokens: int
+    ) -> str:
+        """The first successful completion; ``estimated_tokens`` (prompt plus
+        response) is taken from the quota of each provider called"""
+        routes = self._available_routes()
+        hedging = self._hedging(routes)
+        tasks: Dict[asyncio.Task, _Route] = {}
+        next_index = 0
+        last_error: Optional[BaseException] = None
+
+        def launch() -> None:
+            nonlocal next_index
+            route = routes[next_index]
+            next_index += 1
+            route.breaker.record_attempt()
+            task = asyncio.create_task(
+                self._timed_complete(route, system_prompt, messages, estimated_tokens)
+            )
+            tasks[task] = route
+
+        launch()
+        pending = set(tasks)
+        try:
+            while pending:
+                timeout = None
+                if hedging and len(pending) == 1 and next_index < len(routes):
+                    timeout = _hedge_delay(tasks[next(iter(pending))].complete_latency)
+
+                done, pending = await asyncio.wait(
+                    pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    # Slower than its p95: hedge to the next provider
+                    launch()
+                    pending = {task for task in tasks if not task.done()}
+                    continue
+
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    last_error = task.exception()
+                    print(f"LLM provider {tasks[task].provider.name} failed: {last_error!r}")
+
+                if not pending and next_index < len(routes):
+                    # Fail over to the next provider
+                    launch()
+                    pending = {task for task in tasks if not task.done()}
+        finally:
+            for task in pending:
+                task.cancel()
+
+        raise last_error
+
+    async def _slotted_stream(
+        self,
+        route: _Route,
+        system_prompt: str,
+        messages: List[Dict[str, str]],
+        estimated_tokens: int,
+    ) -> AsyncIterator[str]:
+        """A provider's stream, holding a call slot until it ends or is closed"""
+        async with route.slot(estimated_tokens) as slot:
+            chunks = route.provider.stream(system_prompt, messages)
+            try:
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(anext(chunks), settings.LLM_REQUEST_TIMEOUT)
+                    except StopAsyncIteration:
+                        break
+                    if slot.latency is None:
+                        slot.first_chunk()
+                        route.first_chunk_latency.record(slot.latency)
+                    yield chunk
+            finally:
+                await chunks.aclose()
+
+    async def _first_chunk(self, route: _Route, chunks: AsyncIterator[str]) -> Optional[str]:
+        """First chunk of a stream (None if it ended without any text)"""
+        try:
+            return await anext(chunks, None)
+        except asyncio.CancelledError:
+            route.breaker.record_cancelled()
+            raise
+        except Exception as e:
+            route.record_error(e)
+            raise
+
+    async def stream(
+        self, system_prompt: str, messages: List[Dict[str, str]], estimated_tokens: int
+    ) -> AsyncIterator[str]:
+        """Chunks from the first provider to start streaming; ``estimated_tokens``
+        is taken from the quota of each provider called"""
+        routes = self._available_routes()
+        hedging = self._hedging(routes)
+        # Race on the first chunk; each task is tied to its provider's stream
+        tasks: Dict[asyncio.Task, Tuple[_Route, AsyncIterator[str]]] = {}
+        next_index = 0
+        last_error: Optional[BaseException] = None
+        winner: Optional[asyncio.Task] = None
+
+        def launch() -> None:
+            nonlocal next_index
+            route = routes[next_index]
+            next_index += 1
+            route.breaker.record_attempt()
+            chunks = self._slotted_stream(route, system_prompt, messages, estimated_tokens)
+            task = asyncio.create_task(self._first_chunk(route, chunks))
+            tasks[task] = (route, chunks)
+
+        launch()
+        pending = set(tasks)
+        try:
+            while pending and winner is None:
+                timeout = None
+                if hedging and len(pending) == 1 and next_index < len(routes):
+                    route, _ = tasks[next(iter(pending))]
+                    timeout = _hedge_delay(route.first_chunk_latency)
+
+                done, pending = await asyncio.wait(
+                    pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    # No first chunk by its p95: hedge to the next provider
+                    launch()
+                    pending = {task for task in tasks if not task.done()}
+                    continue
+
+                for task in done:
+                    if task.exception() is None:
+                        winner = task
+                        break
+                    last_error = task.exception()
+                    route, _ = tasks[task]
+                    print(f"LLM provider {route.provider.name} failed: {last_error!r}")
+
+                if winner is None and not pending and next_index < len(routes):
+                    # Fail over to the next provider
+                    launch()
+                    pending = {task for task in tasks if not task.done()}
+        finally:
+            # Stop the losers; their streams can only be closed once the
+            # cancelled tasks have finished running them
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            for task, (_, chunks) in tasks.items():
+                if task is not winner:
+                    await chunks.aclose()
+
+        if winner is None:
+            raise last_error
+
+        route, chunks = tasks[winner]
+        try:
+            first = winner.result()
+            if first is not None:
+                yield first
+                async for chunk in chunks:
+                    yield chunk
+        except Exception:
+            route.breaker.record_failure()
+            raise
+        finally:
+            await chunks.aclose()
+        route.breaker.record_success()
+
+    def status(self) -> List[Dict]:
+        """Breaker state, recent latency percentiles and concurrency limit per provider"""
+        return [
+            {
+                "provider": route.provider.name,
+                "model": route.provider.model,
+                "breaker": route.breaker.state,
+                "consecutive_failures": route.breaker.failures,
+                "p95_latency": route.complete_latency.percentile(95),
+                "p95_first_chunk_latency": route.first_chunk_latency.percentile(95),
+                "concurrency": route.concurrency.status(),
+            }
+            for route in self.routes
+        ]
+
+
+def create_router() -> ProviderRouter:
+    """Router over ``LLM_PROVIDER`` followed by ``LLM_FALLBACK_PROVIDERS``"""
+    providers = [create_provider(settings.LLM_PROVIDER)]
+    fallback_models = {
+        "gemini": settings.GEMINI_FALLBACK_MODEL,
+        "openai": settings.OPENAI_FALLBACK_MODEL,
+    }
+    for name in settings.LLM_FALLBACK_PROVIDERS.split(","):
+        name = name.strip()
+        if name and name != settings.LLM_PROVIDER:
+            providers.append(create_provider(name, fallback_models.get(name)))
+    return ProviderRouter(providers)
@@ -1,131 +1,116 @@
-import google.generativeai as genai
-import openai
-from typing import List, Dict, Optional
+from typing import AsyncIterator, List, Dict, Optional, Tuple
 from app.core.config import settings
-from app.utils.protocols import find_relevant_protocol
-import tiktoken
+from app.services.llm_router import create_router
+from app.utils.context_window import find_cut_index, history_budget
+from app.services.prompt_builder import PromptAssembler
+from app.services.response_cache import response_cache
+from app.utils.protocols import find_relevant_protocol_ids, get_protocol_texts
+
+FALLBACK_RESPONSE = (
+    "I apologize, but I'm having trouble responding right now. Please try again "
+    "in a moment. If this persists, please contact support."
+)
+
+
+def _set_complete(reply_status: Optional[Dict], complete: bool) -> None:
+    if reply_status is not None:
+        reply_status["complete"] = complete
 
 
 class LLMService:
     def __init__(self):
         self.provider = settings.LLM_PROVIDER
-        if self.provider == "gemini":
-            genai.configure(api_key=settings.GEMINI_API_KEY)
-            self.client = genai.GenerativeModel(settings.LLM_MODEL)
-            self.model = settings.LLM_MODEL
-        elif self.provider == "openai":
-            self.client = openai.OpenAI(api_key=settings.OPENAI_API_KEY)
-            self.model = settings.LLM_MODEL or "gpt-4-turbo-preview"
+        # Routes across LLM_PROVIDER and any LLM_FALLBACK_PROVIDERS
+        self.client = create_router()
+        self.model = self.client.model
+        self.prompt_assembler = PromptAssembler(self.count_tokens)
 
     def count_tokens(self, text: str) -> int:
         """Count tokens in text"""
         try:
-            if self.provider == "gemini":
-                # Rough estimation for Gemini (1 token ≈ 4 characters)
-                return len(text) // 4
-            else:
-                encoding = tiktoken.encoding_for_model("gpt-4")
-                return len(encoding.encode(text))
+            return self.client.count_tokens(text)
         except Exception:
             # Fallback estimation
             return len(text) // 4
 
-    def trim_conversation_history(
-        self, messages: List[Dict[str, str]], max_tokens: int
-    ) -> List[Dict[str, str]]:
-        """Trim conversation history to fit within token limit"""
-        total_tokens = sum(self.count_tokens(msg["content"]) for msg in messages)
-
-        if total_tokens <= max_tokens:
-            return messages
+    def message_tokens(self, message: Dict) -> int:
+        """Token count of a context message, using the stored count when present"""
+        tokens = message.get("tokens")
+        if tokens is None:
+            tokens = self.count_tokens(message["content"])
+        return tokens
 
-        # Keep system message and recent messages
-        trimmed = []
-        current_tokens = 0
-
-        # Always keep system message if present
+    def trim_conversation_history(
+        self, messages: List[Dict], max_tokens: int, reserved_tokens: int = 0
+    ) -> List[Dict]:
+        """Trim conversation history to fit within token limit.
+
+        Keeps the most recent messages whose total fits in ``max_tokens`` minus
+        ``reserved_tokens`` (system prompt, response). A leading system message
+        is always kept and counted against the budget, as is the latest message.
+        """
+        head = []
         if messages and messages[0]["role"] == "system":
-            trimmed.append(messages[0])
-            current_tokens += self.count_tokens(messages[0]["content"])
+            head = messages[:1]
+            reserved_tokens += self.message_tokens(messages[0])
             messages = messages[1:]
 
-        # Add messages from most recent, working backwards
-        for msg in reversed(messages):
-            msg_tokens = self.count_tokens(msg["content"])
-            if current_tokens + msg_tokens <= max_tokens:
-                trimmed.insert(1 if trimmed and trimmed[0]["role"] == "system" else 0, msg)
-                current_tokens += msg_tokens
-            else:
-                break
+        budget = history_budget(max_tokens, reserved_tokens)
+        cut = find_cut_index([self.message_tokens(msg) for msg in messages], budget)
 
-        return trimmed
+        if not head:
+            return messages[cut:]
+        return head + messages[cut:]
 
     def create_system_prompt(
         self,
         user_info: Optional[Dict] = None,
         memories: Optional[List[str]] = None,
         protocols: Optional[str] = None,
+        summary: Optional[str] = None,
     ) -> str:
-        """Create system prompt with context"""
-        base_prompt = """You are Disha, India's first AI health coach. You are warm, empathetic, and knowledgeable about health and wellness.
-
-**Your Role:**
-- Provide personalized health guidance and support
-- Help users understand their health concerns
-- Offer evidence-based wellness advice
-- Be a supportive companion on their health journey
-
-**Communication Style:**
-- Warm and conversational, like chatting with a trusted friend on WhatsApp
-- Use simple, easy-to-understand language
-- Show empathy and understanding
-- Ask follow-up questions to better understand concerns
-- Be encouraging and supportive
-- Use appropriate emojis occasionally to be friendly (but don't overdo it)
-
-**Important Guidelines:**
-- You are NOT a replacement for professional medical care
-- For serious symptoms, always recommend consulting a healthcare provider
-- For emergencies (severe chest pain, difficulty breathing, etc.), advise calling emergency services
-- Be honest about the limitations of AI health coaching
-- Focus on prevention, lifestyle, and general wellness
-- Provide information, not diagnosis
-
-**Safety First:**
-- If symptoms suggest serious condition: recommend immediate medical attention
-- If user is in crisis: provide crisis helpline numbers and urge professional help
-- Never provide specific medication dosages or change existing prescriptions
-"""
-
-        # Add user context
-        if user_info:
-            user_context = "\n**User Information:**\n"
-            if user_info.get("name"):
-                user_context += f"- Name: {user_info['name']}\n"
-            if user_info.get("age"):
-                user_context += f"- Age: {user_info['age']}\n"
-            if user_info.get("gender"):
-                user_context += f"- Gender: {user_info['gender']}\n"
-            if user_info.get("medical_conditions"):
-                user_context += f"- Medical Conditions: {', '.join(user_info['medical_conditions'])}\n"
-            if user_info.get("medications"):
-                user_context += f"- Current Medications: {', '.join(user_info['medications'])}\n"
-            if user_info.get("allergies"):
-                user_context += f"- Allergies: {', '.join(user_info['allergies'])}\n"
-            base_prompt += user_context
-
-        # Add memories
-        if memories:
-            memory_context = "\n**What You Remember About This User:**\n"
-            for memory in memories:
-                memory_context += f"- {memory}\n"
-            base_prompt += memory_context
-
-        # Add relevant protocols
-        if protocols:
-            base_prompt += f"\n**Relevant Medical Protocols:**\n{protocols}\n"
-
-        return base_prompt
+        """Create system prompt with context (within the per-section token quotas)"""
+        prompt, _ = self.prompt_assembler.assemble(
+            user_info, memories, [protocols] if protocols else None, summary
+        )
+        return prompt
+
+    def _prepare_history(
+        self, messages: List[Dict], system_tokens: int, report: Dict
+    ) -> List[Dict]:
+        """Trim conversation to its budget: the history quota, capped by what the
+        context window has left after the system prompt and the response"""
+        budget = min(
+            settings.PROMPT_QUOTA_HISTORY,
+            history_budget(
+                settings.MAX_CONTEXT_TOKENS, system_tokens, settings.MAX_RESPONSE_TOKENS
+            ),
+        )
+        history = self.trim_conversation_history(messages, budget)
+        report["history"] = {
+            "quota": budget,
+            "tokens": sum(self.message_tokens(msg) for msg in history),
+            "items": len(history),
+            "dropped": len(messages) - len(history),
+        }
+        report["response_reserve"] = settings.MAX_RESPONSE_TOKENS
+        return history
+
+    def _estimate_call_tokens(self, report: Dict) -> int:
+        """Tokens a call may use against the provider quota: prompt plus response"""
+        return report["system_tokens"] + report["history"]["tokens"] + settings.MAX_RESPONSE_TOKENS
+
+    def _build_prompt(
+        self,
+        user_info: Optional[Dict],
+        memories: Optional[List[str]],
+        protocol_ids: List[str],
+        summary: Optional[str] = None,
+    ) -> Tuple[str, Dict]:
+        """Build the system prompt for a turn; returns (prompt, budget report)"""
+        return self.prompt_assembler.assemble(
+            user_info, memories, get_protocol_texts(protocol_ids), summary
+        )
 
     async def generate_response(
         self,
@@ -133,75 +118,139 @@ class LLMService:
         user_info: Optional[Dict] = None,
         memories: Optional[List[str]] = None,
         user_message: Optional[str] = None,
+        summary: Optional[str] = None,
+        budget_report: Optional[Dict] = None,
+        protocol_ids: Optional[List[str]] = None,
+        reply_status: Optional[Dict] = None,
     ) -> str:
-        """Generate AI response"""
+        """Generate AI response.
+
+        If ``budget_report`` is given, it is filled with how the prompt's token
+        budget was spent per section (see ``PromptAssembler.assemble``).
+        ``protocol_ids`` are the protocols already matched to ``user_message``;
+        without them they are looked up here. If ``reply_status`` is given,
+        ``reply_status["complete"]`` says whether the reply is a full answer
+        (False for the fallback apology or an empty reply).
+        """
+        _set_complete(reply_status, False)
         try:
-            # Find relevant protocols
-            protocols = ""
-            if user_message:
-                protocols = find_relevant_protocol(user_message)
-
-            # Create system prompt
-            system_prompt = self.create_system_prompt(user_info, memories, protocols)
-
-            # Prepare messages
-            if self.provider == "gemini":
-                # Trim conversation to fit context window
-                available_tokens = settings.MAX_CONTEXT_TOKENS - self.count_tokens(system_prompt)
-                trimmed_messages = self.trim_conversation_history(messages, available_tokens)
-
-                # Convert messages to Gemini format
-                # Gemini uses "user" and "model" roles
-                gemini_history = []
-                for i, msg in enumerate(trimmed_messages[:-1]):  # All but last message
-                    role = "user" if msg["role"] == "user" else "model"
-                    gemini_history.append({
-                        "role": role,
-                        "parts": [msg["content"]]
-                    })
-
-                # Configure generation
-                generation_config = genai.types.GenerationConfig(
-                    max_output_tokens=settings.MAX_RESPONSE_TOKENS,
-                    temperature=0.7,
-                )
-
-                # Create model with system instruction
-                model_with_system = genai.GenerativeModel(
-                    self.model,
-                    system_instruction=system_prompt
-                )
-
-                # Start chat with history
-                chat = model_with_system.start_chat(history=gemini_history)
-
-                # Send the last message and get response
-                last_message = trimmed_messages[-1]["content"] if trimmed_messages else ""
-                response = chat.send_message(
-                    last_message,
-                    generation_config=generation_config
-                )
-                return response.text
-
-            elif self.provider == "openai":
-                # Prepare messages with system prompt
-                full_messages = [{"role": "system", "content": system_prompt}] + messages
-
-                # Trim to fit context
-                trimmed_messages = self.trim_conversation_history(
-                    full_messages, settings.MAX_CONTEXT_TOKENS
-                )
-
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=trimmed_messages,
-                    max_tokens=settings.MAX_RESPONSE_TOKENS,
-                )
-                return response.choices[0].message.content
+            if protocol_ids is None:
+                protocol_ids = find_relevant_protocol_ids(user_message) if user_message else []
+
+            # Policy/protocol FAQ answers may be served from the response cache
+            cache_key = response_cache.make_key(
+                user_message, protocol_ids, user_info, memories, summary
+            )
+            if cache_key:
+                cached = await response_cache.get(cache_key)
+                if cached:
+                    _set_complete(reply_status, True)
+                    return cached
+
+            system_prompt, report = self._build_prompt(user_info, memories, protocol_ids, summary)
+            history = self._prepare_history(messages, report["system_tokens"], report)
+            if budget_report is not None:
+                budget_report.update(report)
+
+            # Each provider called takes its own quota and call slot (see llm_router)
+            response = await self.client.complete(
+                system_prompt, history, self._estimate_call_tokens(report)
+            )
+
+            if cache_key and response:
+                await response_cache.set(cache_key, response)
+            _set_complete(reply_status, bool(response))
+            return response
 
         except Exception as e:
-            print(f"LLM Error: {e}")
-            return "I apologize, but I'm having trouble responding right now. Please try again in a moment. If this persists, please contact support."
+            print(f"LLM Error: {type(e).__name__}: {e}")
+            return FALLBACK_RESPONSE
+
+    async def stream_response(
+        self,
+        messages: List[Dict[str, str]],
+        user_info: Optional[Dict] = None,
+        memories: Optional[List[str]] = None,
+        user_message: Optional[str] = None,
+        summary: Optional[str] = None,
+        budget_report: Optional[Dict] = None,
+        protocol_ids: Optional[List[str]] = None,
+        reply_status: Optional[Dict] = None,
+    ) -> AsyncIterator[str]:
+        """Generate AI response, yielding text chunks as the provider produces them.
+
+        Takes the same arguments as ``generate_response``. If the provider fails
+        before anything was streamed, the fallback apology is yielded instead;
+        a failure mid-stream ends the stream with what was already sent. Either
+        way ``reply_status["complete"]`` is False. Each wait for the next chunk
+        is bounded by ``LLM_REQUEST_TIMEOUT``. Cached answers are yielded as a
+        single chunk.
+        """
+        _set_complete(reply_status, False)
+        parts = []
+        try:
+            if protocol_ids is None:
+                protocol_ids = find_relevant_protocol_ids(user_message) if user_message else []
+
+            cache_key = response_cache.make_key(
+                user_message, protocol_ids, user_info, memories, summary
+            )
+            if cache_key:
+                cached = await response_cache.get(cache_key)
+                if cached:
+                    yield cached
+                    _set_complete(reply_status, True)
+                    return
+
+            system_prompt, report = self._build_prompt(user_info, memories, protocol_ids, summary)
+            history = self._prepare_history(messages, report["system_tokens"], report)
+            if budget_report is not None:
+                budget_report.update(report)
+
+            chunks = self.client.stream(system_prompt, history, self._estimate_call_tokens(report))
+            try:
+                async for text in chunks:
+                    parts.append(text)
+                    yield text
+            finally:
+                await chunks.aclose()
+
+            # Only complete streams are cached
+            if cache_key and parts:
+                await response_cache.set(cache_key, "".join(parts))
+            _set_complete(reply_status, bool(parts))
+
+        except Exception as e:
+            print(f"LLM Streaming Error: {type(e).__name__}: {e}")
+            if not parts:
+                yield FALLBACK_RESPONSE
+
+    async def summarize_conversation(
+        self, previous_summary: Optional[str], messages: List[Dict[str, str]]
+    ) -> str:
+        """Fold conversation turns into a running summary.
+
+        Raises on provider errors so a failed fold never overwrites the
+        stored summary.
+        """
+        transcript = "\n".join(
+            f"{'User' if msg['role'] == 'user' else 'Disha'}: {msg['content']}"
+            for msg in messages
+        )
+        system_prompt = f"""You maintain a running summary of a conversation between a user and Disha, an AI health coach.
+Update the existing summary with the new conversation turns. Keep health details (symptoms, conditions, medications, allergies, advice given, follow-ups), personal facts and preferences; drop greetings and small talk.
+Write concise bullet points, at most {settings.SUMMARY_MAX_WORDS} words in total. Reply with the updated summary only."""
+        request = (
+            f"Existing summary:\n{previous_summary or '(none)'}\n\n"
+            f"New conversation turns:\n{transcript}"
+        )
+
+        estimated_tokens = (
+            self.count_tokens(system_prompt) + self.count_tokens(request) + settings.MAX_RESPONSE_TOKENS
+        )
+        return await self.client.complete(
+            system_prompt, [{"role": "user", "content": request}], estimated_tokens
+        )
 
     async def generate_onboarding_message(self) -> str:
         """Generate initial onboarding message"""
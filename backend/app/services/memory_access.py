@@ -0,0 +1,111 @@
+"""Write-behind buffer for memory access statistics.
+
+Retrieving memories for a turn used to update ``access_count`` and
+``last_accessed`` on each returned row and commit, a write transaction on the
+read path of every turn. Accesses are now counted in memory and written every
+``MEMORY_ACCESS_FLUSH_INTERVAL`` seconds with one bulk
+``UPDATE ... FROM (VALUES ...)`` per batch of rows, and once more on shutdown.
+A crash loses at most one interval of access statistics, which only feed
+memory ranking.
+"""
+import asyncio
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.memory import Memory
+
+
+class MemoryAccessBuffer:
+    """Accumulates memory accesses and flushes them to Postgres in bulk"""
+
+    def __init__(self):
+        # memory id -> (accesses, latest access)
+        self._pending: Dict[str, Tuple[int, datetime]] = {}
+        self._lock = threading.Lock()  # Flushes run on a worker thread
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, memories: Iterable[Memory]) -> None:
+        """Count one access to each memory"""
+        now = datetime.utcnow()
+        with self._lock:
+            for memory in memories:
+                key = str(memory.id)
+                hits, _ = self._pending.get(key, (0, now))
+                self._pending[key] = (hits + 1, now)
+
+    def _restore(self, batch: Dict[str, Tuple[int, datetime]]) -> None:
+        """Put back accesses from a failed flush"""
+        with self._lock:
+            for key, (hits, accessed) in batch.items():
+                pending_hits, pending_accessed = self._pending.get(key, (0, accessed))
+                self._pending[key] = (pending_hits + hits, max(pending_accessed, accessed))
+
+    def flush(self) -> int:
+        """Write buffered accesses to the database; returns the rows updated"""
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return 0
+
+        items = list(batch.items())
+        db = SessionLocal()
+        try:
+            for start in range(0, len(items), settings.MEMORY_ACCESS_FLUSH_BATCH):
+                self._update(db, items[start:start + settings.MEMORY_ACCESS_FLUSH_BATCH])
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"Memory access flush error: {e}")
+            self._restore(batch)
+            return 0
+        finally:
+            db.close()
+        return len(items)
+
+    def _update(self, db, items: List[Tuple[str, Tuple[int, datetime]]]) -> None:
+        values = []
+        params = {}
+        for i, (memory_id, (hits, accessed)) in enumerate(items):
+            values.append(
+                f"(CAST(:id{i} AS uuid), CAST(:hits{i} AS double precision), "
+                f"CAST(:accessed{i} AS timestamp))"
+            )
+            params.update({f"id{i}": memory_id, f"hits{i}": hits, f"accessed{i}": accessed})
+
+        db.execute(
+            text(
+                "UPDATE memories AS m "
+                "SET access_count = COALESCE(m.access_count, 0) + v.hits, "
+                "last_accessed = GREATEST(m.last_accessed, v.accessed) "
+                f"FROM (VALUES {', '.join(values)}) AS v(id, hits, accessed) "
+                "WHERE m.id = v.id"
+            ),
+            params,
+        )
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(settings.MEMORY_ACCESS_FLUSH_INTERVAL)
+            await loop.run_in_executor(None, self.flush)
+
+    def start(self) -> None:
+        """Start periodic flushing (called on application startup)"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop periodic flushing and write what is left (called on shutdown)"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await asyncio.get_running_loop().run_in_executor(None, self.flush)
+
+
+memory_access_buffer = MemoryAccessBuffer()
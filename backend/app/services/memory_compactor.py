@@ -0,0 +1,161 @@
+"""Per-user memory cap with decay-based eviction.
+
+Each memory has a retention score: its importance, faded by the time since it
+was last used (``MEMORY_DECAY_HALF_LIFE_DAYS``, never below
+``MEMORY_DECAY_FLOOR`` of the importance), plus a bonus that grows with how
+often it has been retrieved. Users with more than ``MEMORY_MAX_PER_USER``
+active memories have their lowest-scoring ones archived (or deleted, with
+``MEMORY_EVICTION_MODE=delete``) in bulk, so what retrieval scans per user
+stays bounded however long they have used the coach.
+
+The compactor runs every ``MEMORY_COMPACTION_INTERVAL`` seconds on one worker
+at a time (a Redis lock, released when the pass finishes), and on demand with
+``python -m app.commands.compact_memories``.
+"""
+import asyncio
+import json
+import math
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.core.redis_client import redis_client
+from app.models.memory import Memory
+
+# KEYS: lock. ARGV: value this worker set
+# Releases the lock only if it is still this worker's
+RELEASE_LOCK = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def retention_score(
+    importance: Optional[float],
+    created_at: Optional[datetime],
+    last_accessed: Optional[datetime],
+    access_count: Optional[float],
+    now: datetime,
+) -> float:
+    """How much a memory is worth keeping (higher is kept longer)"""
+    last_used = last_accessed or created_at or now
+    idle_days = max(0.0, (now - last_used).total_seconds() / 86400)
+    decay = 0.5 ** (idle_days / settings.MEMORY_DECAY_HALF_LIFE_DAYS)
+    faded = (importance or 0.0) * (
+        settings.MEMORY_DECAY_FLOOR + (1 - settings.MEMORY_DECAY_FLOOR) * decay
+    )
+    # Diminishing returns: ~20 retrievals earn the full bonus
+    reinforcement = min(1.0, math.log1p(access_count or 0) / math.log1p(20))
+    return faded + settings.MEMORY_ACCESS_WEIGHT * reinforcement
+
+
+class MemoryCompactor:
+    """Enforces the per-user memory cap"""
+
+    LOCK_KEY = "memory_compactor:lock"
+    LOCK_MARGIN = 300  # Seconds the lock outlives the interval, for passes that run long
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+
+    def users_over_cap(self, db: Session, limit: Optional[int] = None) -> List[str]:
+        query = (
+            db.query(Memory.user_id)
+            .filter(Memory.archived_at.is_(None))
+            .group_by(Memory.user_id)
+            .having(func.count(Memory.id) > settings.MEMORY_MAX_PER_USER)
+        )
+        if limit:
+            query = query.limit(limit)
+        return [row.user_id for row in query]
+
+    def compact_user(self, db: Session, user_id: str) -> int:
+        """Evict the user's lowest-scoring memories beyond the cap; returns how many"""
+        rows = (
+            db.query(
+                Memory.id,
+                Memory.importance,
+                Memory.created_at,
+                Memory.last_accessed,
+                Memory.access_count,
+            )
+            .filter(Memory.user_id == user_id)
+            .filter(Memory.archived_at.is_(None))
+            .all()
+        )
+        excess = len(rows) - settings.MEMORY_MAX_PER_USER
+        if excess <= 0:
+            return 0
+
+        now = datetime.utcnow()
+        ranked = sorted(
+            rows,
+            key=lambda row: retention_score(
+                row.importance, row.created_at, row.last_accessed, row.access_count, now
+            ),
+        )
+        evicted = [row.id for row in ranked[:excess]]
+
+        query = db.query(Memory).filter(Memory.id.in_(evicted))
+        if settings.MEMORY_EVICTION_MODE == "delete":
+            query.delete(synchronize_session=False)
+        else:
+            query.update({Memory.archived_at: now}, synchronize_session=False)
+        db.commit()
+        return len(evicted)
+
+    def compact(self, max_users: Optional[int] = None) -> Dict[str, int]:
+        """Compact every user over the cap; returns users and memories affected"""
+        db = SessionLocal()
+        users = evicted = 0
+        try:
+            for user_id in self.users_over_cap(db, max_users):
+                evicted += self.compact_user(db, user_id)
+                users += 1
+        finally:
+            db.close()
+        return {"users": users, "evicted": evicted}
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(settings.MEMORY_COMPACTION_INTERVAL)
+            # One worker at a time (if Redis is unreachable, every worker runs)
+            lock = {"token": uuid.uuid4().hex, "started_at": datetime.utcnow().isoformat()}
+            locked = await redis_client.set_nx(
+                self.LOCK_KEY, lock,
+                max(1, math.ceil(settings.MEMORY_COMPACTION_INTERVAL)) + self.LOCK_MARGIN,
+            )
+            if locked is False:
+                continue
+            try:
+                result = await loop.run_in_executor(None, self.compact)
+                if result["evicted"]:
+                    print(f"Memory compaction: evicted {result['evicted']} memories "
+                          f"from {result['users']} users")
+            except Exception as e:
+                print(f"Memory compaction error: {e}")
+            finally:
+                if locked:
+                    await redis_client.eval(RELEASE_LOCK, [self.LOCK_KEY], [json.dumps(lock)])
+
+    def start(self) -> None:
+        """Start periodic compaction (called on application startup)"""
+        if self._task is None and settings.MEMORY_COMPACTION_INTERVAL > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+memory_compactor = MemoryCompactor()
@@ -1,185 +1,298 @@
+import asyncio
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List, Dict
+from typing import List, Dict, Optional, Set
 from datetime import datetime
+import numpy as np
 from app.models.memory import Memory
-from app.models.user import User
 from app.core.config import settings
-import re
+from app.core.redis_client import redis_client
+from app.services.embedding_service import embedding_service, from_bytes, to_bytes
+from app.services.memory_access import memory_access_buffer
+from app.services.task_queue import task_queue
+from app.utils.text import normalize_text
+import hashlib
 
 
-class MemoryService:
-    """Service for managing user long-term memories"""
-
-    def extract_memories_from_conversation(
-        self, user_message: str, assistant_message: str, user: User
-    ) -> List[Dict[str, any]]:
-        """Extract important information from conversation to store as memories"""
-        memories = []
-
-        # Extract medical conditions
-        medical_keywords = [
-            "diagnosed with",
-            "have diabetes",
-            "have hypertension",
-            "have asthma",
-            "suffer from",
-            "condition",
-        ]
-        if any(keyword in user_message.lower() for keyword in medical_keywords):
-            memories.append(
-                {
-                    "content": user_message,
-                    "memory_type": "medical",
-                    "importance": 0.9,
-                }
-            )
+def content_hash(content: str) -> str:
+    """Hash of a memory's normalized content (exact-duplicate key)"""
+    return hashlib.sha256(normalize_text(content).encode("utf-8")).hexdigest()
 
-        # Extract medications
-        medication_keywords = [
-            "taking",
-            "medication",
-            "medicine",
-            "pill",
-            "prescription",
-            "drug",
-        ]
-        if any(keyword in user_message.lower() for keyword in medication_keywords):
-            memories.append(
-                {
-                    "content": user_message,
-                    "memory_type": "medical",
-                    "importance": 0.85,
-                }
-            )
 
-        # Extract preferences
-        preference_keywords = [
-            "i prefer",
-            "i like",
-            "i don't like",
-            "i hate",
-            "my favorite",
-            "i enjoy",
-        ]
-        if any(keyword in user_message.lower() for keyword in preference_keywords):
-            memories.append(
-                {
-                    "content": user_message,
-                    "memory_type": "preference",
-                    "importance": 0.6,
-                }
-            )
+class MemoryIndex:
+    """A user's memories by content hash and by embedding, for duplicate checks"""
 
-        # Extract personal facts
-        fact_patterns = [
-            r"i am (\d+) years? old",
-            r"my name is (\w+)",
-            r"i work as",
-            r"i live in",
-            r"my job",
-        ]
-        for pattern in fact_patterns:
-            if re.search(pattern, user_message.lower()):
-                memories.append(
-                    {
-                        "content": user_message,
-                        "memory_type": "fact",
-                        "importance": 0.7,
-                    }
-                )
-                break
+    def __init__(self, memories: List[Memory] = ()):
+        self.by_hash: Dict[str, Memory] = {}
+        self.rows: List[Memory] = []
+        self.vectors: List[np.ndarray] = []
+        self._matrix: Optional[np.ndarray] = None
+        self._size = embedding_service.dim * 4  # float32
+        for memory in memories:
+            self.add(memory)
 
-        return memories
+    def add(self, memory: Memory) -> None:
+        if memory.content_hash:
+            self.by_hash.setdefault(memory.content_hash, memory)
+        if memory.embedding and len(memory.embedding) == self._size:
+            self.rows.append(memory)
+            self.vectors.append(from_bytes(memory.embedding))
+            self._matrix = None
+
+    def find_duplicate(self, key: str, embedding: Optional[bytes]) -> Optional[Memory]:
+        """Memory with the same normalized content, or a near-identical embedding"""
+        duplicate = self.by_hash.get(key)
+        if duplicate is not None or not embedding or not self.rows:
+            return duplicate
+        if len(embedding) != self._size:
+            return None
+
+        if self._matrix is None:
+            self._matrix = np.vstack(self.vectors)
+        similarity = self._matrix @ from_bytes(embedding)
+        best = int(np.argmax(similarity))
+        if similarity[best] >= settings.MEMORY_DUPLICATE_SIMILARITY:
+            return self.rows[best]
+        return None
+
+
+class MemoryService:
+    """Service for managing user long-term memories.
+
+    Retrieval runs in the chat turn (``AsyncSession``); storing and
+    consolidating memories runs in background tasks and commands
+    (``Session``). Profile changes found in a message are written by the
+    turn's unit of work.
+    """
 
-    def create_memory(
-        self, db: Session, user_id: str, content: str, memory_type: str, importance: float
-    ) -> Memory:
-        """Create a new memory"""
-        memory = Memory(
-            user_id=user_id,
-            content=content,
-            memory_type=memory_type,
-            importance=importance,
-            created_at=datetime.utcnow(),
-            last_accessed=datetime.utcnow(),
-            access_count=0,
+    def __init__(self):
+        self._tasks: Set[asyncio.Task] = set()
+
+    def _active(self, user_id: str):
+        """Select the user's memories that have not been archived"""
+        return (
+            select(Memory)
+            .where(Memory.user_id == user_id)
+            .where(Memory.archived_at.is_(None))
         )
-        db.add(memory)
+
+    def _embed(self, texts: List[str]) -> List[Optional[bytes]]:
+        """Embeddings of texts in one batch (None for each if the model fails)"""
+        try:
+            return [to_bytes(vector) for vector in embedding_service.embed(texts)]
+        except Exception as e:
+            print(f"Memory embedding error: {e}")
+            return [None] * len(texts)
+
+    def create_memories(self, db: Session, user_id: str, memories: List[Dict]) -> List[Memory]:
+        """Create several memories in one commit, embedding them in one batch.
+
+        A memory that repeats one the user already has (same normalized text,
+        or embedding similarity of at least ``MEMORY_DUPLICATE_SIMILARITY``)
+        is not stored again; the existing memory keeps the higher importance
+        of the two and is returned in its place.
+        """
+        if not memories:
+            return []
+
+        # Repeats within the batch (one message matching several extraction
+        # rules) collapse to the entry with the highest importance
+        unique: Dict[str, Dict] = {}
+        for mem in memories:
+            key = content_hash(mem["content"])
+            if key not in unique or mem["importance"] > unique[key]["importance"]:
+                unique[key] = mem
+
+        index = MemoryIndex(db.scalars(self._active(user_id)).all())
+        embeddings = self._embed([mem["content"] for mem in unique.values()])
+
+        now = datetime.utcnow()
+        stored = []
+        for (key, mem), embedding in zip(unique.items(), embeddings):
+            duplicate = index.find_duplicate(key, embedding)
+            if duplicate is not None:
+                duplicate.importance = max(duplicate.importance or 0.0, mem["importance"])
+                stored.append(duplicate)
+                continue
+
+            memory = Memory(
+                user_id=user_id,
+                content=mem["content"],
+                memory_type=mem["memory_type"],
+                importance=mem["importance"],
+                created_at=now,
+                last_accessed=now,
+                access_count=0,
+                embedding=embedding,
+                content_hash=key,
+            )
+            db.add(memory)
+            index.add(memory)
+            stored.append(memory)
+
         db.commit()
-        db.refresh(memory)
-        return memory
+        return stored
 
-    def get_relevant_memories(
-        self, db: Session, user_id: str, current_message: str = None
-    ) -> List[Memory]:
-        """Get relevant memories for context"""
-        # Get all memories for user, ordered by importance and recency
-        memories = (
-            db.query(Memory)
-            .filter(Memory.user_id == user_id)
-            .filter(Memory.importance >= settings.MEMORY_IMPORTANCE_THRESHOLD)
-            .order_by(Memory.importance.desc(), Memory.last_accessed.desc())
-            .limit(settings.MAX_MEMORIES_IN_CONTEXT)
-            .all()
-        )
+    def consolidate_user_memories(self, db: Session, user_id: str) -> int:
+        """Merge a user's duplicate memories; returns the number of rows deleted.
+
+        Memories are visited from most to least important, so of each group of
+        duplicates the most important one is kept. It takes the group's total
+        access count and latest access time.
+        """
+        memories = db.scalars(
+            self._active(user_id).order_by(Memory.importance.desc(), Memory.created_at.asc())
+        ).all()
 
-        # Update access count and last accessed
         for memory in memories:
-            memory.access_count += 1
-            memory.last_accessed = datetime.utcnow()
+            if not memory.content_hash:
+                memory.content_hash = content_hash(memory.content)
+        self._ensure_embeddings(memories)
+
+        index = MemoryIndex()
+        removed = 0
+        for memory in memories:
+            kept = index.find_duplicate(memory.content_hash, memory.embedding)
+            if kept is None:
+                index.add(memory)
+                continue
+            kept.importance = max(kept.importance or 0.0, memory.importance or 0.0)
+            kept.access_count = (kept.access_count or 0) + (memory.access_count or 0)
+            if memory.last_accessed and (
+                not kept.last_accessed or memory.last_accessed > kept.last_accessed
+            ):
+                kept.last_accessed = memory.last_accessed
+            db.delete(memory)
+            removed += 1
+
         db.commit()
+        return removed
 
-        return memories
+    def _has_embedding(self, memory: Memory) -> bool:
+        """Whether the memory is embedded by the current model"""
+        return bool(memory.embedding) and len(memory.embedding) == embedding_service.dim * 4
 
-    def update_user_profile_from_message(
-        self, db: Session, user: User, message: str
-    ) -> bool:
-        """Update user profile from message content"""
-        message_lower = message.lower()
-        updated = False
-
-        # Extract name
-        name_patterns = [
-            r"my name is (\w+)",
-            r"i'm (\w+)",
-            r"i am (\w+)",
-            r"call me (\w+)",
-        ]
-        for pattern in name_patterns:
-            match = re.search(pattern, message_lower)
-            if match and not user.name:
-                user.name = match.group(1).capitalize()
-                updated = True
-                break
-
-        # Extract age
-        age_patterns = [r"i am (\d+) years? old", r"i'm (\d+)", r"(\d+) years? old"]
-        for pattern in age_patterns:
-            match = re.search(pattern, message_lower)
-            if match and not user.age:
-                age = match.group(1)
-                if 1 <= int(age) <= 120:
-                    user.age = age
-                    updated = True
-                    break
-
-        # Extract gender
-        if any(word in message_lower for word in ["i'm male", "i am male", "i'm a man"]):
-            if not user.gender:
-                user.gender = "male"
-                updated = True
-        elif any(
-            word in message_lower for word in ["i'm female", "i am female", "i'm a woman"]
-        ):
-            if not user.gender:
-                user.gender = "female"
-                updated = True
-
-        if updated:
+    def _ensure_embeddings(self, memories: List[Memory]) -> int:
+        """Embed memories stored without one (or by a model of another size);
+        returns how many were embedded"""
+        missing = [mem for mem in memories if not self._has_embedding(mem)]
+        if not missing:
+            return 0
+        for mem, vector in zip(missing, embedding_service.embed([mem.content for mem in missing])):
+            mem.embedding = to_bytes(vector)
+        return len(missing)
+
+    def embed_user_memories(self, db: Session, user_id: str) -> int:
+        """Embed the user's active memories stored without one; returns how many"""
+        embedded = self._ensure_embeddings(db.scalars(self._active(user_id)).all())
+        if embedded:
             db.commit()
-            db.refresh(user)
+        return embedded
+
+    def schedule_embedding(self, user_id: str) -> None:
+        """Queue embedding of the user's unembedded memories (at most one queued per user)"""
+        task = asyncio.create_task(self._enqueue_embedding(user_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _enqueue_embedding(self, user_id: str) -> None:
+        claimed = await redis_client.set_nx(
+            f"memory_embed:{user_id}",
+            {"queued_at": datetime.utcnow().isoformat()},
+            settings.MEMORY_EMBED_PENDING_TTL,
+        )
+        if claimed is not False:
+            await task_queue.enqueue("memories.embed", user_id=user_id)
+
+    async def release_embedding(self, user_id: str) -> None:
+        """Allow another embedding task to be queued for the user"""
+        await redis_client.delete(f"memory_embed:{user_id}")
+
+    def rank_memories(self, memories: List[Memory], current_message: str) -> List[Memory]:
+        """Top memories for a message by blended similarity, importance and recency.
+
+        Memories not embedded yet score zero similarity, so they rank by
+        importance and recency alone.
+        """
+        embedded = [i for i, mem in enumerate(memories) if self._has_embedding(mem)]
+        similarity = np.zeros(len(memories), dtype=np.float32)
+        if embedded:
+            # One matrix product scores every embedded memory of the user
+            query_vector = embedding_service.embed_one(current_message)
+            matrix = np.vstack([from_bytes(memories[i].embedding) for i in embedded])
+            similarity[embedded] = matrix @ query_vector
+        importance = np.array([mem.importance or 0.0 for mem in memories], dtype=np.float32)
+        now = datetime.utcnow()
+        age_days = np.array(
+            [(now - (mem.created_at or now)).total_seconds() / 86400 for mem in memories],
+            dtype=np.float32,
+        )
+        recency = 0.5 ** (age_days / settings.MEMORY_RECENCY_HALF_LIFE_DAYS)
+
+        scores = (
+            settings.MEMORY_SIMILARITY_WEIGHT * similarity
+            + settings.MEMORY_IMPORTANCE_WEIGHT * importance
+            + settings.MEMORY_RECENCY_WEIGHT * recency
+        )
+        k = min(settings.MAX_MEMORIES_IN_CONTEXT, len(memories))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [memories[i] for i in top]
+
+    async def get_relevant_memories(
+        self, db: AsyncSession, user_id: str, current_message: str = None
+    ) -> List[Memory]:
+        """Get relevant memories for context.
+
+        With a ``current_message``, memories are ranked by similarity to it
+        blended with importance and recency; otherwise by importance and
+        recency alone.
+        """
+        query = self._active(user_id).where(
+            Memory.importance >= settings.MEMORY_IMPORTANCE_THRESHOLD
+        )
+
+        memories = None
+        if current_message:
+            try:
+                # Bounded by the per-user cap even before the compactor catches up
+                candidates = (
+                    await db.scalars(
+                        query
+                        .order_by(Memory.importance.desc(), Memory.last_accessed.desc())
+                        .limit(settings.MEMORY_MAX_PER_USER)
+                    )
+                ).all()
+                # Rows stored without an embedding are embedded by a background task
+                if not all(self._has_embedding(mem) for mem in candidates):
+                    self.schedule_embedding(user_id)
+                # Encoding is blocking: it runs in a thread, off the event loop
+                memories = (
+                    await asyncio.to_thread(self.rank_memories, candidates, current_message)
+                    if candidates else []
+                )
+            except Exception as e:
+                print(f"Memory ranking error: {e}")
+
+        if memories is None:
+            # Get memories for user, ordered by importance and recency
+            memories = (
+                await db.scalars(
+                    query
+                    .order_by(Memory.importance.desc(), Memory.last_accessed.desc())
+                    .limit(settings.MAX_MEMORIES_IN_CONTEXT)
+                )
+            ).all()
+
+        # Access count and last accessed are written behind, in bulk
+        memory_access_buffer.record(memories)
+
+        return memories
 
-        return updated
+    def profile_changes(self, current: Dict, profile: Dict[str, str]) -> Dict[str, str]:
+        """The extracted values for profile fields not set in ``current`` yet"""
+        return {field: value for field, value in profile.items() if not current.get(field)}
 
 
 memory_service = MemoryService()
@@ -0,0 +1,175 @@
+"""Two-tier cache of user profiles: an in-process LRU backed by Redis.
+
+Profiles are cached as plain dicts (``profile_dict``), so a hit in the
+local tier is a dictionary lookup. Misses fall through to Redis
+(``profile:{user_id}``) and then to the database.
+
+Writers call ``invalidate`` after committing a change to a user. It bumps
+the user's version (``profile:{user_id}:version``), drops the Redis copy and
+publishes the user id on ``PROFILE_CHANNEL``. Every worker's listener
+task then drops its local copy. A reader only stores what it loaded if
+nothing was invalidated while it was loading: the Redis version and the
+local invalidation count must be unchanged. So a load that raced a write
+cannot cache the old profile. Local entries also expire after
+``PROFILE_CACHE_LOCAL_TTL``, which bounds staleness when invalidations are
+missed, for example while Redis is unreachable.
+"""
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from app.core.config import settings
+from app.core.redis_client import redis_client
+from app.models.user import User
+
+PROFILE_CHANNEL = "profile_invalidations"
+
+PROFILE_FIELDS = (
+    "name",
+    "phone",
+    "age",
+    "gender",
+    "medical_conditions",
+    "medications",
+    "allergies",
+    "onboarding_completed",
+)
+
+# KEYS: profile, version. ARGV: version read before loading ("" if none), profile, ttl
+FILL = """
+if (redis.call('GET', KEYS[2]) or '') ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+return 1
+"""
+
+# KEYS: profile, version. ARGV: channel, user id, version ttl
+INVALIDATE = """
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+redis.call('DEL', KEYS[1])
+redis.call('PUBLISH', ARGV[1], ARGV[2])
+return 1
+"""
+
+
+def profile_dict(user: User) -> Dict:
+    """A user's profile as a JSON-serializable dict"""
+    profile = {"id": str(user.id)}
+    for field in PROFILE_FIELDS:
+        profile[field] = getattr(user, field)
+    profile["created_at"] = user.created_at.isoformat() if user.created_at else None
+    return profile
+
+
+class ProfileCache:
+    """Bounded local LRU of profiles over a Redis tier"""
+
+    def __init__(self, size: int, local_ttl: float):
+        self.size = size
+        self.local_ttl = local_ttl
+        self._local: "OrderedDict[str, Tuple[float, Dict]]" = OrderedDict()
+        self._invalidations = 0
+        self._listener: Optional[asyncio.Task] = None
+
+    def _keys(self, user_id: str) -> List[str]:
+        return [f"profile:{user_id}", f"profile:{user_id}:version"]
+
+    def get_local(self, user_id: str) -> Optional[Dict]:
+        entry = self._local.get(user_id)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self._local[user_id]
+            return None
+        self._local.move_to_end(user_id)
+        return entry[1]
+
+    def _store_local(self, user_id: str, profile: Dict, invalidations: int) -> None:
+        if invalidations != self._invalidations:
+            return
+        self._local[user_id] = (time.monotonic() + self.local_ttl, profile)
+        self._local.move_to_end(user_id)
+        while len(self._local) > self.size:
+            self._local.popitem(last=False)
+
+    def _drop_local(self, user_id: Optional[str] = None) -> None:
+        self._invalidations += 1
+        if user_id is None:
+            self._local.clear()
+        else:
+            self._local.pop(user_id, None)
+
+    async def get_or_load(
+        self, user_id: str, load: Callable[[], Awaitable[Optional[User]]]
+    ) -> Optional[Dict]:
+        """The user's profile from the local tier, Redis, or ``load`` (None if no such user)"""
+        profile = self.get_local(user_id)
+        if profile is not None:
+            return profile
+
+        invalidations = self._invalidations
+        keys = self._keys(user_id)
+        cached, version = await redis_client.mget(*keys)
+        if cached is not None:
+            profile = json.loads(cached)
+        else:
+            user = await load()
+            if user is None:
+                return None
+            profile = profile_dict(user)
+            stored = await redis_client.eval(
+                FILL, keys, [version or "", json.dumps(profile), settings.PROFILE_CACHE_TTL]
+            )
+            if not stored:
+                return profile  # Invalidated while loading (or Redis is down)
+
+        self._store_local(user_id, profile, invalidations)
+        return profile
+
+    async def invalidate(self, user_id: str) -> None:
+        """Drop the user's cached profile in every worker (call after committing a change)"""
+        user_id = str(user_id)
+        self._drop_local(user_id)
+        result = await redis_client.eval(
+            INVALIDATE,
+            self._keys(user_id),
+            [PROFILE_CHANNEL, user_id, settings.PROFILE_CACHE_TTL * 2],
+        )
+        if result is None:
+            # The Redis copy may now be stale; it expires with PROFILE_CACHE_TTL
+            print(f"Profile invalidation for {user_id} not published")
+
+    async def _listen(self) -> None:
+        while True:
+            pubsub = redis_client.pubsub()
+            try:
+                await pubsub.subscribe(PROFILE_CHANNEL)
+                while True:
+                    message = await pubsub.get_message(timeout=1.0)
+                    if message is not None:
+                        self._drop_local(message["data"])
+            except Exception as e:
+                # Invalidations may have been missed while disconnected; until
+                # Redis is back, local entries are only bounded by their TTL
+                print(f"Profile invalidation listener error: {e}")
+                self._drop_local()
+                await asyncio.sleep(1.0)
+            finally:
+                await pubsub.aclose()
+
+    def start(self) -> None:
+        """Listen for invalidations from other workers (called on application startup)"""
+        if self._listener is None:
+            self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+            self._listener = None
+
+
+profile_cache = ProfileCache(settings.PROFILE_CACHE_SIZE, settings.PROFILE_CACHE_LOCAL_TTL)
@@ -0,0 +1,200 @@
+"""Token-budgeted system prompt assembly.
+
+The system prompt is built from sections, each with its own token quota:
+
+- ``base``: Disha's fixed instructions (never truncated)
+- ``profile``: the user's profile fields
+- ``protocols``: matched policies and medical protocols, most relevant first
+- ``memories``: long-term memories, most relevant first
+- ``summary``: the rolling summary of earlier conversation
+
+Within a section, items are kept in order until the quota is used up; an item
+that does not fit is truncated only if nothing else from the section fits.
+If the sections together still exceed ``PROMPT_MAX_SYSTEM_TOKENS``, items are
+dropped from the lowest-priority sections first. ``assemble`` returns the
+prompt together with a report of how the budget was spent.
+"""
+from typing import Callable, Dict, List, Optional, Tuple
+from app.core.config import settings
+
+BASE_SYSTEM_PROMPT = """You are Disha, India's first AI health coach. You are warm, empathetic, and knowledgeable about health and wellness.
+
+**Your Role:**
+- Provide personalized health guidance and support
+- Help users understand their health concerns
+- Offer evidence-based wellness advice
+- Be a supportive companion on their health journey
+
+**Communication Style:**
+- Warm and conversational, like chatting with a trusted friend on WhatsApp
+- Use simple, easy-to-understand language
+- Show empathy and understanding
+- Ask follow-up questions to better understand concerns
+- Be encouraging and supportive
+- Use appropriate emojis occasionally to be friendly (but don't overdo it)
+
+**Important Guidelines:**
+- You are NOT a replacement for professional medical care
+- For serious symptoms, always recommend consulting a healthcare provider
+- For emergencies (severe chest pain, difficulty breathing, etc.), advise calling emergency services
+- Be honest about the limitations of AI health coaching
+- Focus on prevention, lifestyle, and general wellness
+- Provide information, not diagnosis
+
+**Safety First:**
+- If symptoms suggest serious condition: recommend immediate medical attention
+- If user is in crisis: provide crisis helpline numbers and urge professional help
+- Never provide specific medication dosages or change existing prescriptions
+"""
+
+# Highest priority first; overflow is cut from the end of this list
+SECTION_PRIORITY = ["base", "profile", "protocols", "memories", "summary"]
+
+# Order sections appear in the prompt
+SECTION_ORDER = ["base", "profile", "memories", "summary", "protocols"]
+
+SECTION_HEADERS = {
+    "base": "",
+    "profile": "\n**User Information:**\n",
+    "memories": "\n**What You Remember About This User:**\n",
+    "summary": "\n**Summary of Earlier Conversation:**\n",
+    "protocols": "\n**Relevant Medical Protocols:**\n",
+}
+
+PROTOCOL_SEPARATOR = "\n\n---\n\n"
+
+TRUNCATION_MARKER = "\n[...]\n"
+
+
+def section_quotas() -> Dict[str, int]:
+    """Token quota per prompt section (history is budgeted by the caller)"""
+    return {
+        "base": settings.PROMPT_QUOTA_BASE,
+        "profile": settings.PROMPT_QUOTA_PROFILE,
+        "protocols": settings.PROMPT_QUOTA_PROTOCOLS,
+        "memories": settings.PROMPT_QUOTA_MEMORIES,
+        "summary": settings.PROMPT_QUOTA_SUMMARY,
+    }
+
+
+def profile_lines(user_info: Optional[Dict]) -> List[str]:
+    """User profile as prompt lines, most important first"""
+    if not user_info:
+        return []
+    lines = []
+    if user_info.get("name"):
+        lines.append(f"- Name: {user_info['name']}\n")
+    if user_info.get("age"):
+        lines.append(f"- Age: {user_info['age']}\n")
+    if user_info.get("gender"):
+        lines.append(f"- Gender: {user_info['gender']}\n")
+    if user_info.get("medical_conditions"):
+        lines.append(f"- Medical Conditions: {', '.join(user_info['medical_conditions'])}\n")
+    if user_info.get("medications"):
+        lines.append(f"- Current Medications: {', '.join(user_info['medications'])}\n")
+    if user_info.get("allergies"):
+        lines.append(f"- Allergies: {', '.join(user_info['allergies'])}\n")
+    return lines
+
+
+class PromptAssembler:
+    """Builds system prompts within per-section token quotas"""
+
+    def __init__(self, count_tokens: Callable[[str], int]):
+        self.count_tokens = count_tokens
+
+    def _truncate(self, text: str, max_tokens: int) -> str:
+        """Cut text to at most ``max_tokens`` (estimated from its length, then checked)"""
+        max_tokens -= self.count_tokens(TRUNCATION_MARKER)
+        tokens = self.count_tokens(text)
+        while tokens > max_tokens and text:
+            text = text[: max(0, int(len(text) * max_tokens / tokens) - 1)]
+            tokens = self.count_tokens(text)
+        return text.rstrip() + TRUNCATION_MARKER if text else ""
+
+    def _fit(self, name: str, items: List[str], quota: int) -> Tuple[List[str], List[int], bool]:
+        """Keep items in order within ``quota``; returns (kept, token counts, truncated)"""
+        if not items:
+            return [], [], False
+
+        kept, counts = [], []
+        used = self.count_tokens(SECTION_HEADERS[name])
+        for item in items:
+            tokens = self.count_tokens(item)
+            if used + tokens <= quota:
+                kept.append(item)
+                counts.append(tokens)
+                used += tokens
+                continue
+            if not kept and quota - used >= settings.PROMPT_MIN_TRUNCATED_TOKENS:
+                # Nothing else fits: keep a truncated first item rather than nothing
+                truncated = self._truncate(item, quota - used)
+                return [truncated], [self.count_tokens(truncated)], True
+            break
+        return kept, counts, False
+
+    def _render(self, name: str, items: List[str]) -> str:
+        if not items:
+            return ""
+        if name == "protocols":
+            body = PROTOCOL_SEPARATOR.join(items) + "\n"
+        elif name == "memories":
+            body = "".join(f"- {item}\n" for item in items)
+        elif name == "summary":
+            body = "".join(items) + "\n"
+        else:
+            body = "".join(items)
+        return SECTION_HEADERS[name] + body
+
+    def assemble(
+        self,
+        user_info: Optional[Dict] = None,
+        memories: Optional[List[str]] = None,
+        protocols: Optional[List[str]] = None,
+        summary: Optional[str] = None,
+    ) -> Tuple[str, Dict]:
+        """Build the system prompt; returns (prompt, budget report)"""
+        quotas = section_quotas()
+        candidates = {
+            "base": [BASE_SYSTEM_PROMPT],
+            "profile": profile_lines(user_info),
+            "protocols": list(protocols or []),
+            "memories": list(memories or []),
+            "summary": [summary] if summary else [],
+        }
+
+        kept, counts, truncated = {}, {}, {}
+        for name in SECTION_PRIORITY:
+            if name == "base":
+                # Fixed instructions are always sent in full
+                kept[name], counts[name], truncated[name] = (
+                    candidates[name], [self.count_tokens(BASE_SYSTEM_PROMPT)], False
+                )
+                continue
+            kept[name], counts[name], truncated[name] = self._fit(
+                name, candidates[name], quotas[name]
+            )
+
+        # Enforce the overall cap by dropping items from the lowest priority sections
+        overflow = sum(sum(c) for c in counts.values()) - settings.PROMPT_MAX_SYSTEM_TOKENS
+        for name in reversed(SECTION_PRIORITY[1:]):
+            while overflow > 0 and kept[name]:
+                kept[name] = kept[name][:-1]
+                overflow -= counts[name].pop()
+
+        prompt = "".join(self._render(name, kept[name]) for name in SECTION_ORDER)
+
+        report = {
+            "sections": {
+                name: {
+                    "quota": quotas[name],
+                    "tokens": self.count_tokens(self._render(name, kept[name])),
+                    "items": len(kept[name]),
+                    "dropped": len(candidates[name]) - len(kept[name]),
+                    "truncated": truncated[name] and bool(kept[name]),
+                }
+                for name in SECTION_PRIORITY
+            },
+            "system_tokens": self.count_tokens(prompt),
+        }
+        return prompt, report
@@ -0,0 +1,154 @@
+"""Provider rate limiting shared across workers, plus adaptive concurrency.
+
+``ClusterRateLimiter`` keeps two Redis token buckets per provider, one for
+requests per minute and one for tokens per minute, shared by every worker and
+replica. A call takes one request and its estimated tokens from both buckets
+atomically (a Lua script using the Redis clock); if either bucket is short, the
+caller sleeps until it refills, for at most ``LLM_RATE_LIMIT_MAX_WAIT`` seconds.
+If Redis is unreachable, calls are let through.
+
+``AdaptiveConcurrencyLimiter`` bounds in-flight calls to one provider on this
+worker with an AIMD limit: it grows by about one slot per limit's worth of fast
+successful calls, and is cut multiplicatively on provider 429s, timeouts or
+latency above ``LLM_AIMD_LATENCY_TARGET``.
+"""
+import asyncio
+import time
+from typing import Dict, Optional
+
+from app.core.config import settings
+from app.core.redis_client import RedisClient, redis_client
+
+
+class RateLimitExceededError(Exception):
+    """Raised when the shared quota does not free up within the wait limit"""
+
+
+# KEYS: request bucket, token bucket
+# ARGV: rpm capacity, rpm refill/sec, tpm capacity, tpm refill/sec, requests, tokens
+# Returns "0" if both amounts were taken, otherwise the seconds to wait.
+TOKEN_BUCKET_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local wait = 0
+local levels = {}
+for i = 1, 2 do
+  local capacity = tonumber(ARGV[2 * i - 1])
+  local rate = tonumber(ARGV[2 * i])
+  local amount = math.min(tonumber(ARGV[4 + i]), capacity)
+  if capacity > 0 then
+    local bucket = redis.call('HMGET', KEYS[i], 'level', 'ts')
+    local level = tonumber(bucket[1]) or capacity
+    local ts = tonumber(bucket[2]) or now
+    level = math.min(capacity, level + math.max(0, now - ts) * rate)
+    levels[i] = level - amount
+    if amount > level then
+      wait = math.max(wait, (amount - level) / rate)
+    end
+  end
+end
+if wait > 0 then
+  return tostring(wait)
+end
+for i = 1, 2 do
+  if levels[i] ~= nil then
+    redis.call('HSET', KEYS[i], 'level', levels[i], 'ts', now)
+    redis.call('EXPIRE', KEYS[i], 120)
+  end
+end
+return "0"
+"""
+
+
+class ClusterRateLimiter:
+    """Redis token buckets for requests and tokens per minute"""
+
+    PREFIX = "rate_limit"
+
+    def __init__(self, client: RedisClient):
+        self.client = client
+
+    @property
+    def enabled(self) -> bool:
+        return settings.LLM_RATE_LIMIT_RPM > 0 or settings.LLM_RATE_LIMIT_TPM > 0
+
+    async def acquire(self, provider: str, tokens: int) -> None:
+        """Take one request and ``tokens`` from the provider's shared quota"""
+        if not self.enabled:
+            return
+
+        rpm, tpm = settings.LLM_RATE_LIMIT_RPM, settings.LLM_RATE_LIMIT_TPM
+        keys = [f"{self.PREFIX}:{provider}:requests", f"{self.PREFIX}:{provider}:tokens"]
+        args = [rpm, rpm / 60, tpm, tpm / 60, 1, tokens]
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.LLM_RATE_LIMIT_MAX_WAIT
+        while True:
+            result = await self.client.eval(TOKEN_BUCKET_SCRIPT, keys, args)
+            if result is None:
+                return  # Redis unavailable: fail open
+            wait = float(result)
+            if wait <= 0:
+                return
+
+            remaining = deadline - loop.time()
+            if wait > remaining:
+                raise RateLimitExceededError(
+                    f"LLM quota for {provider} exhausted; retry in {wait:.1f}s"
+                )
+            await asyncio.sleep(wait)
+
+
+class AdaptiveConcurrencyLimiter:
+    """AIMD limit on in-flight provider calls for this worker"""
+
+    def __init__(self, min_limit: int, max_limit: int):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = asyncio.Condition()
+
+    def _has_capacity(self) -> bool:
+        return self.in_flight < max(self.min_limit, int(self.limit))
+
+    async def acquire(self, timeout: float) -> None:
+        """Wait (at most ``timeout`` seconds) for a free slot"""
+        async with self._condition:
+            await asyncio.wait_for(self._condition.wait_for(self._has_capacity), timeout)
+            self.in_flight += 1
+
+    async def release(self, latency: Optional[float] = None, congested: bool = False) -> None:
+        """Free a slot and adapt the limit.
+
+        ``latency`` is given for successful calls; ``congested`` marks a 429 or a
+        timeout. Calls that failed for other reasons leave the limit unchanged.
+        """
+        async with self._condition:
+            self.in_flight -= 1
+            if congested or (latency is not None and latency > settings.LLM_AIMD_LATENCY_TARGET):
+                self._decrease()
+            elif latency is not None:
+                # Additive increase: about +1 per `limit` successful calls
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+    def _decrease(self) -> None:
+        # Calls already in flight report the same congestion; cut once per cooldown
+        now = time.monotonic()
+        if now - self._last_decrease < settings.LLM_AIMD_DECREASE_COOLDOWN:
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * settings.LLM_AIMD_DECREASE_FACTOR)
+
+    def status(self) -> Dict:
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "min_limit": self.min_limit,
+            "max_limit": self.max_limit,
+        }
+
+
+cluster_rate_limiter = ClusterRateLimiter(redis_client)
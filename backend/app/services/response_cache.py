@@ -0,0 +1,111 @@
+"""Opt-in Redis cache of LLM answers to policy and protocol FAQ questions.
+
+Only short messages that match at least one policy or medical protocol are
+cached, and never for turns that carry memories or a conversation summary
+(the answer would draw on them). Entries are keyed on the normalized
+message, the matched protocol ids and the profile fields that change a
+protocol answer (``ANSWER_FIELDS``), so users with the same relevant
+profile share answers.
+"""
+import hashlib
+import json
+import time
+from typing import Dict, List, Optional
+from app.core.config import settings
+from app.core.redis_client import RedisClient, redis_client
+from app.utils.text import normalize_text
+
+# Profile fields that change an answer; the name, for one, does not
+ANSWER_FIELDS = ("age", "gender", "medical_conditions", "medications", "allergies")
+
+
+class ResponseCache:
+    """Answer cache with TTL and size-based (oldest first) eviction"""
+
+    PREFIX = "response_cache"
+
+    def __init__(self, client: RedisClient):
+        self.client = client
+        self.index_key = f"{self.PREFIX}:index"
+        self.stats_key = f"{self.PREFIX}:stats"
+
+    @property
+    def enabled(self) -> bool:
+        return settings.RESPONSE_CACHE_ENABLED
+
+    def make_key(
+        self,
+        message: Optional[str],
+        protocol_ids: List[str],
+        user_info: Optional[Dict] = None,
+        memories: Optional[List[str]] = None,
+        summary: Optional[str] = None,
+    ) -> Optional[str]:
+        """Cache key for a turn, or None if the turn is not cacheable"""
+        if not self.enabled or not message or not protocol_ids or memories or summary:
+            return None
+
+        normalized = normalize_text(message)
+        if not normalized or len(normalized) > settings.RESPONSE_CACHE_MAX_MESSAGE_CHARS:
+            return None
+
+        user_info = user_info or {}
+        profile = json.dumps(
+            {
+                field: sorted(value) if isinstance(value, list) else value
+                for field, value in ((field, user_info.get(field)) for field in ANSWER_FIELDS)
+            },
+            sort_keys=True,
+            default=str,
+        )
+        digest = hashlib.sha256(
+            "\x1f".join([normalized, ",".join(sorted(protocol_ids)), profile]).encode("utf-8")
+        ).hexdigest()
+        return f"{self.PREFIX}:{digest}"
+
+    async def get(self, key: str) -> Optional[str]:
+        """Cached answer for ``key``; records a hit or miss"""
+        entry = await self.client.get(key)
+        if entry:
+            await self.client.hincrby(self.stats_key, "hits")
+            return entry["response"]
+
+        await self.client.hincrby(self.stats_key, "misses")
+        return None
+
+    async def set(self, key: str, response: str) -> None:
+        """Store an answer, evicting the oldest entries beyond the size limit"""
+        now = time.time()
+        stored = await self.client.set(
+            key, {"response": response, "created_at": now}, settings.RESPONSE_CACHE_TTL
+        )
+        if not stored:
+            return
+
+        evicted = await self.client.zadd_and_trim(
+            self.index_key,
+            key,
+            now,
+            settings.RESPONSE_CACHE_MAX_ENTRIES,
+            min_score=now - settings.RESPONSE_CACHE_TTL,
+        )
+        if evicted:
+            await self.client.delete_many(*evicted)
+            await self.client.hincrby(self.stats_key, "evictions", len(evicted))
+
+    async def stats(self) -> Dict:
+        """Hit/miss/eviction counters across all workers"""
+        raw = await self.client.hgetall(self.stats_key)
+        hits = int(raw.get("hits", 0))
+        misses = int(raw.get("misses", 0))
+        lookups = hits + misses
+        return {
+            "enabled": self.enabled,
+            "hits": hits,
+            "misses": misses,
+            "evictions": int(raw.get("evictions", 0)),
+            "hit_rate": hits / lookups if lookups else 0.0,
+        }
+
+
+response_cache = ResponseCache(redis_client)
@@ -0,0 +1,119 @@
+"""Rolling conversation summaries for long-running users.
+
+Once the unsummarized tail of a user's conversation passes
+``SUMMARY_TRIGGER_TOKENS``, the oldest turns are folded into a stored running
+summary, keeping roughly ``SUMMARY_KEEP_RECENT_TOKENS`` of recent turns as
+verbatim history. The summary goes into the system prompt and only messages
+after it are sent as history, so the prompt stays bounded however long the
+user has been chatting. Folding runs as a ``summary.fold`` task on the background
+task queue, off the request path, with at most one fold queued per user. It
+uses the async database session, so it never blocks the event loop.
+"""
+import asyncio
+from datetime import datetime
+from typing import Dict, List, Optional, Set
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.core.redis_client import redis_client
+from app.models.message import Message
+from app.models.summary import ConversationSummary
+from app.services.llm_service import llm_service
+from app.services.task_queue import task_queue
+from app.utils.context_window import find_cut_index
+
+
+class SummaryService:
+    """Service for maintaining rolling conversation summaries"""
+
+    def __init__(self):
+        self._folding: Set[str] = set()  # Users with a fold queued while Redis is down
+        self._tasks: Set[asyncio.Task] = set()
+
+    def _summary(self, user_id: str):
+        return select(ConversationSummary).where(ConversationSummary.user_id == user_id)
+
+    async def get_summary(self, db: AsyncSession, user_id: str) -> Optional[ConversationSummary]:
+        """Get the user's running summary, if one exists"""
+        return (await db.scalars(self._summary(user_id))).first()
+
+    def needs_folding(self, context: List[Dict]) -> bool:
+        """Whether the unsummarized history has grown past the trigger"""
+        return sum(llm_service.message_tokens(msg) for msg in context) > settings.SUMMARY_TRIGGER_TOKENS
+
+    def schedule_fold(self, user_id: str) -> None:
+        """Queue a fold of the user's oldest turns (at most one queued per user)"""
+        task = asyncio.create_task(self._enqueue_fold(user_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _enqueue_fold(self, user_id: str) -> None:
+        claimed = await redis_client.set_nx(
+            f"summary_fold:{user_id}",
+            {"queued_at": datetime.utcnow().isoformat()},
+            settings.SUMMARY_FOLD_PENDING_TTL,
+        )
+        if claimed is False:
+            return
+        if claimed is None:
+            # Redis unreachable: the fold runs on this worker's in-process queue
+            if user_id in self._folding:
+                return
+            self._folding.add(user_id)
+        await task_queue.enqueue("summary.fold", user_id=user_id)
+
+    async def release_fold(self, user_id: str) -> None:
+        """Allow another fold to be queued for the user"""
+        self._folding.discard(user_id)
+        await redis_client.delete(f"summary_fold:{user_id}")
+
+    async def fold(self, user_id: str) -> int:
+        """Fold the oldest unsummarized turns into the summary; returns messages folded.
+
+        Sessions are only open to read the turns and to store each batch's
+        summary, never while the LLM summarizes.
+        """
+        async with AsyncSessionLocal() as db:
+            summary = await self.get_summary(db, user_id)
+            query = select(Message).where(Message.user_id == user_id)
+            if summary:
+                query = query.where(Message.created_at > summary.summarized_until)
+            messages = (await db.scalars(query.order_by(Message.created_at.asc()))).all()
+
+        token_counts = [
+            msg.tokens_used or llm_service.count_tokens(msg.content) for msg in messages
+        ]
+        if sum(token_counts) <= settings.SUMMARY_TRIGGER_TOKENS:
+            return 0
+
+        # Keep the most recent turns verbatim, fold everything older
+        cut = find_cut_index(token_counts, settings.SUMMARY_KEEP_RECENT_TOKENS)
+        to_fold = messages[:cut]
+
+        folded = 0
+        content = summary.content if summary else None
+        # Large backlogs (users from before summaries existed) fold in batches
+        for start in range(0, len(to_fold), settings.SUMMARY_FOLD_BATCH_SIZE):
+            batch = to_fold[start:start + settings.SUMMARY_FOLD_BATCH_SIZE]
+            content = await llm_service.summarize_conversation(
+                content, [{"role": msg.role, "content": msg.content} for msg in batch]
+            )
+
+            async with AsyncSessionLocal() as db:
+                summary = await self.get_summary(db, user_id)
+                if summary is None:
+                    summary = ConversationSummary(user_id=user_id, message_count=0)
+                    db.add(summary)
+                summary.content = content
+                summary.summarized_until = batch[-1].created_at
+                summary.message_count = (summary.message_count or 0) + len(batch)
+                summary.tokens = llm_service.count_tokens(content)
+                summary.updated_at = datetime.utcnow()
+                await db.commit()
+            folded += len(batch)
+
+        return folded
+
+
+summary_service = SummaryService()
@@ -0,0 +1,293 @@
+"""Background task queue for work that does not need to finish before a reply.
+
+Tasks are registered by name with ``@task_queue.task("name")`` (see
+``app/tasks.py``) and queued with ``await task_queue.enqueue("name", **kwargs)``;
+arguments must be JSON-serializable. Synchronous tasks run on a thread so
+database work never blocks the event loop.
+
+With ``TASK_QUEUE_BACKEND=redis`` jobs go through a Redis list and delivery is
+at-least-once: a consumer moves a job to its own processing list while it runs
+and removes it only once the task has finished. Failed jobs are retried with
+exponential backoff (``TASK_RETRY_BACKOFF``) up to ``TASK_MAX_ATTEMPTS`` times,
+then moved to a dead-letter list. Each process refreshes its heartbeat from a
+separate task every ``TASK_QUEUE_HEARTBEAT`` seconds, also while its jobs run;
+jobs held by a process whose heartbeat has expired (a crashed worker) are put
+back on the queue. Consumers run inside
+the API process (``TASK_QUEUE_APP_WORKERS``) and/or in dedicated workers
+(``python -m app.worker``).
+
+If Redis cannot be reached, or with ``TASK_QUEUE_BACKEND=local``, jobs run on
+an in-process queue of the worker that queued them, with the same retries.
+"""
+import asyncio
+import functools
+import inspect
+import json
+import os
+import socket
+import time
+import uuid
+from typing import Callable, Dict, List, Optional, Set
+
+from app.core.config import settings
+from app.core.redis_client import RedisClient, redis_client
+
+# KEYS: pending, processing, delayed. ARGV: now
+# Moves due retries back to pending, then claims the oldest pending job
+CLAIM_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', ARGV[1], 'LIMIT', 0, 100)
+for _, job in ipairs(due) do
+  redis.call('LPUSH', KEYS[1], job)
+  redis.call('ZREM', KEYS[3], job)
+end
+return redis.call('RPOPLPUSH', KEYS[1], KEYS[2])
+"""
+
+# KEYS: processing, destination. ARGV: claimed job, updated job, retry time (or empty)
+# Finishes a claimed job: retry later (delayed set) or dead-letter it (list)
+REQUEUE_SCRIPT = """
+redis.call('LREM', KEYS[1], 1, ARGV[1])
+if ARGV[3] ~= '' then
+  redis.call('ZADD', KEYS[2], ARGV[3], ARGV[2])
+else
+  redis.call('LPUSH', KEYS[2], ARGV[2])
+end
+return 1
+"""
+
+# KEYS: processing. ARGV: claimed job
+ACK_SCRIPT = """
+return redis.call('LREM', KEYS[1], 1, ARGV[1])
+"""
+
+# KEYS: workers set, this worker's heartbeat, pending. ARGV: worker id, ttl (ms), key prefix
+# Refreshes this worker's heartbeat and requeues jobs held by dead workers
+HEARTBEAT_SCRIPT = """
+redis.call('SET', KEYS[2], ARGV[1], 'PX', ARGV[2])
+redis.call('SADD', KEYS[1], ARGV[1])
+local requeued = 0
+for _, worker in ipairs(redis.call('SMEMBERS', KEYS[1])) do
+  if redis.call('EXISTS', ARGV[3] .. ':heartbeat:' .. worker) == 0 then
+    local processing = ARGV[3] .. ':processing:' .. worker
+    while redis.call('RPOPLPUSH', processing, KEYS[3]) do
+      requeued = requeued + 1
+    end
+    redis.call('SREM', KEYS[1], worker)
+  end
+end
+return requeued
+"""
+
+
+class TaskQueue:
+    """Named background tasks over Redis, with an in-process fallback"""
+
+    PREFIX = "task_queue"
+
+    def __init__(self, client: RedisClient):
+        self.client = client
+        self.handlers: Dict[str, Callable] = {}
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.pending_key = f"{self.PREFIX}:pending"
+        self.delayed_key = f"{self.PREFIX}:delayed"
+        self.dead_key = f"{self.PREFIX}:dead"
+        self.workers_key = f"{self.PREFIX}:workers"
+        self.processing_key = f"{self.PREFIX}:processing:{self.worker_id}"
+        self.heartbeat_key = f"{self.PREFIX}:heartbeat:{self.worker_id}"
+        self._local: Optional[asyncio.Queue] = None
+        self._consumers: List[asyncio.Task] = []
+        self._retries: Set[asyncio.Task] = set()
+        self._registered: Optional[asyncio.Event] = None  # Set after the first heartbeat
+
+    def task(self, name: str) -> Callable:
+        """Decorator registering a function as the task ``name``"""
+        def register(func: Callable) -> Callable:
+            self.handlers[name] = func
+            return func
+        return register
+
+    @property
+    def uses_redis(self) -> bool:
+        return settings.TASK_QUEUE_BACKEND == "redis"
+
+    def _local_queue(self) -> asyncio.Queue:
+        if self._local is None:
+            self._local = asyncio.Queue()
+        return self._local
+
+    async def enqueue(self, name: str, **kwargs) -> None:
+        """Queue a task run"""
+        job = {
+            "id": uuid.uuid4().hex,
+            "name": name,
+            "kwargs": kwargs,
+            "attempts": 0,
+            "enqueued_at": time.time(),
+        }
+        if self.uses_redis and await self.client.lpush(self.pending_key, json.dumps(job)):
+            return
+        # Redis unavailable (or local backend): run on this worker
+        self._local_queue().put_nowait(job)
+
+    async def _execute(self, job: Dict) -> None:
+        handler = self.handlers[job["name"]]
+        if inspect.iscoroutinefunction(handler):
+            call = handler(**job["kwargs"])
+        else:
+            call = asyncio.get_running_loop().run_in_executor(
+                None, functools.partial(handler, **job["kwargs"])
+            )
+        await asyncio.wait_for(call, settings.TASK_TIMEOUT)
+
+    def _retry_delay(self, job: Dict) -> Optional[float]:
+        """Seconds before the next attempt, or None once attempts are used up"""
+        if job["attempts"] >= settings.TASK_MAX_ATTEMPTS:
+            return None
+        return settings.TASK_RETRY_BACKOFF * 2 ** (job["attempts"] - 1)
+
+    def _log_failure(self, job: Dict, error: Exception, delay: Optional[float]) -> None:
+        outcome = f"retrying in {delay:.1f}s" if delay is not None else "giving up"
+        print(
+            f"Task {job['name']} ({job['id']}) failed on attempt {job['attempts']}, "
+            f"{outcome}: {type(error).__name__}: {error}"
+        )
+
+    # Redis consumer
+
+    async def _process_claimed(self, raw: str) -> None:
+        job = json.loads(raw)
+        try:
+            await self._execute(job)
+        except Exception as e:
+            job["attempts"] += 1
+            delay = self._retry_delay(job)
+            self._log_failure(job, e, delay)
+            if delay is None:
+                await self.client.eval(
+                    REQUEUE_SCRIPT, [self.processing_key, self.dead_key], [raw, json.dumps(job), ""]
+                )
+            else:
+                await self.client.eval(
+                    REQUEUE_SCRIPT,
+                    [self.processing_key, self.delayed_key],
+                    [raw, json.dumps(job), time.time() + delay],
+                )
+            return
+        await self.client.eval(ACK_SCRIPT, [self.processing_key], [raw])
+
+    async def _heartbeat(self) -> None:
+        requeued = await self.client.eval(
+            HEARTBEAT_SCRIPT,
+            [self.workers_key, self.heartbeat_key, self.pending_key],
+            [self.worker_id, int(settings.TASK_QUEUE_HEARTBEAT * 3 * 1000), self.PREFIX],
+        )
+        if requeued:
+            print(f"Task queue: requeued {requeued} jobs from stopped workers")
+
+    async def _heartbeat_loop(self) -> None:
+        """Keep this worker's heartbeat fresh, however long its jobs run"""
+        while True:
+            await self._heartbeat()
+            self._registered.set()
+            await asyncio.sleep(settings.TASK_QUEUE_HEARTBEAT)
+
+    async def _consume_redis(self) -> None:
+        # Claimed jobs are only requeued for workers that registered a heartbeat
+        await self._registered.wait()
+        while True:
+            raw = await self.client.eval(
+                CLAIM_SCRIPT,
+                [self.pending_key, self.processing_key, self.delayed_key],
+                [time.time()],
+            )
+            if raw is None:
+                await asyncio.sleep(settings.TASK_QUEUE_POLL_INTERVAL)
+                continue
+            await self._process_claimed(raw)
+
+    # In-process consumer
+
+    async def _retry_local(self, job: Dict, delay: float) -> None:
+        await asyncio.sleep(delay)
+        self._local_queue().put_nowait(job)
+
+    async def _run_local(self, job: Dict) -> None:
+        try:
+            await self._execute(job)
+        except Exception as e:
+            job["attempts"] += 1
+            delay = self._retry_delay(job)
+            self._log_failure(job, e, delay)
+            if delay is not None:
+                retry = asyncio.create_task(self._retry_local(job, delay))
+                self._retries.add(retry)
+                retry.add_done_callback(self._retries.discard)
+
+    async def _consume_local(self) -> None:
+        queue = self._local_queue()
+        while True:
+            job = await queue.get()
+            await self._run_local(job)
+
+    # Lifecycle
+
+    def start(self, redis_consumers: Optional[int] = None) -> None:
+        """Start consuming (called on application startup and by the worker)"""
+        if self._consumers:
+            return
+        if redis_consumers is None:
+            redis_consumers = settings.TASK_QUEUE_APP_WORKERS
+        if self.uses_redis and redis_consumers:
+            self._registered = asyncio.Event()
+            self._consumers.append(asyncio.create_task(self._heartbeat_loop()))
+            for _ in range(redis_consumers):
+                self._consumers.append(asyncio.create_task(self._consume_redis()))
+        self._consumers.append(asyncio.create_task(self._consume_local()))
+
+    async def stop(self) -> None:
+        """Stop consuming and finish in-process jobs (bounded by TASK_SHUTDOWN_TIMEOUT).
+
+        A Redis job interrupted here stays in this worker's processing list
+        and is requeued by another worker once the heartbeat expires.
+        """
+        for consumer in self._consumers:
+            consumer.cancel()
+        await asyncio.gather(*self._consumers, return_exceptions=True)
+        self._consumers = []
+        for retry in list(self._retries):
+            retry.cancel()
+
+        if self._local is None or self._local.empty():
+            return
+        jobs = []
+        while not self._local.empty():
+            jobs.append(self._local.get_nowait())
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(self._run_local(job) for job in jobs)),
+                settings.TASK_SHUTDOWN_TIMEOUT,
+            )
+        except asyncio.TimeoutError:
+            print("Task queue: shutdown timed out with in-process jobs unfinished")
+
+    async def stats(self) -> Dict:
+        """Queue depths"""
+        local = self._local.qsize() if self._local is not None else 0
+        if not self.uses_redis:
+            return {"backend": "local", "local": local}
+        depths = await self.client.eval(
+            "return {redis.call('LLEN', KEYS[1]), redis.call('ZCARD', KEYS[2]), "
+            "redis.call('LLEN', KEYS[3])}",
+            [self.pending_key, self.delayed_key, self.dead_key],
+            [],
+        ) or [None, None, None]
+        return {
+            "backend": "redis",
+            "pending": depths[0],
+            "delayed": depths[1],
+            "dead": depths[2],
+            "local": local,
+        }
+
+
+task_queue = TaskQueue(redis_client)
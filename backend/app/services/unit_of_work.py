@@ -0,0 +1,132 @@
+"""Unit of work for a chat turn.
+
+A turn's writes (the user message, profile fields learned from it and the
+assistant message) are collected while the turn runs and written together
+once the reply exists: one multi-row ``INSERT ... RETURNING``, one
+``UPDATE`` of the profile and a single commit, instead of a commit and a
+refresh per write. Writes stay queued until that commit succeeds. Written
+messages are then added to the user's history window in Redis, and a changed
+profile is invalidated in the profile cache. Database round trips per turn,
+how long context gathering took and which context steps were dropped are
+recorded in ``turn_stats``.
+"""
+import uuid
+from collections import Counter, deque
+from typing import Dict, List, Optional
+from sqlalchemy import insert, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.core.database import count_round_trips
+from app.models.message import Message
+from app.models.user import User
+from app.services.history_cache import history_cache
+from app.services.profile_cache import profile_cache
+
+
+class TurnStats:
+    """Rolling windows of database round trips and context-gathering time per
+    chat turn, and counts of context steps dropped for overrunning or failing"""
+
+    def __init__(self, window: int):
+        self.samples = deque(maxlen=window)
+        self.context_seconds = deque(maxlen=window)
+        self.degraded: Counter = Counter()
+        self.turns = 0
+
+    def record(self, round_trips: int) -> None:
+        self.samples.append(round_trips)
+        self.turns += 1
+
+    def record_context(self, seconds: float) -> None:
+        self.context_seconds.append(seconds)
+
+    def record_degraded(self, step: str) -> None:
+        self.degraded[step] += 1
+
+    def status(self) -> Dict:
+        return {
+            "turns": self.turns,
+            "round_trips": _summarize(self.samples),
+            "context_ms": _summarize([seconds * 1000 for seconds in self.context_seconds]),
+            "degraded_steps": dict(self.degraded),
+        }
+
+
+def _summarize(samples) -> Optional[Dict]:
+    ordered = sorted(samples)
+    if not ordered:
+        return None
+    return {
+        "mean": round(sum(ordered) / len(ordered), 2),
+        "p50": round(ordered[len(ordered) // 2], 2),
+        "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 2),
+        "max": round(ordered[-1], 2),
+    }
+
+
+turn_stats = TurnStats(settings.TURN_STATS_WINDOW)
+
+
+class TurnUnitOfWork:
+    """Pending writes of one turn, and the round trips the turn has made"""
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+        self.user: Optional[Dict] = None  # The turn's user profile (see profile_cache)
+        self.round_trips = [0]
+        self._messages: List[Dict] = []
+        self._profile: Dict[str, str] = {}
+
+    def counting(self):
+        """Count the database round trips of a block towards this turn"""
+        return count_round_trips(self.round_trips)
+
+    def add_message(self, row: Dict) -> Message:
+        """Queue a message row; returns an unsaved copy for echoing back"""
+        self._messages.append(row)
+        return Message(**row)
+
+    def update_profile(self, changes: Dict[str, str]) -> None:
+        """Queue profile fields to set on the turn's user"""
+        self._profile.update(changes)
+
+    async def commit(self) -> Dict[uuid.UUID, Message]:
+        """Write everything queued in one transaction; returns the stored messages by id.
+
+        The queue is only cleared once the transaction has committed, so
+        ``commit_pending`` can retry what a failed write left.
+        """
+        rows, profile = self._messages, self._profile
+        if not rows and not profile:
+            return {}
+
+        with self.counting():
+            stored = []
+            if rows:
+                stored = (
+                    await self.db.scalars(
+                        insert(Message).returning(Message, sort_by_parameter_order=True),
+                        rows,
+                    )
+                ).all()
+            if profile:
+                await self.db.execute(
+                    update(User).where(User.id == uuid.UUID(self.user["id"])).values(**profile)
+                )
+            await self.db.commit()
+        self._messages, self._profile = [], {}
+        await history_cache.append(stored)
+        if profile:
+            await profile_cache.invalidate(self.user["id"])
+        return {message.id: message for message in stored}
+
+    async def commit_pending(self) -> None:
+        """Write what is queued after a failed turn, so the user's message is kept"""
+        try:
+            await self.db.rollback()  # Whatever failed may have left a transaction open
+            await self.commit()
+        except Exception as e:
+            print(f"Turn write error: {e}")
+
+    def finish(self) -> None:
+        turn_stats.record(self.round_trips[0])
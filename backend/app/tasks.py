@@ -0,0 +1,76 @@
+"""Background tasks run after a reply has been sent (see app/services/task_queue.py).
+
+Delivery is at-least-once, so each task must be safe to run twice: memory
+creation deduplicates by content, embedding skips memories that have one, and
+the onboarding and summary updates recheck their condition before writing.
+"""
+import asyncio
+from typing import Dict, List
+
+from app.core.database import SessionLocal
+from app.models.message import Message
+from app.models.user import User
+from app.services.memory_service import memory_service
+from app.services.profile_cache import profile_cache
+from app.services.summary_service import summary_service
+from app.services.task_queue import task_queue
+
+
+@task_queue.task("memories.create")
+def create_memories(user_id: str, memories: List[Dict]) -> None:
+    """Store (embed and deduplicate) the memories extracted from a turn"""
+    db = SessionLocal()
+    try:
+        memory_service.create_memories(db, user_id, memories)
+    finally:
+        db.close()
+
+
+def _embed_memories(user_id: str) -> int:
+    db = SessionLocal()
+    try:
+        return memory_service.embed_user_memories(db, user_id)
+    finally:
+        db.close()
+
+
+@task_queue.task("memories.embed")
+async def embed_memories(user_id: str) -> None:
+    """Embed the user's memories stored without an embedding"""
+    try:
+        await asyncio.to_thread(_embed_memories, user_id)
+    finally:
+        await memory_service.release_embedding(user_id)
+
+
+def _complete_onboarding(user_id: str) -> bool:
+    """Mark onboarding as completed after a few exchanges; whether it was"""
+    db = SessionLocal()
+    try:
+        user = db.query(User).filter(User.id == user_id).first()
+        if not user or user.onboarding_completed:
+            return False
+        message_count = db.query(Message).filter(Message.user_id == user_id).count()
+        if message_count >= 6:  # After 3 exchanges (user + assistant messages)
+            user.onboarding_completed = True
+            db.commit()
+            return True
+        return False
+    finally:
+        db.close()
+
+
+@task_queue.task("onboarding.update")
+async def update_onboarding(user_id: str) -> None:
+    """Mark onboarding as completed after a few exchanges"""
+    if await asyncio.to_thread(_complete_onboarding, user_id):
+        await profile_cache.invalidate(user_id)
+
+
+@task_queue.task("summary.fold")
+async def fold_summary(user_id: str) -> None:
+    """Fold the user's oldest turns into their running summary"""
+    try:
+        await summary_service.fold(user_id)
+    finally:
+        await summary_service.release_fold(user_id)
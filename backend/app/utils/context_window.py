@@ -0,0 +1,27 @@
+"""Context window trimming on precomputed token counts.
+
+The cut point is found with a single reverse cumulative sum that stops at the
+first message that no longer fits, so trimming costs O(kept messages), never
+re-tokenizes, and callers get the kept history back as one slice.
+"""
+from typing import Sequence
+
+
+def history_budget(max_tokens: int, system_tokens: int = 0, response_tokens: int = 0) -> int:
+    """Tokens left for conversation history after the reserved budgets"""
+    return max(0, max_tokens - system_tokens - response_tokens)
+
+
+def find_cut_index(token_counts: Sequence[int], budget: int, min_keep: int = 1) -> int:
+    """Index of the oldest message to keep so that ``token_counts[cut:]`` fits ``budget``.
+
+    The newest ``min_keep`` messages are always kept, even if they alone exceed
+    the budget, so the message being answered is never dropped.
+    """
+    total = 0
+    n = len(token_counts)
+    for i in range(n - 1, -1, -1):
+        total += token_counts[i]
+        if total > budget and n - i > min_keep:
+            return i + 1
+    return 0
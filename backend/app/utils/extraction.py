@@ -0,0 +1,234 @@
+"""Rule engine extracting profile fields and memories from a user message.
+
+Rules are data (``RULES``): a trigger phrase plus an optional pattern that
+must follow it. All triggers are compiled into one scanner (phrases as a
+prefix trie), so a lowercased message is scanned once however many rules
+there are; a rule's pattern is only tried where its trigger was found. A
+rule can fill a profile field (the first declared rule that matches wins),
+mark the message as a memory of a category (``MEMORY_CATEGORIES``), or both.
+"""
+import re
+from dataclasses import dataclass, field as dataclass_field
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+# Category -> (memory type, importance)
+MEMORY_CATEGORIES: Dict[str, Tuple[str, float]] = {
+    "condition": ("medical", 0.9),
+    "medication": ("medical", 0.85),
+    "preference": ("preference", 0.6),
+    "fact": ("fact", 0.7),
+}
+
+# Words that follow "i'm" / "i am" but are not names
+NOT_NAMES = frozenset(
+    """
+    a an the not so very too just also really still always never now here there
+    fine good great ok okay well better worse sick ill unwell tired sleepy hungry
+    thirsty sad happy angry stressed anxious worried scared afraid nervous sorry
+    sure glad new back home from in on at with without for about over under
+    male female man woman boy girl married single pregnant diabetic allergic
+    feeling having taking going doing trying getting looking working living
+    suffering thinking wondering planning starting eating drinking sleeping
+    """.split()
+)
+
+
+def _name(value: str) -> Optional[str]:
+    value = value.lower()
+    return None if value in NOT_NAMES else value.capitalize()
+
+
+def _age(value: str) -> Optional[str]:
+    return value if 1 <= int(value) <= 120 else None
+
+
+@dataclass(frozen=True)
+class Rule:
+    """A trigger phrase, optionally followed by a pattern (group 1 is the value)"""
+
+    trigger: str  # Phrase, case-insensitive (a lowercase regex with is_regex=True)
+    pattern: str = ""  # Regex that must match right after the trigger
+    field: Optional[str] = None  # Profile field filled by the rule
+    value: Optional[str] = None  # Fixed value for the field, instead of group 1
+    transform: Optional[Callable[[str], Optional[str]]] = None  # Normalize or reject (None)
+    memory: Optional[str] = None  # Memory category the message belongs to
+    is_regex: bool = False
+
+
+def keywords(memory: str, *phrases: str) -> List[Rule]:
+    """Rules marking a message containing any of the phrases as a memory"""
+    return [Rule(phrase, memory=memory) for phrase in phrases]
+
+
+RULES: List[Rule] = [
+    # Profile (for each field, earlier rules take precedence)
+    Rule("my name is", r"\s+([a-z]+)\b", field="name", transform=_name),
+    Rule("i'm", r"\s+([a-z]+)\b", field="name", transform=_name),
+    Rule("i am", r"\s+([a-z]+)\b", field="name", transform=_name),
+    Rule("call me", r"\s+([a-z]+)\b", field="name", transform=_name),
+    Rule("i am", r"\s+(\d{1,3})\s+years?\s+old\b", field="age", transform=_age, memory="fact"),
+    Rule("i'm", r"\s+(\d{1,3})\b", field="age", transform=_age),
+    Rule(r"(\d{1,3})", r"\s+years?\s+old\b", field="age", transform=_age, is_regex=True),
+    Rule("i'm", r"\s+(?:a\s+)?(?:male|man)\b", field="gender", value="male"),
+    Rule("i am", r"\s+(?:a\s+)?(?:male|man)\b", field="gender", value="male"),
+    Rule("i'm", r"\s+(?:a\s+)?(?:female|woman)\b", field="gender", value="female"),
+    Rule("i am", r"\s+(?:a\s+)?(?:female|woman)\b", field="gender", value="female"),
+    # Memories
+    *keywords(
+        "condition",
+        "diagnosed with", "have diabetes", "have hypertension", "have asthma",
+        "suffer from", "condition",
+    ),
+    *keywords(
+        "medication",
+        "taking", "medication", "medicine", "pill", "prescription", "drug",
+    ),
+    *keywords(
+        "preference",
+        "i prefer", "i like", "i don't like", "i hate", "my favorite", "i enjoy",
+    ),
+    Rule("my name is", r"\s+\w", memory="fact"),
+    *keywords("fact", "i work as", "i live in", "my job"),
+]
+
+
+@dataclass
+class Extraction:
+    """What a message says about the user"""
+
+    profile: Dict[str, str] = dataclass_field(default_factory=dict)
+    memories: List[Dict] = dataclass_field(default_factory=list)
+
+
+_UNITS = {" ": r"\s+", "'": "['’]"}  # Any whitespace run, straight or curly apostrophe
+
+
+def _phrase_regex(phrase: str) -> str:
+    return "".join(_UNITS.get(char, re.escape(char)) for char in phrase)
+
+
+def _trie_regex(phrases: Iterable[str]) -> str:
+    """One regex matching any of the phrases (the longest at a position),
+    factored by common prefix so a failed position costs one character test"""
+    trie: Dict = {}
+    for phrase in phrases:
+        node = trie
+        for char in phrase:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def emit(node: Dict) -> str:
+        branches = [
+            _UNITS.get(char, re.escape(char)) + emit(child)
+            for char, child in sorted(node.items())
+            if char
+        ]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return f"(?:{body})?" if "" in node else body
+
+    return emit(trie)
+
+
+def _phrase_key(text: str) -> str:
+    return " ".join(text.split()).replace("’", "'")
+
+
+class ExtractionEngine:
+    """Compiled ``RULES``: one scan per message"""
+
+    def __init__(
+        self,
+        rules: Iterable[Rule] = RULES,
+        categories: Dict[str, Tuple[str, float]] = MEMORY_CATEGORIES,
+    ):
+        self.rules = list(rules)
+        self.categories = categories
+        for rule in self.rules:
+            if rule.memory is not None and rule.memory not in categories:
+                raise ValueError(f"Unknown memory category: {rule.memory}")
+
+        # Rules by trigger, in rule order. Messages are lowercased once, so
+        # phrases are matched lowercased and regex triggers must be lowercase
+        phrases: Dict[str, List[int]] = {}
+        regexes: Dict[str, List[int]] = {}
+        for index, rule in enumerate(self.rules):
+            if rule.is_regex:
+                regexes.setdefault(rule.trigger, []).append(index)
+            else:
+                phrases.setdefault(_phrase_key(rule.trigger.lower()), []).append(index)
+        # Rules without a pattern (and on a phrase) match wherever their trigger does
+        self._matchers = [
+            re.compile(
+                (rule.trigger if rule.is_regex else _phrase_regex(rule.trigger.lower()))
+                + rule.pattern
+            ).match
+            if rule.pattern or rule.is_regex
+            else None
+            for rule in self.rules
+        ]
+
+        # The scanner reports one phrase per position (the longest), so each
+        # phrase also carries the rules of the phrases it starts with
+        self._by_phrase: Dict[str, List[int]] = {
+            phrase: sorted(
+                index
+                for other, indexes in phrases.items()
+                if phrase.startswith(other)
+                for index in indexes
+            )
+            for phrase in phrases
+        }
+        self._by_group: Dict[int, List[int]] = {}
+        alternatives = [f"({_trie_regex(phrases)})" if phrases else "((?!))"]
+        group = 2
+        for regex, indexes in regexes.items():
+            self._by_group[group] = indexes
+            alternatives.append(f"({regex})")
+            group += 1 + re.compile(regex).groups
+        self._scanner = re.compile(r"\b(?:" + "|".join(alternatives) + ")")
+
+    def extract(self, message: str) -> Extraction:
+        """Profile values and memory candidates found in the message"""
+        profile: Dict[str, Tuple[int, str]] = {}  # field -> (rule index, value)
+        found: Set[str] = set()
+        text = message.lower()
+        for trigger in self._scanner.finditer(text):
+            if trigger.lastindex == 1:
+                phrase = trigger.group(1)
+                candidates = self._by_phrase.get(phrase) or self._by_phrase[_phrase_key(phrase)]
+            else:
+                candidates = self._by_group[trigger.lastindex]
+            for index in candidates:
+                rule = self.rules[index]
+                wants_field = rule.field is not None and (
+                    rule.field not in profile or profile[rule.field][0] > index
+                )
+                wants_memory = rule.memory is not None and rule.memory not in found
+                if not (wants_field or wants_memory):
+                    continue
+                matcher = self._matchers[index]
+                match = matcher(text, trigger.start()) if matcher is not None else None
+                if matcher is not None and match is None:
+                    continue
+                if wants_memory:
+                    found.add(rule.memory)
+                if wants_field:
+                    value = rule.value if rule.value is not None else match.group(1)
+                    if rule.transform is not None:
+                        value = rule.transform(value)
+                    if value is not None:
+                        profile[rule.field] = (index, value)
+
+        return Extraction(
+            profile={name: value for name, (_, value) in profile.items()},
+            memories=[
+                {"content": message, "memory_type": memory_type, "importance": importance}
+                for category, (memory_type, importance) in self.categories.items()
+                if category in found
+            ],
+        )
+
+
+extraction_engine = ExtractionEngine()
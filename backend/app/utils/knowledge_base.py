@@ -0,0 +1,273 @@
+"""File-based knowledge base of medical protocols and policies.
+
+Each protocol or policy is a Markdown file in ``PROTOCOLS_DIR`` with a short
+header::
+
+    ---
+    id: fever
+    kind: protocol
+    keywords: fever, temperature, chills
+    ---
+    **Fever Management Protocol:**
+    ...
+
+``synonyms.txt`` in the same directory lists groups of equivalent terms. The
+files are indexed in memory for BM25 ranking, with the keywords weighted above
+the body text. Only documents with a keyword in the message (every term of it,
+directly or through a synonym group) are candidates; the body text ranks them
+but never matches on its own, so small talk retrieves nothing. A search returns at most ``PROTOCOL_TOP_K`` ids, so prompts do
+not grow with the size of the library. The directory is checked for changes
+at most every ``PROTOCOL_RELOAD_INTERVAL`` seconds; the index is rebuilt and
+swapped in when a file is added, removed or edited, without restarting workers.
+"""
+import heapq
+import math
+import os
+import re
+import time
+from collections import Counter
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+
+from app.core.config import settings
+
+_WORD = re.compile(r"\w+")
+
+STOPWORDS = frozenset(
+    """a about after again all am an and any are as at be been before being but by
+    can could did do does doing for from had has have having he her here hers him
+    his how i if in into is it its just me more most my myself no nor not now of
+    off on once only or other our out over own same she should so some such than
+    that the their them then there these they this those through to too under
+    until up very was we were what when where which while who whom why will with
+    would you your yours s t d ll m re ve don""".split()
+)
+
+SYNONYMS_FILE = "synonyms.txt"
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+KEYWORD_FIELD_WEIGHT = 3  # Keywords count as this many occurrences in the text
+SYNONYM_WEIGHT = 0.5  # Query weight of terms added through a synonym group
+
+
+def _stem(word: str) -> str:
+    """Crude plural folding ("headaches" -> "headache", "allergies" -> "allergy")"""
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased, stemmed index terms of ``text``, without stopwords"""
+    return [
+        _stem(word) for word in _WORD.findall(text.lower())
+        if word not in STOPWORDS
+    ]
+
+
+class ProtocolDocument:
+    """A protocol or policy file"""
+
+    def __init__(self, doc_id: str, kind: str, keywords: List[str], text: str):
+        self.id = doc_id
+        self.kind = kind
+        self.keywords = keywords
+        self.text = text
+
+
+def parse_protocol_file(path: str) -> ProtocolDocument:
+    """Read a protocol file; the id defaults to the file name"""
+    with open(path, encoding="utf-8") as f:
+        content = f.read()
+
+    header: Dict[str, str] = {}
+    if content.startswith("---"):
+        _, raw_header, content = content.split("---", 2)
+        for line in raw_header.strip().splitlines():
+            key, _, value = line.partition(":")
+            header[key.strip().lower()] = value.strip()
+
+    return ProtocolDocument(
+        header.get("id") or os.path.splitext(os.path.basename(path))[0],
+        header.get("kind", "protocol"),
+        [keyword.strip() for keyword in header.get("keywords", "").split(",") if keyword.strip()],
+        content.strip(),
+    )
+
+
+def load_synonyms(path: str) -> List[List[str]]:
+    """Synonym groups, one comma-separated group per line ("#" starts a comment)"""
+    if not os.path.exists(path):
+        return []
+    groups = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            terms = [term.strip() for term in line.split(",") if term.strip()]
+            if len(terms) > 1:
+                groups.append(terms)
+    return groups
+
+
+class ProtocolIndex:
+    """Immutable BM25 index over a set of documents"""
+
+    def __init__(self, documents: List[ProtocolDocument], synonym_groups: List[List[str]]):
+        self.documents = {doc.id: doc for doc in documents}
+
+        term_counts = []
+        # Each keyword's terms, listed under every one of its terms
+        self.keywords: Dict[str, List[Tuple[FrozenSet[str], str]]] = {}
+        for doc in documents:
+            counts = Counter(tokenize(doc.text))
+            for keyword in doc.keywords:
+                terms = tokenize(keyword)
+                for term in terms:
+                    counts[term] += KEYWORD_FIELD_WEIGHT
+                    self.keywords.setdefault(term, []).append((frozenset(terms), doc.id))
+            term_counts.append((doc.id, counts))
+
+        # BM25 weight of each (term, document) pair, computed once
+        total = len(term_counts)
+        lengths = [sum(counts.values()) for _, counts in term_counts]
+        average_length = sum(lengths) / total if total else 0
+        document_frequency = Counter(term for _, counts in term_counts for term in counts)
+        self.postings: Dict[str, List[Tuple[str, float]]] = {}
+        for (doc_id, counts), length in zip(term_counts, lengths):
+            norm = K1 * (1 - B + B * length / average_length)
+            for term, tf in counts.items():
+                df = document_frequency[term]
+                idf = math.log(1 + (total - df + 0.5) / (df + 0.5))
+                self.postings.setdefault(term, []).append(
+                    (doc_id, idf * tf * (K1 + 1) / (tf + norm))
+                )
+
+        # Synonym phrases as term tuples, mapped to the terms of their group
+        self.synonyms: Dict[Tuple[str, ...], List[str]] = {}
+        for group in synonym_groups:
+            group_terms = [term for phrase in group for term in tokenize(phrase)]
+            for phrase in group:
+                key = tuple(tokenize(phrase))
+                if key:
+                    self.synonyms.setdefault(key, []).extend(group_terms)
+        self._max_phrase = max((len(key) for key in self.synonyms), default=0)
+
+    def _query_weights(self, message: str) -> Dict[str, float]:
+        terms = tokenize(message)
+        weights = {term: 1.0 for term in terms}
+        for start in range(len(terms)):
+            for end in range(start + 1, min(len(terms), start + self._max_phrase) + 1):
+                for term in self.synonyms.get(tuple(terms[start:end]), ()):
+                    weights.setdefault(term, SYNONYM_WEIGHT)
+        return weights
+
+    def _candidates(self, terms: Set[str]) -> Set[str]:
+        """Documents with a keyword whose terms all occur in the query"""
+        return {
+            doc_id
+            for term in terms
+            for keyword, doc_id in self.keywords.get(term, ())
+            if keyword <= terms
+        }
+
+    def search(
+        self, message: str, top_k: int, min_score: float, relative_cutoff: float
+    ) -> List[Tuple[str, float]]:
+        """Up to ``top_k`` (id, score) pairs, best first.
+
+        Only documents with a keyword in the message are scored. Those scoring
+        below ``min_score``, or below ``relative_cutoff`` times the best score,
+        are left out.
+        """
+        weights = self._query_weights(message)
+        candidates = self._candidates(set(weights))
+        if not candidates:
+            return []
+        scores: Dict[str, float] = {}
+        for term, weight in weights.items():
+            for doc_id, term_weight in self.postings.get(term, ()):
+                if doc_id in candidates:
+                    scores[doc_id] = scores.get(doc_id, 0.0) + weight * term_weight
+        if not scores:
+            return []
+
+        ranked = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+        threshold = max(min_score, ranked[0][1] * relative_cutoff)
+        return [(doc_id, score) for doc_id, score in ranked if score >= threshold]
+
+
+class KnowledgeBase:
+    """The protocol index for a directory, rebuilt when its files change"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.index = ProtocolIndex([], [])
+        self.loaded_at: Optional[float] = None
+        self._signature = None
+        self._checked_at = 0.0
+
+    def _directory_signature(self) -> Tuple:
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".md") or entry.name == SYNONYMS_FILE:
+                stat = entry.stat()
+                entries.append((entry.name, stat.st_mtime_ns, stat.st_size))
+        return tuple(sorted(entries))
+
+    def load(self) -> None:
+        """Build a new index from the directory and swap it in"""
+        signature = self._directory_signature()
+        documents = [
+            parse_protocol_file(os.path.join(self.directory, name))
+            for name, _, _ in signature
+            if name.endswith(".md")
+        ]
+        synonyms = load_synonyms(os.path.join(self.directory, SYNONYMS_FILE))
+        self.index = ProtocolIndex(documents, synonyms)
+        self._signature = signature
+        self._checked_at = time.monotonic()
+        self.loaded_at = time.time()
+
+    def maybe_reload(self) -> None:
+        """Reload if files changed (checked at most every PROTOCOL_RELOAD_INTERVAL)"""
+        now = time.monotonic()
+        if self._signature is not None and now - self._checked_at < settings.PROTOCOL_RELOAD_INTERVAL:
+            return
+        self._checked_at = now
+        try:
+            if self._directory_signature() != self._signature:
+                self.load()
+        except Exception as e:
+            # Keep serving the previous index
+            print(f"Protocol knowledge base reload error: {e}")
+
+    def search(self, message: str, top_k: Optional[int] = None) -> List[str]:
+        """Ids of the most relevant protocols and policies for a message"""
+        self.maybe_reload()
+        results = self.index.search(
+            message,
+            top_k or settings.PROTOCOL_TOP_K,
+            settings.PROTOCOL_MIN_SCORE,
+            settings.PROTOCOL_RELATIVE_CUTOFF,
+        )
+        return [doc_id for doc_id, _ in results]
+
+    def get_text(self, doc_id: str) -> Optional[str]:
+        """Text of a document (None if it was removed since it was found)"""
+        doc = self.index.documents.get(doc_id)
+        return doc.text if doc else None
+
+    def status(self) -> Dict:
+        kinds = Counter(doc.kind for doc in self.index.documents.values())
+        return {
+            "directory": self.directory,
+            "documents": dict(kinds),
+            "terms": len(self.index.postings),
+            "loaded_at": self.loaded_at,
+        }
+
+
+knowledge_base = KnowledgeBase(settings.PROTOCOLS_DIR)
@@ -0,0 +1,47 @@
+"""Dedicated background task worker.
+
+Usage:
+    python -m app.worker [--concurrency N]
+
+Consumes the Redis task queue (``TASK_QUEUE_BACKEND=redis``) alongside or
+instead of the API processes; set ``TASK_QUEUE_APP_WORKERS=0`` to keep
+background work out of the API entirely. Stops on SIGINT/SIGTERM after
+finishing in-process jobs.
+"""
+import argparse
+import asyncio
+import signal
+
+import app.tasks  # noqa: F401 (registers background tasks)
+from app.core.redis_client import redis_client
+from app.services.embedding_service import embedding_service
+from app.services.llm_providers import shutdown_executor
+from app.services.task_queue import task_queue
+
+
+async def run(concurrency: int) -> None:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    # memories.create jobs embed; load the model before consuming
+    await asyncio.to_thread(embedding_service.load)
+    task_queue.start(concurrency)
+    print(f"Task worker {task_queue.worker_id} started with {concurrency} consumers")
+    await stop.wait()
+
+    await task_queue.stop()
+    shutdown_executor()
+    await redis_client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=4, help="jobs run at once")
+    args = parser.parse_args()
+    asyncio.run(run(args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
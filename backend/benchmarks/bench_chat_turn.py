@@ -0,0 +1,92 @@
+"""End-to-end latency benchmark for chat turns.
+
+Runs ``ChatService.process_user_message`` (or, with ``--stream``,
+``stream_user_message``) against the configured database. Pair it with the
+replay provider for repeatable, offline runs:
+
+    LLM_PROVIDER=cassette LLM_CASSETTE_MODE=replay \
+        python -m benchmarks.bench_chat_turn --users 10 --turns 20
+
+Record a cassette first by running the same command with
+``LLM_CASSETTE_MODE=record`` and real API keys. Reports p50/p95/p99 turn
+latency, and time to first chunk when streaming.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+from typing import List
+
+from app.core.database import AsyncSessionLocal
+from app.services.chat_service import chat_service
+
+MESSAGES = [
+    "Hi, my name is Asha and I am 34 years old",
+    "I have had a fever since yesterday",
+    "How do I get a refund for my subscription?",
+    "I have a headache and feel tired",
+    "Is my data private?",
+    "What should I eat to stay healthy?",
+]
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def run_user(turns: int, stream: bool, latencies: List[float], first_chunks: List[float]):
+    async with AsyncSessionLocal() as db:
+        user = await chat_service.get_or_create_user(db, str(uuid.uuid4()))
+        user_id = str(user.id)
+    for turn in range(turns):
+        content = MESSAGES[turn % len(MESSAGES)]
+        started = time.perf_counter()
+        # One session per turn, as in the WebSocket handler
+        async with AsyncSessionLocal() as db:
+            if stream:
+                first_chunk = None
+                async for event in chat_service.stream_user_message(db, user_id, content):
+                    if event["type"] == "delta" and first_chunk is None:
+                        first_chunk = time.perf_counter() - started
+                        first_chunks.append(first_chunk)
+            else:
+                await chat_service.process_user_message(db, user_id, content)
+        latencies.append(time.perf_counter() - started)
+
+
+def report(name: str, samples: List[float]) -> None:
+    if not samples:
+        return
+    print(
+        f"{name:<16} n={len(samples):<5} "
+        f"mean={statistics.mean(samples) * 1000:8.1f}ms "
+        f"p50={percentile(samples, 50) * 1000:8.1f}ms "
+        f"p95={percentile(samples, 95) * 1000:8.1f}ms "
+        f"p99={percentile(samples, 99) * 1000:8.1f}ms"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Chat turn latency benchmark")
+    parser.add_argument("--users", type=int, default=5, help="Concurrent users")
+    parser.add_argument("--turns", type=int, default=10, help="Turns per user")
+    parser.add_argument("--stream", action="store_true", help="Use the streaming path")
+    args = parser.parse_args()
+
+    latencies: List[float] = []
+    first_chunks: List[float] = []
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(run_user(args.turns, args.stream, latencies, first_chunks) for _ in range(args.users))
+    )
+    elapsed = time.perf_counter() - started
+
+    print(f"{len(latencies)} turns in {elapsed:.2f}s ({len(latencies) / elapsed:.1f} turns/s)")
+    report("turn latency", latencies)
+    report("first chunk", first_chunks)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,140 @@
+"""Micro-benchmark: protocol retrieval vs. the per-keyword scan.
+
+Compares ``ProtocolIndex.search`` (BM25 over the protocol knowledge base) with
+the original implementation (lowercase the message, then one substring test
+per keyword per protocol) on the real protocol library, padded with synthetic
+protocols to ``--protocols`` entries. The retrieval examples are first checked
+against the real library alone:
+
+    python -m benchmarks.bench_protocol_matcher --protocols 1000 --iterations 20000
+"""
+import argparse
+import os
+import random
+import time
+from typing import Callable, Dict, List
+
+from app.core.config import settings
+from app.utils.knowledge_base import (
+    SYNONYMS_FILE,
+    ProtocolDocument,
+    ProtocolIndex,
+    load_synonyms,
+    parse_protocol_file,
+)
+
+# Retrieval examples: message and the ids expected from the real library
+EXAMPLES = [
+    ("I have had a fever since yesterday and my head hurts", ["headache", "fever"]),
+    ("How do I get a refund for my subscription?", ["refund_policy"]),
+    ("My stomach ache got worse after lunch, and I feel some nausea", ["stomach_ache"]),
+    ("Can you suggest a healthy lifestyle routine for someone who sits all day?", ["general_wellness"]),
+    ("My belly hurts", ["stomach_ache"]),
+    ("What is your privacy policy for my data?", ["general_policies"]),
+    # Small talk and personal details must not pull in protocols
+    ("My mom scolded me for taking a photo in the hospital", []),
+    ("I am 30 years old", []),
+    ("call me Raj", []),
+    ("I got scolded at work", []),
+    ("my friend said I should sleep more", []),
+]
+
+MESSAGES = [message for message, _ in EXAMPLES]
+
+WORDS = [
+    "rash", "itch", "dizzy", "sprain", "insomnia", "anxiety", "acne", "allergy",
+    "asthma", "bruise", "burn", "diabetes", "eczema", "fatigue", "gout", "hives",
+    "jaundice", "knee", "lupus", "mole", "numbness", "obesity", "palpitations",
+    "reflux", "sciatica", "tinnitus", "ulcer", "vertigo", "wheezing", "yeast",
+    "rest", "fluids", "doctor", "pain", "severe", "symptoms", "medication", "sleep",
+    "hydrated", "exercise", "diet", "monitor", "emergency", "dosage", "signs",
+]
+
+
+def scan(keywords_by_id: Dict[str, List[str]], message: str) -> List[str]:
+    """The original implementation: a substring test per keyword"""
+    message_lower = message.lower()
+    return [
+        protocol_id
+        for protocol_id, keywords in keywords_by_id.items()
+        if any(keyword in message_lower for keyword in keywords)
+    ]
+
+
+def build_library(size: int) -> List[ProtocolDocument]:
+    documents = [
+        parse_protocol_file(os.path.join(settings.PROTOCOLS_DIR, name))
+        for name in sorted(os.listdir(settings.PROTOCOLS_DIR))
+        if name.endswith(".md")
+    ]
+
+    rng = random.Random(42)
+    while len(documents) < size:
+        index = len(documents)
+        keywords = [f"{rng.choice(WORDS)} {rng.choice(WORDS)}" for _ in range(6)]
+        text = " ".join(rng.choice(WORDS) for _ in range(250))
+        documents.append(ProtocolDocument(f"synthetic_{index}", "protocol", keywords, text))
+    return documents
+
+
+def check_examples(index: ProtocolIndex) -> bool:
+    """Whether every example retrieves exactly its expected ids"""
+    passed = True
+    for message, expected in EXAMPLES:
+        found = [
+            doc_id
+            for doc_id, _ in index.search(
+                message,
+                settings.PROTOCOL_TOP_K,
+                settings.PROTOCOL_MIN_SCORE,
+                settings.PROTOCOL_RELATIVE_CUTOFF,
+            )
+        ]
+        if found != expected:
+            passed = False
+            print(f"MISMATCH {message!r}: expected {expected}, got {found}")
+    print(f"examples {'passed' if passed else 'FAILED'} ({len(EXAMPLES)} messages)")
+    return passed
+
+
+def timed(name: str, match: Callable[[str], List], iterations: int) -> float:
+    started = time.perf_counter()
+    for i in range(iterations):
+        match(MESSAGES[i % len(MESSAGES)])
+    per_call = (time.perf_counter() - started) / iterations
+    print(f"{name:<8} {per_call * 1e6:9.2f} us/message")
+    return per_call
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--protocols", type=int, default=1000, help="library size")
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    synonyms = load_synonyms(os.path.join(settings.PROTOCOLS_DIR, SYNONYMS_FILE))
+    check_examples(ProtocolIndex(build_library(0), synonyms))
+
+    documents = build_library(args.protocols)
+    started = time.perf_counter()
+    index = ProtocolIndex(documents, synonyms)
+    print(f"{len(documents)} protocols, {len(index.postings)} terms, index built in "
+          f"{(time.perf_counter() - started) * 1000:.1f} ms")
+
+    keywords_by_id = {doc.id: doc.keywords for doc in documents}
+    scan_time = timed("scan", lambda message: scan(keywords_by_id, message), args.iterations)
+    index_time = timed(
+        "bm25",
+        lambda message: index.search(
+            message,
+            settings.PROTOCOL_TOP_K,
+            settings.PROTOCOL_MIN_SCORE,
+            settings.PROTOCOL_RELATIVE_CUTOFF,
+        ),
+        args.iterations,
+    )
+    print(f"ratio    {scan_time / index_time:9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
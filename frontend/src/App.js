@@ -8,7 +8,7 @@ import './App.css';
 
 function App() {
   const [userId] = useState(() => getUserId());
-  const { messages, sendMessage, isConnected, isTyping } = useWebSocket(userId);
+  const { messages, sendMessage, isConnected, isTyping, history } = useWebSocket(userId);
 
   const handleSendMessage = (content) => {
     sendMessage(content);
@@ -21,6 +21,7 @@ function App() {
         messages={messages}
         isTyping={isTyping}
         userId={userId}
+        history={history}
       />
       <MessageInput
         onSendMessage={handleSendMessage}
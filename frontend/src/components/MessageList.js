@@ -4,12 +4,12 @@ import TypingIndicator from './TypingIndicator';
 import { chatAPI } from '../services/api';
 import './MessageList.css';
 
-const MessageList = ({ messages, isTyping, userId }) => {
+const MessageList = ({ messages, isTyping, userId, history }) => {
   const messagesEndRef = useRef(null);
   const messagesContainerRef = useRef(null);
-  const [page, setPage] = useState(1);
+  const [cursor, setCursor] = useState(null);
   const [loading, setLoading] = useState(false);
-  const [hasMore, setHasMore] = useState(true);
+  const [hasMore, setHasMore] = useState(false);
   const [oldMessages, setOldMessages] = useState([]);
   const [isInitialLoad, setIsInitialLoad] = useState(true);
   const prevMessagesLengthRef = useRef(0);
@@ -31,6 +31,12 @@ const MessageList = ({ messages, isTyping, userId }) => {
     }
   }, [messages, isInitialLoad]);
 
+  useEffect(() => {
+    // Older history starts where the initial load ended
+    setCursor(history.cursor);
+    setHasMore(history.hasMore);
+  }, [history]);
+
   useEffect(() => {
     // Scroll to bottom when typing indicator appears
     if (isTyping) {
@@ -39,15 +45,15 @@ const MessageList = ({ messages, isTyping, userId }) => {
   }, [isTyping]);
 
   const loadOlderMessages = async () => {
-    if (loading || !hasMore) return;
+    if (loading || !hasMore || !cursor) return;
 
     setLoading(true);
     try {
-      const result = await chatAPI.getMessages(userId, page + 1, 20);
+      const result = await chatAPI.getMessages(userId, { before: cursor, perPage: 20 });
 
       if (result.messages && result.messages.length > 0) {
         setOldMessages((prev) => [...result.messages, ...prev]);
-        setPage((prev) => prev + 1);
+        setCursor(result.before_cursor);
         setHasMore(result.has_more);
       } else {
         setHasMore(false);
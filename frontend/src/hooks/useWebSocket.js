@@ -1,5 +1,6 @@
 import { useEffect, useRef, useState, useCallback } from 'react';
 import { chatAPI } from '../services/api';
+import { generateUUID } from '../utils/storage';
 
 const WS_URL = process.env.REACT_APP_WS_URL || 'ws://localhost:8000';
 
@@ -8,9 +9,21 @@ const useWebSocket = (userId) => {
   const [isConnected, setIsConnected] = useState(false);
   const [isTyping, setIsTyping] = useState(false);
   const [initialLoadComplete, setInitialLoadComplete] = useState(false);
+  // Where older history starts, for loading it on scroll
+  const [history, setHistory] = useState({ cursor: null, hasMore: false });
   const wsRef = useRef(null);
   const reconnectTimeoutRef = useRef(null);
   const reconnectAttempts = useRef(0);
+  // Sends not answered yet (clientMessageId -> content), resent after a reconnect
+  const pendingRef = useRef(new Map());
+
+  const sendPending = (ws, clientMessageId, content) => {
+    ws.send(JSON.stringify({
+      type: 'message',
+      content,
+      client_message_id: clientMessageId,
+    }));
+  };
 
   const connect = useCallback(() => {
     if (!userId) return;
@@ -22,6 +35,11 @@ const useWebSocket = (userId) => {
         console.log('WebSocket connected');
         setIsConnected(true);
         reconnectAttempts.current = 0;
+
+        // Resend with the same ids; the server answers each message only once
+        pendingRef.current.forEach((content, clientMessageId) => {
+          sendPending(ws, clientMessageId, content);
+        });
       };
 
       ws.onmessage = (event) => {
@@ -39,7 +57,15 @@ const useWebSocket = (userId) => {
             setMessages((prev) => {
               // For user messages, replace temp message with real one
               if (data.role === 'user') {
-                const withoutTemp = prev.filter(msg => !msg.id.toString().startsWith('temp-'));
+                const withoutTemp = prev.filter(msg => (
+                  data.client_message_id
+                    ? msg.id !== `temp-${data.client_message_id}`
+                    : !msg.id.toString().startsWith('temp-')
+                ));
+                // A resent message is echoed again with the same id
+                if (withoutTemp.some(msg => msg.id === data.id)) {
+                  return withoutTemp;
+                }
                 return [...withoutTemp, newMessage];
               }
 
@@ -51,6 +77,42 @@ const useWebSocket = (userId) => {
 
               return [...prev, newMessage];
             });
+          } else if (data.type === 'message_start') {
+            // Assistant reply is being streamed - add an empty message to fill in
+            setIsTyping(false);
+            setMessages((prev) => {
+              if (prev.some(msg => msg.id === data.id)) {
+                return prev;
+              }
+              return [...prev, {
+                id: data.id,
+                role: data.role,
+                content: '',
+                created_at: new Date().toISOString(),
+                streaming: true,
+              }];
+            });
+          } else if (data.type === 'message_delta') {
+            setMessages((prev) => prev.map(msg => (
+              msg.id === data.id ? { ...msg, content: msg.content + data.content } : msg
+            )));
+          } else if (data.type === 'message_end') {
+            if (data.client_message_id) {
+              pendingRef.current.delete(data.client_message_id);
+            }
+            // Replace streamed content with the saved message
+            const finalMessage = {
+              id: data.id,
+              role: data.role,
+              content: data.content,
+              created_at: data.created_at,
+            };
+            setMessages((prev) => {
+              if (!prev.some(msg => msg.id === data.id)) {
+                return [...prev, finalMessage];
+              }
+              return prev.map(msg => (msg.id === data.id ? finalMessage : msg));
+            });
           } else if (data.type === 'typing_indicator') {
             setIsTyping(data.is_typing);
           } else if (data.type === 'error') {
@@ -86,24 +148,25 @@ const useWebSocket = (userId) => {
   }, [userId]);
 
   const sendMessage = useCallback((content) => {
-    if (wsRef.current && wsRef.current.readyState === WebSocket.OPEN) {
-      // Immediately add user message to UI for instant feedback
-      const userMessage = {
-        id: `temp-${Date.now()}`,
-        role: 'user',
-        content,
-        created_at: new Date().toISOString(),
-      };
+    // Client-generated id lets the server deduplicate resends of this message
+    const clientMessageId = generateUUID();
+    pendingRef.current.set(clientMessageId, content);
+
+    // Immediately add user message to UI for instant feedback
+    const userMessage = {
+      id: `temp-${clientMessageId}`,
+      role: 'user',
+      content,
+      created_at: new Date().toISOString(),
+    };
 
-      setMessages((prev) => [...prev, userMessage]);
+    setMessages((prev) => [...prev, userMessage]);
 
-      // Send message through WebSocket
-      wsRef.current.send(JSON.stringify({
-        type: 'message',
-        content,
-      }));
+    // Send message through WebSocket; if it is down, the message goes out on reconnect
+    if (wsRef.current && wsRef.current.readyState === WebSocket.OPEN) {
+      sendPending(wsRef.current, clientMessageId, content);
     } else {
-      console.error('WebSocket is not connected');
+      console.error('WebSocket is not connected; message will be sent on reconnect');
     }
   }, []);
 
@@ -123,10 +186,11 @@ const useWebSocket = (userId) => {
       if (!userId || initialLoadComplete) return;
 
       try {
-        const result = await chatAPI.getMessages(userId, 1, 50);
+        const result = await chatAPI.getMessages(userId, { perPage: 50 });
         if (result.messages && result.messages.length > 0) {
           setMessages(result.messages);
         }
+        setHistory({ cursor: result.before_cursor, hasMore: result.has_more });
         setInitialLoadComplete(true);
       } catch (error) {
         console.error('Error loading initial messages:', error);
@@ -151,6 +215,7 @@ const useWebSocket = (userId) => {
     sendMessage,
     isConnected,
     isTyping,
+    history,
   };
 };
 
@@ -20,16 +20,18 @@ export const chatAPI = {
     return response.data;
   },
 
-  getMessages: async (userId, page = 1, perPage = 20) => {
+  // Newest messages, or those before/after a cursor from a previous page
+  getMessages: async (userId, { before, after, perPage = 20 } = {}) => {
     const response = await api.get(`/api/chat/user/${userId}/messages`, {
-      params: { page, per_page: perPage },
+      params: { before, after, per_page: perPage },
     });
     return response.data;
   },
 
-  sendMessage: async (userId, content) => {
+  sendMessage: async (userId, content, clientMessageId = undefined) => {
     const response = await api.post(`/api/chat/user/${userId}/message`, {
       content,
+      client_message_id: clientMessageId,
     });
     return response.data;
   },